@@ -651,6 +651,9 @@ class dat_viewer():
             if self.sxm_select.value == '':
                 sxm_ref_value = self.db.db_get(self.data_ids[0],'sxm_ref')
                 if sxm_ref_value == None:
+                    # scan that contains the position of the spectrum (see db_manager.suggest_sxm_ref)
+                    sxm_ref_value = self.db.suggest_sxm_ref(self.data_ids[0])
+                if sxm_ref_value == None or sxm_ref_value not in self.all_data_ids_sxm:
                     self.data_id_sxm = self.all_data_ids_sxm[0]
                 else:
                     self.data_id_sxm = sxm_ref_value
@@ -1035,15 +1038,10 @@ class dat_viewer():
                 self.ax_sxm.set_title(title + '\n', loc='left', fontsize=8)
                 #plt.title(title + '\n', loc='left', fontsize=8)
 
-            if self.positions.value == 'Show':
-                print('ERROR when trying to display multiple positions')
-                for (s,c) in zip(all_plotted_dat_data_ids,all_plotted_dat_data_ids_colors):
-                    # print('all_plotted_dat_data_ids',all_plotted_dat_data_ids)
-                    # print('type(all_plotted_dat_data_ids)',type(all_plotted_dat_data_ids))
-                    # print('all_plotted_dat_data_ids_colors',all_plotted_dat_data_ids_colors)
-                    # print('type(all_plotted_dat_data_ids_colors)',type(all_plotted_dat_data_ids_colors))
-                    (x,y) = spmpy.relative_position(sxm,self.db.db_data[s])
-                    self.ax_sxm.plot(x,y,'o',color = c)
+            if self.positions.value == 'Show' and len(all_plotted_dat_data_ids) > 0:
+                # positions of all plotted spectra in one call (from the metadata, see db_manager.spectrum_positions)
+                positions = spmpy.relative_positions(sxm,self.db.spectrum_positions(all_plotted_dat_data_ids))
+                self.ax_sxm.scatter(positions[:,0],positions[:,1],marker='o',color=all_plotted_dat_data_ids_colors)
 
         if self.display_legend.value == 'Show':
             handles = []
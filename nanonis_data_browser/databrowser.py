@@ -7,6 +7,7 @@ import databrowser_dat_viewer
 import dat_viewer
 import sxm_viewer
 import helpers
+import prerender_service
 
 import importlib
 importlib.reload(databrowser_sxm_viewer)
@@ -18,6 +19,8 @@ dat_viewer = dat_viewer.dat_viewer
 importlib.reload(sxm_viewer)
 sxm_viewer = sxm_viewer.sxm_viewer
 importlib.reload(helpers)
+importlib.reload(prerender_service)
+prerender_service = prerender_service.prerender_service
 copy_to_clipboard_powershell = helpers.copy_to_clipboard_powershell
 
 
@@ -39,6 +42,14 @@ class databrowser():
             self.sort_by = kwargs['sort_by']
         else:
             self.sort_by = 'Time Inverse'
+        if 'prerender_workers' in kwargs:
+            prerender_workers = kwargs['prerender_workers']
+        else:
+            prerender_workers = None
+        if 'prerender_visible' in kwargs:
+            self.prerender_visible = kwargs['prerender_visible'] # number of the first tiles whose thumbnails are rendered first
+        else:
+            self.prerender_visible = 24
 
         # Profiling ON or OFF
         self.profiling = False
@@ -47,6 +58,16 @@ class databrowser():
         if len(list(self.db.db_prop['data_prop'].keys())) == 0:
             self.widgets = ipw.HTML(value="databrowser.__init__: db.db_data['data_prop'] is empty. No database initalized?")
             return
+
+        # Thumbnails are rendered in the background (see prerender_service), the service of a previous databrowser is stopped
+        if self.db.prerender_service != None:
+            self.db.prerender_service.stop()
+        if prerender_workers != None:
+            self.prerender_service = prerender_service(self.db,workers=prerender_workers,callback=self.prerender_done)
+        else:
+            self.prerender_service = prerender_service(self.db,callback=self.prerender_done)
+        self.db.prerender_service = self.prerender_service
+        self.prerender_service.start()
         
         # Create widgets
         self.create_widgets()
@@ -93,10 +114,12 @@ class databrowser():
         # Sort Options
         self.html_sort_options = ipw.HTML(value='Sort Options:')
 
-        self.sort_dropdown = ipw.Dropdown(options=['Name','Name Inverse','Time','Time Inverse','Tags','Tags Inverse','Selected Tags','Checked','Liked','Disliked'],value=self.sort_by,description='',disabled=False,layout=ipw.Layout(width='120px'))
+        self.sort_options = ['Name','Name Inverse','Time','Time Inverse','Tags','Tags Inverse','Selected Tags','Checked','Liked','Disliked','Metadata']
+        self.sort_dropdown = ipw.Dropdown(options=self.sort_options+self.metadata_category_options(),value=self.sort_by,description='',disabled=False,layout=ipw.Layout(width='120px'))
         self.sort_dropdown.observe(self.tag_list_refresh, names='value')
     
         self.selected_tags_only = ipw.SelectMultiple(options=[],value=[],description='',disabled=True,layout=ipw.Layout(width='120px',height='100px'))
+        self.metadata_query = ipw.Text(value='',placeholder='e.g. abs(V) < 0.05 and temperature < 6 sort time desc',description='',disabled=True,layout=ipw.Layout(width='300px',visibility='hidden'))
 
         self.sort_execute = ipw.Button(description='Sort',disabled=False,tooltip='Execute Sorting',layout=ipw.Layout(width='60px'))
         self.sort_execute.on_click(self.sort)
@@ -133,9 +156,9 @@ class databrowser():
         self.metadata_category_add_button = ipw.Button(description='',icon='plus',disabled=False,tooltip='Add new category',layout=ipw.Layout(width='60px'))
         self.metadata_category_add_button.on_click(self.metadata_category_add)
         self.metadata_add_show = False
-        self.metadata_tags = ipw.TagsInput(placeholder='Tags',description='',disabled=False,layout=ipw.Layout(width='120px'))
+        self.metadata_tags = ipw.TagsInput(value=list(self.db.metadata_categories().keys()),placeholder='Categories',description='',disabled=False,layout=ipw.Layout(width='120px'))
         self.metadata_tags.observe(self.metadata_tags_change, names='value')
-        self.metadata_condition = ipw.Text(value='',placeholder='Condition e.g. "filename_substring_ = XXX" or "fchannel = XXX"',description='',disabled=True,layout=ipw.Layout(width='180px',visibility='hidden'))
+        self.metadata_condition = ipw.Text(value='',placeholder='Condition e.g. "abs(V) < 0.05 and temperature < 6"',description='',disabled=True,layout=ipw.Layout(width='180px',visibility='hidden'))
         self.metadata_category_name = ipw.Text(value='',placeholder='Category Name',description='',disabled=True,layout=ipw.Layout(width='180px',visibility='hidden'))
 
         self.data_browser_options = ipw.VBox([self.html_options,
@@ -145,6 +168,7 @@ class databrowser():
                                               ipw.VBox([self.html_sort_options,
                                                         ipw.HBox([self.sort_dropdown,self.sort_execute])]),
                                                         self.selected_tags_only,
+                                                        self.metadata_query,
                                               ipw.VBox([self.html_selected_options,
                                                         ipw.HBox([self.button_check_all,self.button_uncheck_all]),
                                                         ipw.HBox([self.tag_input,self.button_add_tag,self.button_delete_tag]),
@@ -170,6 +194,7 @@ class databrowser():
         
         # Create Item Viewers Widgets
         self.databrowser_items = {}
+        self.databrowser_items_position = None # {data_id:position in self.databrowser_items}, see displayed_ids
         self.databrowser_init_items = {} # Initalized classes
         
         for data_id in list(self.db.db_get('super','data_id_time_sorted',super_prop=True)):
@@ -179,13 +204,13 @@ class databrowser():
 
             try:
                 if self.db.db_get(data_id,'filename_ending') == 'sxm':
-                    viewer_sxm = databrowser_sxm_viewer(data_id,self.db,prerender=True)
+                    viewer_sxm = databrowser_sxm_viewer(data_id,self.db,prerender=True,placeholder=True)
                     self.databrowser_init_items.update({data_id:viewer_sxm})
                     viewer_sxm_widgets = viewer_sxm.widgets
                     self.databrowser_items.update({data_id:viewer_sxm_widgets})
 
                 if self.db.db_get(data_id,'filename_ending') == 'dat':
-                    viewer_dat = databrowser_dat_viewer(data_id,self.db,prerender=True)
+                    viewer_dat = databrowser_dat_viewer(data_id,self.db,prerender=True,placeholder=True)
                     self.databrowser_init_items.update({data_id:viewer_dat})
                     viewer_dat_widgets = viewer_dat.widgets
                     self.databrowser_items.update({data_id:viewer_dat_widgets})
@@ -200,6 +225,9 @@ class databrowser():
                 time_line = str(data_id) + ": " + f"{iteration_time:.2f}" + " ms.\n"
                 all_times += time_line
 
+        # Thumbnails of the placeholders (newest first, the first tiles are moved forward by sort_and_display_viewers)
+        self.prerender_service.submit(self.placeholder_ids(self.databrowser_init_items.keys()),priority='background')
+
         if self.profiling:
             print(all_times)
             print(f"Average time: {sum(times_list)/len(times_list):.2f} ms.")
@@ -214,6 +242,11 @@ class databrowser():
 
         self.sort_viewers()
 
+        # Thumbnails of the first tiles are rendered first
+        widget_data_ids = {id(widgets):data_id for data_id,widgets in self.databrowser_items.items()}
+        first_data_ids = [widget_data_ids.get(id(widgets)) for widgets in self.databrowser_items_list[:self.prerender_visible]]
+        self.prerender_service.prioritize(first_data_ids,priority='visible')
+
         self.all_viewer_widgets = ipw.VBox(children=self.databrowser_items_list,
                                       layout=ipw.Layout(display='flex-wrap',flex_flow='row wrap',justify_content='space-between',height='700px', overflow_y='auto',width='1000px'))
         self.widgets = ipw.HBox([self.all_viewer_widgets,
@@ -233,6 +266,8 @@ class databrowser():
             - Checked (Only)
             - Liked (Only)
             - Not Liked (Only)
+            - Metadata (Only the elements that match self.metadata_query, see db_metadata)
+            - Category: <category_name> (Only the elements that match the saved metadata category)
         """
         if self.sort_dropdown.value == 'Name' or self.sort_dropdown.value == 'Name Inverse':
 
@@ -261,13 +296,10 @@ class databrowser():
             # Get all the data_ids
             data_ids = list(self.databrowser_init_items.keys())
 
-            # Get the file modified date for each data_id
-            data_time_list = []
-            for data_id in data_ids:
-                data_time_list.append(self.db.db_get(data_id,'file_modified_date'))
-
-            # Sort the data_id by time
-            data_id_time_sorted = [x for x, _ in sorted(zip(data_ids, data_time_list), key=lambda pair: pair[1])]
+            # data_ids in time order (time index of the database), data_ids without a time at the end
+            data_id_time_sorted = [data_id for data_id in self.db.db_time_index.sorted_ids() if data_id in self.databrowser_init_items]
+            data_id_time_sorted_set = set(data_id_time_sorted)
+            data_id_time_sorted = data_id_time_sorted + [data_id for data_id in data_ids if data_id not in data_id_time_sorted_set]
 
             if self.sort_dropdown.value == 'Time Inverse':
                 data_id_time_sorted.reverse()
@@ -280,23 +312,19 @@ class databrowser():
 
         if self.sort_dropdown.value == 'Tags' or self.sort_dropdown.value == 'Tags Inverse':
             
-            # Get all the data_ids
-            data_ids = list(self.databrowser_init_items.keys())
-
-            # Get the tag for each data_id
-            data_tag_list = []
-            for data_id in data_ids:
-                data_tag_list.append(self.db.db_get(data_id,'tags'))
-            
-            # Find unique tags
-            unique_tags = list(set([item for sublist in data_tag_list for item in sublist]))
+            # Find the tags of the displayed data_ids (tag index of the database)
+            unique_tags = []
+            tag_ids = {}
+            for tag in self.db.db_index.all_tags():
+                ids = self.displayed_ids(self.db.db_index.ids_with_tag(tag))
+                if len(ids) > 0:
+                    unique_tags.append(tag)
+                    tag_ids.update({tag:ids})
             unique_tags.sort() # Sort alphabetically
 
             tag_sorted_ids = []
             for tag in unique_tags:
-                for id in data_ids:
-                    if tag in self.db.db_get(id,"tags"):
-                        tag_sorted_ids.append(id)
+                tag_sorted_ids.extend(tag_ids[tag])
             
             if self.sort_dropdown.value == 'Tags Inverse':
                 tag_sorted_ids.reverse()
@@ -308,21 +336,10 @@ class databrowser():
 
         if self.sort_dropdown.value == 'Selected Tags':
             
-            # Get all the data_ids
-            data_ids = list(self.databrowser_init_items.keys())
-
             # Find the data_ids of the elements that have the selected tags
-            selected_tag_ids = []
             selected_tags = self.selected_tags_only.value
             selected_tags = list(selected_tags)
-
-            for data_id in data_ids:
-                print(self.db.db_get(data_id,'tags'))
-                for selected_tag in selected_tags:
-                    if selected_tag in self.db.db_get(data_id,'tags'):
-                        selected_tag_ids.append(data_id)
-
-            unique_selected_tag_ids = list(set(selected_tag_ids))
+            unique_selected_tag_ids = self.displayed_ids(self.db.db_index.ids_with_any_tag(selected_tags))
             
             # Output the selected tags
             self.databrowser_items_list = []
@@ -331,14 +348,8 @@ class databrowser():
 
         if self.sort_dropdown.value == 'Checked':
 
-            # Get all the data_ids
-            data_ids = list(self.databrowser_init_items.keys())
-
             # Find the data_ids of the elements that have been checked
-            checked_ids = []
-            for data_id in data_ids:
-                if self.db.db_get(data_id,'checked'):
-                    checked_ids.append(data_id)
+            checked_ids = self.displayed_ids(self.db.db_index.checked())
 
             # Output the checked data_ids
             self.databrowser_items_list = []
@@ -347,14 +358,8 @@ class databrowser():
             
         if self.sort_dropdown.value == 'Liked':
 
-            # Get all the data_ids
-            data_ids = list(self.databrowser_init_items.keys())
-
             # Find the data_ids of the elements that have been liked
-            liked_ids = []
-            for data_id in data_ids:
-                if self.db.db_get(data_id,'liked'):
-                    liked_ids.append(data_id)
+            liked_ids = self.displayed_ids(self.db.db_index.liked())
             
             # Output the liked data_ids
             self.databrowser_items_list = []
@@ -367,23 +372,65 @@ class databrowser():
             data_ids = list(self.databrowser_init_items.keys())
 
             # Find the data_ids of the elements that have been disliked
-            disliked_ids = []
-            for data_id in data_ids:
-                if self.db.db_get(data_id,'liked') == False:
-                    disliked_ids.append(data_id)
+            liked_ids = self.db.db_index.liked_ids
+            disliked_ids = [data_id for data_id in data_ids if data_id not in liked_ids]
 
             # Output the disliked data_ids
             self.databrowser_items_list = []
             for data_id in disliked_ids:
                 self.databrowser_items_list.append(self.databrowser_items[data_id])
             
+        if self.sort_dropdown.value == 'Metadata' or self.sort_dropdown.value.startswith('Category: '):
+
+            # Find the data_ids that match the metadata expression (in the order of its sort key)
+            if self.sort_dropdown.value == 'Metadata':
+                expression = self.metadata_query.value
+            else:
+                expression = self.db.metadata_categories().get(self.sort_dropdown.value[len('Category: '):],'')
+            metadata_ids = self.db.metadata_query(expression)
+            if metadata_ids == None:
+                metadata_ids = []
+            if self.metadata_dropdown.value != 'All':
+                ending_ids = self.db.db_index.ending_ids.get(self.metadata_dropdown.value,{})
+                metadata_ids = [data_id for data_id in metadata_ids if data_id in ending_ids]
+
+            # Output the matching data_ids
+            self.databrowser_items_list = []
+            for data_id in metadata_ids:
+                if data_id in self.databrowser_items:
+                    self.databrowser_items_list.append(self.databrowser_items[data_id])
+            
     ### Callbacks ###
 
     def metadata_dropdown_change(self,change):
-        print('databrowser.metadata_dropdown_change: Not implemented yet.')
+        """Restricts the metadata sorting and the categories to the selected file type."""
+        if self.sort_dropdown.value == 'Metadata' or self.sort_dropdown.value.startswith('Category: '):
+            self.sort_and_display_viewers()
 
     def metadata_tags_change(self,change):
-        print('databrowser.metadata_tags_change: Not implemented yet.')
+        """Deletes the metadata categories that were removed from self.metadata_tags."""
+        categories = self.db.metadata_categories()
+        for category_name in categories.keys():
+            if category_name not in change['new']:
+                self.db.metadata_category_write(category_name,None)
+        if [category_name for category_name in change['new'] if category_name not in categories] != []:
+            print('databrowser.metadata_tags_change: New categories are added with the + button (category name and condition).')
+        self.metadata_categories_refresh()
+
+    def metadata_categories_refresh(self):
+        """Updates the category tags and the category sort options from the database."""
+        category_names = list(self.db.metadata_categories().keys())
+        if list(self.metadata_tags.value) != category_names:
+            self.metadata_tags.value = category_names
+        options = self.sort_options + self.metadata_category_options()
+        if list(self.sort_dropdown.options) != options:
+            value = self.sort_dropdown.value
+            self.sort_dropdown.options = options
+            if value in options:
+                self.sort_dropdown.value = value
+
+    def metadata_category_options(self):
+        return ['Category: '+category_name for category_name in self.db.metadata_categories().keys()]
 
     def metadata_category_add(self,change):
         if self.metadata_add_show == False:
@@ -394,16 +441,28 @@ class databrowser():
             self.metadata_condition.layout.visibility = 'visible'
             self.metadata_category_add_button.tooltip = 'Submit new category'
         else:
+            # Save the new category if the condition is valid
+            category_name = self.metadata_category_name.value.strip()
+            condition = self.metadata_condition.value.strip()
+            if category_name != '' and condition != '':
+                if self.db.metadata_query(condition) == None:
+                    print('databrowser.metadata_category_add: Category not saved, the condition is not valid.')
+                    return
+                self.db.metadata_category_write(category_name,condition)
+                self.metadata_categories_refresh()
+                self.metadata_category_name.value = ''
+                self.metadata_condition.value = ''
+            elif category_name != '' or condition != '':
+                print('databrowser.metadata_category_add: Category not saved, a category name and a condition are needed.')
             self.metadata_add_show = False
             self.metadata_category_name.disabled = True
             self.metadata_category_name.layout.visibility = 'hidden'
             self.metadata_condition.disabled = True
             self.metadata_condition.layout.visibility = 'hidden'
             self.metadata_category_add_button.tooltip = 'Add new category'
-        print('databrowser.metadata_category_add: Not implemented yet.')
 
     def save_db(self,change):
-        self.db.save_db(self.db.directory,with_data=True,overwrite=True)
+        self.db.save_db_async(self.db.directory,with_data=True,overwrite=True)
 
     def refresh_db(self,change):
         """Checks the filepath for new files, adds them to the database and adds the viewers to the databrowser."""
@@ -411,7 +470,7 @@ class databrowser():
         # Update the database
         new_data = self.db.update(self.db.directory)
         
-        if new_data == False:
+        if new_data == True:
             print('databrowser.refresh_db: New data found.')
             self.refresh_viewers()
         else:
@@ -419,8 +478,18 @@ class databrowser():
     
     def refresh_viewers(self):
         """ Updates the databrowser viewers with the new data."""
-        # Check which data_ids are not yet displayed
+        # Remove viewers of deleted (or renamed) data_ids and of modified files (they are created again)
         all_data_ids = self.db.db_get_all_ids()
+        modified_data_ids = []
+        if self.db.directory_diff_last != None:
+            modified_data_ids = [d_meta['filename_full'] for d_meta in self.db.directory_diff_last['modified']]
+        all_data_ids_set = set(all_data_ids)
+        for data_id in list(self.databrowser_items.keys()):
+            if data_id not in all_data_ids_set or data_id in modified_data_ids:
+                self.databrowser_items.pop(data_id)
+                self.databrowser_init_items.pop(data_id,None)
+
+        # Check which data_ids are not yet displayed
         all_displayed_data_ids = list(self.databrowser_items.keys())
         new_data_ids = []
         for data_id in all_data_ids:
@@ -430,20 +499,33 @@ class databrowser():
         # Create new viewers for the new data_ids
         for data_id in new_data_ids:
             if self.db.db_get(data_id,'filename_ending') == 'sxm':
-                viewer_sxm = databrowser_sxm_viewer(data_id,self.db,prerender=True)
+                viewer_sxm = databrowser_sxm_viewer(data_id,self.db,prerender=True,placeholder=True)
                 self.databrowser_init_items.update({data_id:viewer_sxm})
                 viewer_sxm_widgets = viewer_sxm.widgets
                 self.databrowser_items.update({data_id:viewer_sxm_widgets})
 
             if self.db.db_get(data_id,'filename_ending') == 'dat':
-                viewer_dat = databrowser_dat_viewer(data_id,self.db,prerender=True)
+                viewer_dat = databrowser_dat_viewer(data_id,self.db,prerender=True,placeholder=True)
                 self.databrowser_init_items.update({data_id:viewer_dat})
                 viewer_dat_widgets = viewer_dat.widgets
                 self.databrowser_items.update({data_id:viewer_dat_widgets})
+        self.prerender_service.submit(self.placeholder_ids(new_data_ids),priority='new')
         
+        self.databrowser_items_position = None
+
         # Sort the data_ids according to the current sorting and update the display
         self.sort_and_display_viewers()
 
+    def placeholder_ids(self,data_ids):
+        """Returns the data_ids whose viewers show a placeholder instead of their thumbnail"""
+        return [data_id for data_id in data_ids if data_id in self.databrowser_init_items and self.databrowser_init_items[data_id].placeholder_shown]
+
+    def prerender_done(self,data_id,key,image_bytes):
+        """Callback of the prerender_service (worker threads): replaces the placeholder of data_id with its thumbnail"""
+        viewer = self.databrowser_init_items.get(data_id)
+        if viewer != None and viewer.placeholder_shown:
+            viewer.show_prerender(key,image_bytes)
+
     def refresh_properties(self,change):
         """Loads the likebutton and tag properties from the database and updates the widgets."""
 
@@ -463,10 +545,7 @@ class databrowser():
         """Provides a list of all tags in the database and updates the self.selected_tags_only"""
 
         # Update the display
-        all_tags = []
-        for key in self.databrowser_items.keys():
-            all_tags.append(self.db.db_get(key,'tags'))
-        all_tags = list(set([item for sublist in all_tags for item in sublist]))
+        all_tags = [tag for tag in self.db.db_index.all_tags() if len(self.displayed_ids(self.db.db_index.ids_with_tag(tag))) > 0]
         all_tags.sort()
         self.selected_tags_only.options = all_tags
         if self.sort_dropdown.value == 'Selected Tags':
@@ -477,6 +556,13 @@ class databrowser():
             self.selected_tags_only.disabled = True
             self.selected_tags_only.layout.visibility = 'hidden'
 
+        if self.sort_dropdown.value == 'Metadata':
+            self.metadata_query.disabled = False
+            self.metadata_query.layout.visibility = 'visible'
+        else:
+            self.metadata_query.disabled = True
+            self.metadata_query.layout.visibility = 'hidden'
+
     def check_all(self,change):
         """Sets the display_proptery 'checked' to True for all databrowser_items. And updates the checkbox."""
         for key in self.databrowser_items.keys():
@@ -496,13 +582,8 @@ class databrowser():
     def add_tag(self,change):
         """Read which data_id are selected and adds the tag to the corresponding database entries."""
 
-        all_keys = list(self.databrowser_items.keys())
-
         # Read which data_ids are selected
-        selected_keys = []
-        for key in all_keys:
-            if self.db.db_get(key,'checked')==True:
-                selected_keys.append(key)
+        selected_keys = self.displayed_ids(self.db.db_index.checked())
         
         if selected_keys == []:
             print('databrowser.delete_tag: No data_id selected.')
@@ -527,13 +608,8 @@ class databrowser():
 
         print('databrowser.delete_tag: Does delete the tag from the database. But is unable to update the ipywidgets.TagsInput widget.')
 
-        all_keys = list(self.databrowser_items.keys())
-
         # Read which data_ids are selected
-        selected_keys = []
-        for key in all_keys:
-            if self.db.db_get(key,'checked')==True:
-                selected_keys.append(key)
+        selected_keys = self.displayed_ids(self.db.db_index.checked())
 
         if selected_keys == []:
             print('databrowser.delete_tag: No data_id selected.')
@@ -556,13 +632,8 @@ class databrowser():
     def like(self,change):
         """Reads which data_id are selected and likes the corresponding database entries."""
         
-        all_keys = list(self.databrowser_items.keys())
-
         # Read which data_ids are selected
-        selected_keys = []
-        for key in all_keys:
-            if self.db.db_get(key,'checked')==True:
-                selected_keys.append(key)
+        selected_keys = self.displayed_ids(self.db.db_index.checked())
             
         if selected_keys == []:
             print('databrowser.like: No data_id selected.')
@@ -578,13 +649,8 @@ class databrowser():
     def unlike(self,change):
         """Reads which data_id are selected and unlikes the corresponding database entries."""
             
-        all_keys = list(self.databrowser_items.keys())
-
         # Read which data_ids are selected
-        selected_keys = []
-        for key in all_keys:
-            if self.db.db_get(key,'checked')==True:
-                selected_keys.append(key)
+        selected_keys = self.displayed_ids(self.db.db_index.checked())
             
         if selected_keys == []:
             print('databrowser.like: No data_id selected.')
@@ -600,10 +666,8 @@ class databrowser():
     def export_png(self,change):
         """Exports the png of all selected data_ids to the filepath of the database."""
         
-        selected_keys = []
-        for key in list(self.databrowser_items.keys()):
-            if self.db.db_get(key,'checked')==True:
-                selected_keys.append(key)
+        # Read which data_ids are selected
+        selected_keys = self.displayed_ids(self.db.db_index.checked())
         
         if selected_keys == []:
             print('databrowser.export_png: No data_id selected.')
@@ -613,10 +677,8 @@ class databrowser():
     def copy_png(self,change):
         """Copies the png of all selected data_ids to the clipboard."""
 
-        selected_keys = []
-        for key in list(self.databrowser_items.keys()):
-            if self.db.db_get(key,'checked')==True:
-                selected_keys.append(key)
+        # Read which data_ids are selected
+        selected_keys = self.displayed_ids(self.db.db_index.checked())
         
         if selected_keys == []:
             print('databrowser.copy_png: No data_id selected.')
@@ -645,6 +707,16 @@ class databrowser():
 
 
 
+    ### Helper Functions ###
+
+    def displayed_ids(self,data_ids:list):
+        """Returns the data_ids that have a viewer in the databrowser, in the order of self.databrowser_items"""
+        position = self.databrowser_items_position
+        if position == None:
+            position = {data_id:i for i,data_id in enumerate(self.databrowser_items.keys())}
+            self.databrowser_items_position = position
+        return sorted([data_id for data_id in data_ids if data_id in position],key=position.get)
+
     ### External Functions ###
 
     def get_all_initailized_viewers(self):
@@ -4,6 +4,7 @@ import checkbox
 import likebutton
 import tagging
 from helpers import fname_generator, tempdir_maker
+import thumbnail
 
 
 
@@ -31,6 +32,10 @@ from IPython.display import Image, display
 class databrowser_dat_viewer():
     """
     Small DAT Viewer for the Data Browser
+
+    'prerender' is a boolean that determines if the image is prerendered or not.
+    'placeholder' is a boolean: if True and the image is not prerendered yet, a placeholder is shown until the
+    prerender_service renders the image (see show_prerender).
     """
     def __init__(self,data_id:str,db,**kwargs):
 
@@ -49,6 +54,12 @@ class databrowser_dat_viewer():
         else:
             self.prerender = False
 
+        if 'placeholder' in kwargs:
+            self.placeholder = kwargs['placeholder']
+        else:
+            self.placeholder = False
+        self.placeholder_shown = False
+
         # Create widgets
         self.create_widgets()
         self.update_plot(None)
@@ -157,6 +168,13 @@ class databrowser_dat_viewer():
         self.parameter_print()
         self.write_display_properties()
 
+    def show_prerender(self,key,image_bytes):
+        """Shows a thumbnail of the prerender_service (called from its worker threads) if key are the selected channels"""
+        if key == thumbnail.prerender_key('dat',(self.selector_xchannel.value,self.selector_ychannel.value)):
+            self.outdat.clear_output(wait=True)
+            self.outdat.append_display_data(Image(data=image_bytes))
+            self.placeholder_shown = False
+
     ### Plotting ###
 
     def parameter_print(self):
@@ -209,7 +227,31 @@ class databrowser_dat_viewer():
         else:
             run_plot = True
 
-        if run_plot == True:
+        if run_plot == True and self.placeholder == True:
+            # The thumbnail is rendered in the background (see prerender_service and show_prerender)
+            with self.outdat:
+                self.outdat.clear_output(wait=True)
+                display(Image(data=thumbnail.placeholder(str(self.data_id))))
+            self.placeholder_shown = True
+            run_plot = False
+        self.placeholder = False
+
+        if run_plot == True and self.prerender == True:
+            # Render the thumbnail without a matplotlib figure and save it to the prerender cache (see thumbnail)
+            selector_xchannel_value = self.selector_xchannel.value
+            selector_ychannel_value = self.selector_ychannel.value
+            if selector_xchannel_value in self.db.db_get(self.data_id,'channel_names') and selector_ychannel_value in self.db.db_get(self.data_id,'channel_names'):
+                image_bytes = thumbnail.dat_thumbnail(self.db.db_get_data(self.data_id),selector_xchannel_value,selector_ychannel_value,
+                                                      title=str(self.data_id))
+                prerender_key = thumbnail.prerender_key('dat',(selector_xchannel_value,selector_ychannel_value))
+                thumbnail.write_prerender(self.db,self.data_id,prerender_key,image_bytes,tempdir_maker(self.db))
+                with self.outdat:
+                    self.outdat.clear_output(wait=True)
+                    display(Image(data=image_bytes))
+            else:
+                print('X or Y channel ',selector_xchannel_value,selector_ychannel_value,' in ',self.data_id, ' not found')
+
+        elif run_plot == True:
 
             # Set up the plot figure and axes
 
@@ -242,24 +284,6 @@ class databrowser_dat_viewer():
             
             plt.title(str(self.data_id),fontsize=8)
 
-            # Create prerender image and save path to database
-            if self.prerender == True:
-
-                # Save plot as png to tempdir
-                tempdir = tempdir_maker(self.db)
-                new_filename = fname_generator(tempdir,'temp_dat_', 'png')
-                prerender_path = tempdir+'/'+new_filename
-                self.fig_combined.savefig(prerender_path, dpi=100, bbox_inches='tight')
-
-                # Save prerender_path to database
-                current_prerender = self.db.db_get(self.data_id,'prerender')
-                if current_prerender == None:
-                    current_prerender = {}
-
-                prerender_key = "("+selector_xchannel_value+","+selector_ychannel_value+")"
-                current_prerender.update({prerender_key:prerender_path})
-                self.db.db_write(self.data_id,'prerender',current_prerender)
-                
             #self.out_com.clear_output()
             with self.outdat:
                 plt.show()
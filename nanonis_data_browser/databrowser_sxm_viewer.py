@@ -5,6 +5,7 @@ import checkbox
 import likebutton
 import tagging
 from helpers import fname_generator, tempdir_maker
+import thumbnail
 
 # Libraries for plotting
 import matplotlib.pyplot as plt
@@ -36,6 +37,8 @@ class databrowser_sxm_viewer():
 
     'parameter_print_names' is a list of strings that will be used to print the parameters in the parameter area.
     'prerender' is a boolean that determines if the image is prerendered or not.
+    'placeholder' is a boolean: if True and the image is not prerendered yet, a placeholder is shown until the
+    prerender_service renders the image (see show_prerender).
     """
     def __init__(self,data_id:str,db,**kwargs):
 
@@ -54,6 +57,12 @@ class databrowser_sxm_viewer():
         else:
             self.prerender = False
 
+        if 'placeholder' in kwargs:
+            self.placeholder = kwargs['placeholder']
+        else:
+            self.placeholder = False
+        self.placeholder_shown = False
+
         # Create widgets
         self.create_widgets()
         self.update_plot(None)
@@ -160,6 +169,13 @@ class databrowser_sxm_viewer():
         self.parameter_print()
         #self.write_display_properties()
 
+    def show_prerender(self,key,image_bytes):
+        """Shows a thumbnail of the prerender_service (called from its worker threads) if key is the selected channel"""
+        if key == thumbnail.prerender_key('sxm',self.channel_selector.value):
+            self.outsxm.clear_output(wait=True)
+            self.outsxm.append_display_data(Image(data=image_bytes))
+            self.placeholder_shown = False
+
     ### Plotting ###
 
     def parameter_print(self):
@@ -229,7 +245,25 @@ class databrowser_sxm_viewer():
             # Do plot
             run_plot = True
 
-        if run_plot == True:
+        if run_plot == True and self.placeholder == True:
+            # The thumbnail is rendered in the background (see prerender_service and show_prerender)
+            with self.outsxm:
+                self.outsxm.clear_output(wait=True)
+                display(Image(data=thumbnail.placeholder(str(self.data_id))))
+            self.placeholder_shown = True
+            run_plot = False
+        self.placeholder = False
+
+        if run_plot == True and self.prerender == True:
+            # Render the thumbnail without a matplotlib figure and save it to the prerender cache (see thumbnail)
+            image_bytes = thumbnail.sxm_thumbnail(self.sxm,self.channel_selector.value,direction=self.sxm_direction,
+                                                  offset=self.sxm_offset,title=str(self.data_id))
+            thumbnail.write_prerender(self.db,self.data_id,self.channel_selector.value,image_bytes,tempdir_maker(self.db))
+            with self.outsxm:
+                self.outsxm.clear_output(wait=True)
+                display(Image(data=image_bytes))
+
+        elif run_plot == True:
             # Plot Parameters
             direction = 'forward'
             direction = self.sxm_direction
@@ -277,22 +311,6 @@ class databrowser_sxm_viewer():
             #cbar.set_label('%s (%s)' % (self.selector_channel.value,chUnit))
             plt.title(str(self.data_id),fontsize=8)
 
-            if self.prerender == True:
-
-                # Save plot as png to tempdir
-                tempdir = tempdir_maker(self.db)
-                new_filename = fname_generator(tempdir,'temp_sxm_', 'png')
-                prerender_path = tempdir+'/'+new_filename
-                fig_sxm.savefig(prerender_path, dpi=100, bbox_inches='tight')
-
-                # Save path to prerender
-                current_prerender = self.db.db_get(self.data_id,'prerender')
-                if current_prerender == None:
-                    current_prerender = {}
-
-                current_prerender.update({self.channel_selector.value:prerender_path})
-                self.db.db_write(self.data_id,'prerender',current_prerender)
-
             with self.outsxm:
                 plt.show()
         
@@ -0,0 +1,248 @@
+"""
+Description:    memory-mapped array store for db_data of the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import os
+import pickle
+from collections.abc import Mapping
+import numpy as np
+import sys
+sys.path.append('K:/Labs205/labs/THz-STM/Software/spmpy')
+import spmpy_terry as spmpy
+
+
+class db_array_store():
+    """
+    db_array_store writes the signals of all spm objects in db_data as contiguous arrays into one container file
+    and keeps a small index with offsets, shapes, dtypes and units of every array.
+
+    Reopening the store does not read any array: the container is memory-mapped on the first access of a signal
+    and every signal is a view into the mapping (no copy).
+
+    Input:
+        path_base: str (path without file ending, e.g. directory+'\\_database_data')
+
+    Files:
+        path_base + '.bin': container with all arrays (appended, aligned to self.alignment bytes)
+        path_base + '.index': pickled index {data_id:{'path','name','type','header','signals','units'},...}
+            signals = {ChannelName:{'forward':(offset,shape,dtype),'backward':(offset,shape,dtype)},...} for .sxm
+            signals = {ChannelName:(offset,shape,dtype),...} for .dat
+
+    External Functions:
+        write(db_data): Appends the arrays of all spm objects that are not yet stored, returns db_data with mapped spm objects
+        load_db_data(): Returns db_data with mapped spm objects
+        is_stored(data_id,spm_object): True if spm_object is already mapped from this store
+    """
+
+    alignment = 64
+    index_version = 1
+
+    def __init__(self,path_base:str):
+        self.path_base = path_base
+        self.path_bin = path_base + '.bin'
+        self.path_index = path_base + '.index'
+        self.index = self.read_index()
+        self.mmap = None
+
+    ### Index ###
+
+    def read_index(self):
+        """Reads the index file (empty index if it does not exist)"""
+        if not os.path.isfile(self.path_index):
+            return {}
+        with open(self.path_index,'rb') as handle:
+            index_group = pickle.load(handle)
+        if index_group.get('index_version') != self.index_version:
+            print('db_array_store.read_index: index version not supported: ',self.path_index)
+            return {}
+        return index_group['index']
+
+    def write_index(self):
+        """Writes the index to a temporary file and replaces the index file"""
+        path_tmp = self.path_index + '.tmp'
+        with open(path_tmp,'wb') as handle:
+            pickle.dump({'index_version':self.index_version,'index':self.index},handle,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path_tmp,self.path_index)
+
+    ### Write ###
+
+    def write(self,db_data:dict):
+        """
+        Appends the signals of every spm object in db_data that is not yet stored in this container.
+
+        Input:
+            db_data: dict {data_id:spm,...}
+        Output:
+            db_data_mapped: dict {data_id:spm,...} with spm objects reading from the container
+        """
+        db_data_mapped = dict(db_data)
+        db_data_mapped.update(self.write_items(db_data.items()))
+        return db_data_mapped
+
+    def write_items(self,items):
+        """
+        Appends the signals of the spm objects of items that are not yet stored in this container, one at a time
+        (items can be a generator that loads the spm objects, see db_manager.save_db_data_mmap).
+
+        Input:
+            items: iterable of (data_id,spm)
+        Output:
+            db_data_mapped: dict {data_id:spm,...} of the written spm objects, reading from the container
+        """
+        written_data_ids = []
+        with open(self.path_bin,'ab') as handle:
+            for data_id,spm_object in items:
+                if self.is_stored(data_id,spm_object):
+                    continue
+                entry = self.write_spm(handle,spm_object)
+                if entry != None:
+                    self.index.update({data_id:entry})
+                    written_data_ids.append(data_id)
+            handle.flush()
+            os.fsync(handle.fileno())
+        if len(written_data_ids) > 0:
+            self.write_index()
+        return {data_id:self.get_spm(data_id) for data_id in written_data_ids}
+
+    def write_spm(self,handle,spm_object):
+        """
+        Appends all signals of spm_object to the open container handle.
+
+        Output:
+            entry: dict for the index (None if spm_object could not be stored)
+        """
+        try:
+            signals = spm_object.napImport.signals
+            header = spm_object.napImport.header
+        except AttributeError:
+            print('db_array_store.write_spm: spm object without signals: ',spm_object)
+            return None
+
+        entry = {'path':spm_object.path,'name':spm_object.name,'type':spm_object.type,'header':header,'signals':{},'units':{}}
+        for signal in spm_object.SignalsList:
+            entry['units'].update({signal['ChannelName']:signal['ChannelUnit']})
+
+        for channel_name in signals.keys():
+            if spm_object.type == 'scan':
+                entry['signals'].update({channel_name:{}})
+                for direction in signals[channel_name].keys():
+                    entry['signals'][channel_name].update({direction:self.write_array(handle,signals[channel_name][direction])})
+            else:
+                entry['signals'].update({channel_name:self.write_array(handle,signals[channel_name])})
+        return entry
+
+    def write_array(self,handle,array):
+        """
+        Appends array (C-contiguous) at the next aligned offset.
+
+        Output:
+            (offset,shape,dtype)
+        """
+        array = np.ascontiguousarray(array)
+        offset = handle.tell()
+        padding = (-offset) % self.alignment
+        if padding:
+            handle.write(b'\0'*padding)
+            offset += padding
+        handle.write(array.tobytes())
+        return (offset,array.shape,array.dtype.str)
+
+    ### Read ###
+
+    def mapped(self,end:int):
+        """Returns the memory-mapped container, remapped if it does not cover the byte position end"""
+        if self.mmap is None or len(self.mmap) < end:
+            self.mmap = np.memmap(self.path_bin,dtype=np.uint8,mode='r')
+        return self.mmap
+
+    def get_array(self,array_entry):
+        """Returns a read-only view into the container for (offset,shape,dtype)"""
+        offset,shape,dtype = array_entry
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape))*dtype.itemsize
+        if nbytes == 0:
+            return np.zeros(shape,dtype=dtype)
+        return np.ndarray(shape,dtype=dtype,buffer=self.mapped(offset+nbytes),offset=offset)
+
+    def get_spm(self,data_id:str):
+        """Returns an spm object whose signals are mapped from the container"""
+        entry = self.index[data_id]
+        spm_object = spmpy.spm(entry['path'],napImport=db_array_import(self,data_id))
+        spm_object.path = entry['path']
+        spm_object.name = entry['name']
+        return spm_object
+
+    def load_db_data(self):
+        """
+        Returns db_data for all data_ids in the index. No array is read before it is accessed.
+
+        Output:
+            db_data: dict {data_id:spm,...}
+        """
+        db_data = {}
+        for data_id in self.index.keys():
+            db_data.update({data_id:self.get_spm(data_id)})
+        return db_data
+
+    def is_stored(self,data_id:str,spm_object):
+        """True if spm_object is already mapped from this container"""
+        if data_id not in self.index:
+            return False
+        napImport = getattr(spm_object,'napImport',None)
+        return isinstance(napImport,db_array_import) and napImport.path_base == self.path_base
+
+
+class db_array_import():
+    """
+    Replacement for the nanonispy import object of an spm object (.header and .signals).
+    .signals has the same structure as in nanonispy, the arrays are views into the memory-mapped container
+    of db_array_store that are created on the first access of each channel.
+
+    Input:
+        store: db_array_store
+        data_id: str
+    """
+
+    def __init__(self,store:db_array_store,data_id:str):
+        self.store = store
+        self.path_base = store.path_base
+        self.data_id = data_id
+        self.header = store.index[data_id]['header']
+        self.signals = db_array_signals(store,data_id)
+
+    def __getstate__(self):
+        # Views into the mapping are not pickled, the container is reopened on the next access
+        return {'path_base':self.path_base,'data_id':self.data_id}
+
+    def __setstate__(self,state):
+        self.__init__(db_array_store(state['path_base']),state['data_id'])
+
+
+class db_array_signals(Mapping):
+    """
+    Read-only mapping {ChannelName:array} (.dat) or {ChannelName:{'forward':array,'backward':array}} (.sxm)
+    that maps the arrays of a single channel on its first access.
+    """
+
+    def __init__(self,store:db_array_store,data_id:str):
+        self.store = store
+        self.entry = store.index[data_id]
+        self.mapped_signals = {}
+
+    def __getitem__(self,channel_name):
+        if channel_name not in self.mapped_signals:
+            array_entries = self.entry['signals'][channel_name]
+            if self.entry['type'] == 'scan':
+                signal = {direction:self.store.get_array(array_entry) for direction,array_entry in array_entries.items()}
+            else:
+                signal = self.store.get_array(array_entries)
+            self.mapped_signals.update({channel_name:signal})
+        return self.mapped_signals[channel_name]
+
+    def __iter__(self):
+        return iter(self.entry['signals'])
+
+    def __len__(self):
+        return len(self.entry['signals'])
@@ -0,0 +1,259 @@
+"""
+Description:    memory-budgeted LRU cache for db_data of the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import numpy as np
+import spmpy_terry as spmpy
+from db_array_store import db_array_import, db_array_signals
+
+
+def spm_nbytes(spm_object):
+    """
+    Returns the bytes of the signal arrays that are loaded (or mapped) by spm_object.
+    spm objects whose data is not read yet (.sxm before mapping, .dat imported with lazy=True) count 0 bytes.
+    The processed channels of get_channel (see spmpy_terry.channel_cache) are counted as well.
+    """
+    signals = getattr(getattr(spm_object,'napImport',None),'signals',None)
+    if isinstance(signals,spmpy.dat_fast_signals):
+        signals = signals.loaded_signals
+    elif isinstance(signals,(db_array_signals,spmpy.sxm_mmap_signals)):
+        signals = signals.mapped_signals
+    channel_cache = getattr(spm_object,'channel_cache',None)
+    return signals_nbytes(signals) + (channel_cache.nbytes if channel_cache is not None else 0)
+
+
+def signals_nbytes(signals):
+    if isinstance(signals,np.ndarray):
+        return signals.nbytes
+    if isinstance(signals,dict):
+        return sum(signals_nbytes(value) for value in list(signals.values()))
+    return 0
+
+
+def close_spm(spm_object):
+    """Drops the memory mapping of a removed or evicted spm object, such that its file can be renamed or deleted (Windows)"""
+    if hasattr(spm_object,'close'):
+        spm_object.close()
+
+
+class db_data_cache(MutableMapping):
+    """
+    db_data_cache is the dict {data_id:spm} of db_manager.db_data with a memory budget.
+
+    The loaded signal arrays of every spm object are counted (see spm_nbytes). If the sum exceeds memory_limit,
+    the least recently used spm objects are evicted. An evicted data_id stays in the mapping and is reloaded with
+    loader(data_id,store) on its next access: store is the db_array_store the evicted object was mapped from
+    (remapped from the container) or None (read again from the file). Evicted and removed spm objects are closed
+    (see spmpy_terry.spm.close), open memory mappings would block renaming and deleting their files on Windows.
+
+    The data of an spm object is usually read after it was returned (e.g. by the first get_channel of a lazy
+    import), therefore the last returned object is measured again on the next access of the cache.
+
+    Optional Arguments:
+        memory_limit: int, bytes (default: None, no limit)
+        loader: function(data_id,store) -> spm (default: None, evicted objects cannot be reloaded and are not evicted)
+
+    External Functions:
+        reset(db_data): Replaces all entries by the dict db_data
+        replace(data_id,spm_object_old,spm_object_new): Replaces a resident spm object (e.g. by its stored version)
+        evicted_store(data_id): Returns the db_array_store of an evicted data_id
+        set_memory_limit(memory_limit): Changes the memory budget (and evicts if needed)
+        stats(): Returns the hit, miss, eviction and memory statistics
+    """
+
+    def __init__(self,db_data:dict=None,**kwargs):
+        if 'memory_limit' in kwargs: self.memory_limit = kwargs['memory_limit']
+        else: self.memory_limit = None
+        if 'loader' in kwargs: self.loader = kwargs['loader']
+        else: self.loader = None
+
+        self.lock = threading.RLock()
+        self.data_ids = {} # all data_ids (ordered set)
+        self.resident = OrderedDict() # {data_id:spm} in the order of their last access
+        self.evicted = {} # {data_id:store or None}
+        self.sizes = {} # {data_id:bytes} of resident spm objects
+        self.resident_bytes = 0
+        self.last_data_id = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if db_data != None:
+            self.update(db_data)
+
+    def reset(self,db_data:dict):
+        """Replaces all entries by db_data (memory limit and statistics are kept)"""
+        with self.lock:
+            self.data_ids.clear()
+            self.resident.clear()
+            self.evicted.clear()
+            self.sizes.clear()
+            self.resident_bytes = 0
+            self.last_data_id = None
+            for data_id,spm_object in db_data.items():
+                self.insert(data_id,spm_object)
+            self.enforce_memory_limit()
+
+    def set_memory_limit(self,memory_limit):
+        """Sets the memory budget in bytes (None: no limit)"""
+        with self.lock:
+            self.memory_limit = memory_limit
+            self.measure(self.last_data_id)
+            self.enforce_memory_limit()
+
+    ### Mapping ###
+
+    def __getitem__(self,data_id):
+        with self.lock:
+            if data_id != self.last_data_id:
+                self.measure(self.last_data_id)
+            if data_id in self.resident:
+                self.hits += 1
+                self.resident.move_to_end(data_id)
+            elif data_id in self.evicted:
+                self.misses += 1
+                try:
+                    spm_object = self.loader(data_id,self.evicted[data_id])
+                except Exception as e:
+                    print('db_data_cache: Error: could not reload '+str(data_id)+': ',e)
+                    raise KeyError(data_id)
+                self.evicted.pop(data_id)
+                self.resident.update({data_id:spm_object})
+                self.sizes.update({data_id:0})
+            else:
+                raise KeyError(data_id)
+            self.last_data_id = data_id
+            self.measure(data_id)
+            self.enforce_memory_limit()
+            return self.resident[data_id]
+
+    def __setitem__(self,data_id,spm_object):
+        with self.lock:
+            self.insert(data_id,spm_object)
+            self.enforce_memory_limit()
+
+    def __delitem__(self,data_id):
+        with self.lock:
+            if data_id not in self.data_ids:
+                raise KeyError(data_id)
+            self.data_ids.pop(data_id)
+            self.evicted.pop(data_id,None)
+            if data_id in self.resident:
+                close_spm(self.resident.pop(data_id))
+                self.resident_bytes -= self.sizes.pop(data_id)
+            if self.last_data_id == data_id:
+                self.last_data_id = None
+
+    def pop(self,data_id,*default):
+        # Without loading an evicted spm object
+        with self.lock:
+            if data_id not in self.data_ids:
+                if len(default) > 0:
+                    return default[0]
+                raise KeyError(data_id)
+            spm_object = self.resident.get(data_id)
+            del self[data_id]
+            return spm_object
+
+    def replace(self,data_id,spm_object_old,spm_object_new):
+        """Replaces the resident spm_object_old of data_id by spm_object_new (no effect if data_id holds another object)"""
+        with self.lock:
+            if self.resident.get(data_id) is spm_object_old:
+                self.resident[data_id] = spm_object_new
+                self.measure(data_id)
+                close_spm(spm_object_old)
+                self.enforce_memory_limit()
+
+    def evicted_store(self,data_id):
+        """Returns the db_array_store an evicted data_id is remapped from (None if it is resident or read from its file)"""
+        with self.lock:
+            return self.evicted.get(data_id)
+
+    def __contains__(self,data_id):
+        return data_id in self.data_ids
+
+    def __iter__(self):
+        return iter(list(self.data_ids))
+
+    def __len__(self):
+        return len(self.data_ids)
+
+    ### Memory budget ###
+
+    def insert(self,data_id,spm_object):
+        if data_id in self.data_ids:
+            del self[data_id]
+        self.data_ids.update({data_id:None})
+        self.resident.update({data_id:spm_object})
+        self.sizes.update({data_id:0})
+        self.measure(data_id)
+
+    def measure(self,data_id):
+        """Counts the bytes of the resident spm object data_id again"""
+        if data_id not in self.resident:
+            return
+        nbytes = spm_nbytes(self.resident[data_id])
+        self.resident_bytes += nbytes - self.sizes[data_id]
+        self.sizes[data_id] = nbytes
+
+    def enforce_memory_limit(self):
+        """Evicts the least recently used spm objects until the resident bytes are below the memory limit"""
+        if self.memory_limit == None or self.loader == None or self.resident_bytes <= self.memory_limit:
+            return
+        for data_id in list(self.resident.keys()):
+            if self.resident_bytes <= self.memory_limit:
+                break
+            if data_id == self.last_data_id or self.sizes[data_id] == 0:
+                continue
+            spm_object = self.resident.pop(data_id)
+            napImport = getattr(spm_object,'napImport',None)
+            self.evicted.update({data_id:napImport.store if isinstance(napImport,db_array_import) else None})
+            close_spm(spm_object)
+            self.resident_bytes -= self.sizes.pop(data_id)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Output:
+            stats: dict {'hits','misses','evictions','resident','evicted','resident_bytes','memory_limit'}
+        """
+        with self.lock:
+            self.measure(self.last_data_id)
+            return {'hits':self.hits,'misses':self.misses,'evictions':self.evictions,
+                    'resident':len(self.resident),'evicted':len(self.evicted),
+                    'resident_bytes':self.resident_bytes,'memory_limit':self.memory_limit}
+
+
+class db_data_stream():
+    """
+    db_data_stream is pickled like the dict {data_id:spm} of data_ids in db_data, but the spm objects are taken from
+    db_data (evicted ones are reloaded) and materialized (see spmpy_terry.spm.materialized) one at a time while they
+    are pickled, such that db_data is never loaded completely. It is unpickled as a dict.
+
+    Input:
+        db_data: db_data_cache (or dict)
+        data_ids: list of data_id
+
+    External Functions:
+        items(): Generator of (data_id, materialized spm), data_ids that cannot be loaded are skipped
+    """
+
+    def __init__(self,db_data,data_ids):
+        self.db_data = db_data
+        self.data_ids = data_ids
+        self.written_data_ids = [] # data_ids that were pickled
+
+    def __reduce__(self):
+        return (dict,(),None,None,self.items())
+
+    def items(self):
+        for data_id in self.data_ids:
+            spm_object = self.db_data.get(data_id)
+            if spm_object is None:
+                continue
+            self.written_data_ids.append(data_id)
+            yield data_id,spm_object.materialized()
@@ -0,0 +1,100 @@
+"""
+Description:    directory diff engine for the db_manager of the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import hashlib
+
+
+def directory_diff(db_meta_old:list,db_meta_new:list,**kwargs):
+    """
+    Compares the stored file index db_meta_old with the file index of the directory db_meta_new.
+    Files are matched by filename_full with a dict index. Files that disappeared and files that appeared with
+    the same filename_ending, file_size and file_modified_date (a rename keeps both) are matched as renames.
+
+    Input:
+        db_meta_old: db_meta [{filename_full, filename_ending, file_size, file_modified_date, (file_hash)},...]
+        db_meta_new: db_meta [{path, filename_full, filename_ending, file_size, file_modified_date},...]
+
+    Optional Arguments:
+        content_hash: function(d_meta_new) -> hash. If given, a rename candidate is only accepted if its hash
+                      equals the 'file_hash' of the old file (old files without 'file_hash' are not checked).
+                      The hash is only computed for rename candidates.
+
+    Output:
+        diff = {'added':[d_meta_new,...],
+                'modified':[d_meta_new,...],            same filename, different file_size or file_modified_date
+                'deleted':[d_meta_old,...],
+                'renamed':[(d_meta_old,d_meta_new),...],
+                'unchanged':int}
+    """
+    if 'content_hash' in kwargs:
+        content_hash = kwargs['content_hash']
+    else:
+        content_hash = None
+
+    diff = {'added':[],'modified':[],'deleted':[],'renamed':[],'unchanged':0}
+
+    db_meta_old_index = {d_meta['filename_full']:d_meta for d_meta in db_meta_old}
+    filenames_new = set()
+    for d_meta_new in db_meta_new:
+        filename = d_meta_new['filename_full']
+        filenames_new.add(filename)
+        d_meta_old = db_meta_old_index.get(filename)
+        if d_meta_old == None:
+            diff['added'].append(d_meta_new)
+        elif d_meta_old['file_size'] != d_meta_new['file_size'] or d_meta_old['file_modified_date'] != d_meta_new['file_modified_date']:
+            diff['modified'].append(d_meta_new)
+        else:
+            diff['unchanged'] += 1
+    diff['deleted'] = [d_meta for d_meta in db_meta_old if d_meta['filename_full'] not in filenames_new]
+
+    # Renames: pair deleted and added files with the same signature
+    if len(diff['deleted']) > 0 and len(diff['added']) > 0:
+        added_by_signature = {}
+        for d_meta_new in diff['added']:
+            added_by_signature.setdefault(file_signature(d_meta_new),[]).append(d_meta_new)
+
+        renamed_new = set()
+        deleted = []
+        for d_meta_old in diff['deleted']:
+            candidates = [d_meta_new for d_meta_new in added_by_signature.get(file_signature(d_meta_old),[])
+                          if d_meta_new['filename_full'] not in renamed_new]
+            if content_hash != None and d_meta_old.get('file_hash') != None:
+                candidates = [d_meta_new for d_meta_new in candidates if content_hash(d_meta_new) == d_meta_old['file_hash']]
+            if len(candidates) > 0:
+                diff['renamed'].append((d_meta_old,candidates[0]))
+                renamed_new.add(candidates[0]['filename_full'])
+            else:
+                deleted.append(d_meta_old)
+        diff['deleted'] = deleted
+        diff['added'] = [d_meta_new for d_meta_new in diff['added'] if d_meta_new['filename_full'] not in renamed_new]
+
+    return diff
+
+
+def diff_is_empty(diff:dict):
+    """True if directory_diff found no added, modified, deleted or renamed files"""
+    return len(diff['added']) == 0 and len(diff['modified']) == 0 and len(diff['deleted']) == 0 and len(diff['renamed']) == 0
+
+
+def file_signature(d_meta:dict):
+    """Signature that is kept when a file is renamed"""
+    return (d_meta['filename_ending'],d_meta['file_size'],d_meta['file_modified_date'])
+
+
+def file_content_hash(path:str):
+    """
+    Returns the blake2b hash (hex) of the content of the file at path.
+
+    Input:
+        path: str
+    Output:
+        file_hash: str
+    """
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(path,'rb') as handle:
+        for block in iter(lambda: handle.read(1024*1024),b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
@@ -0,0 +1,124 @@
+"""
+Description:    secondary indexes on db_prop for the db_manager of the python based Nanonis data browser
+
+"""
+
+
+class db_index():
+    """
+    db_index keeps secondary indexes of db_prop['data_prop'] that are updated by db_manager.db_write and db_delete,
+    such that queries by tag, like, checked state and file ending do not scan all data_ids.
+
+    The sets of data_ids are dicts {data_id:None} (ordered sets, in the order the data_ids were indexed).
+    The tags of every data_id are kept as a copy, because the list in db_prop may be changed in place before db_write.
+
+    Indexes:
+        tag_ids = {tag:{data_id:None,...},...}
+        liked_ids = {data_id:None,...}
+        checked_ids = {data_id:None,...}
+        ending_ids = {filename_ending:{data_id:None,...},...}
+
+    External Functions:
+        rebuild(db_prop): Indexes all data_ids of db_prop['data_prop']
+        update(data_id,display_property,display_property_value): Called by db_write
+        remove(data_id): Called by db_delete
+        ids_with_tag(tag), ids_with_any_tag(tags), tag_counts(), all_tags()
+        liked(), checked(), ids_with_ending(filename_ending)
+    """
+
+    indexed_properties = ['tags','liked','checked','filename_ending']
+
+    def __init__(self):
+        self.tag_ids = {}
+        self.data_id_tags = {}
+        self.liked_ids = {}
+        self.checked_ids = {}
+        self.ending_ids = {}
+        self.data_id_ending = {}
+
+    def rebuild(self,db_prop:dict):
+        """Indexes all data_ids of db_prop['data_prop'] (after db_prop was replaced)"""
+        self.__init__()
+        for data_id,d_prop in db_prop['data_prop'].items():
+            for display_property in self.indexed_properties:
+                if display_property in d_prop:
+                    self.update(data_id,display_property,d_prop[display_property])
+
+    ### Update ###
+
+    def update(self,data_id,display_property:str,display_property_value):
+        """Updates the index of display_property for data_id (other display properties are ignored)"""
+        if display_property == 'tags':
+            self.update_tags(data_id,display_property_value)
+        elif display_property == 'liked':
+            self.update_set(self.liked_ids,data_id,display_property_value == True)
+        elif display_property == 'checked':
+            self.update_set(self.checked_ids,data_id,display_property_value == True)
+        elif display_property == 'filename_ending':
+            old_ending = self.data_id_ending.get(data_id)
+            if old_ending != None:
+                self.ending_ids.get(old_ending,{}).pop(data_id,None)
+            self.data_id_ending.update({data_id:display_property_value})
+            self.ending_ids.setdefault(display_property_value,{}).update({data_id:None})
+
+    def update_tags(self,data_id,tags):
+        old_tags = self.data_id_tags.get(data_id,())
+        new_tags = tuple(tags) if tags != None else ()
+        for tag in old_tags:
+            if tag not in new_tags:
+                ids = self.tag_ids.get(tag,{})
+                ids.pop(data_id,None)
+                if len(ids) == 0:
+                    self.tag_ids.pop(tag,None)
+        for tag in new_tags:
+            self.tag_ids.setdefault(tag,{}).update({data_id:None})
+        self.data_id_tags.update({data_id:new_tags})
+
+    def update_set(self,ids:dict,data_id,is_member:bool):
+        if is_member:
+            ids.update({data_id:None})
+        else:
+            ids.pop(data_id,None)
+
+    def remove(self,data_id):
+        """Removes data_id from all indexes"""
+        self.update_tags(data_id,())
+        self.data_id_tags.pop(data_id,None)
+        self.liked_ids.pop(data_id,None)
+        self.checked_ids.pop(data_id,None)
+        old_ending = self.data_id_ending.pop(data_id,None)
+        if old_ending != None:
+            self.ending_ids.get(old_ending,{}).pop(data_id,None)
+
+    ### Queries ###
+
+    def ids_with_tag(self,tag:str):
+        """Returns the list of data_ids with tag"""
+        return list(self.tag_ids.get(tag,{}))
+
+    def ids_with_any_tag(self,tags):
+        """Returns the list of data_ids with at least one of tags (each data_id once)"""
+        ids = {}
+        for tag in tags:
+            ids.update(self.tag_ids.get(tag,{}))
+        return list(ids)
+
+    def tag_counts(self):
+        """Returns {tag:number of data_ids with tag}"""
+        return {tag:len(ids) for tag,ids in self.tag_ids.items()}
+
+    def all_tags(self):
+        """Returns all tags (in the order they were first used)"""
+        return list(self.tag_ids)
+
+    def liked(self):
+        """Returns the list of liked data_ids"""
+        return list(self.liked_ids)
+
+    def checked(self):
+        """Returns the list of checked data_ids"""
+        return list(self.checked_ids)
+
+    def ids_with_ending(self,filename_ending:str):
+        """Returns the list of data_ids with filename_ending (e.g. 'sxm' or 'dat')"""
+        return list(self.ending_ids.get(filename_ending,{}))
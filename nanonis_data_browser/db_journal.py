@@ -0,0 +1,189 @@
+"""
+Description:    append-only change journal of db_write for the db_manager of the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import os
+import pickle
+import struct
+
+
+class db_journal():
+    """
+    db_journal appends every db_write to a journal file next to the database snapshot (self.database_file).
+
+    The first record of the journal identifies the snapshot it belongs to (db_prop['super']['db_save_time'] of the snapshot)
+    and, while the snapshot is being written, its parent snapshot: {'snapshot':snapshot_id,'parent':parent_snapshot_id}.
+    If the new snapshot never reaches the disk, the records are replayed on top of the parent snapshot and its journal.
+    All following records are (db_base, data_id, display_property, display_property_value) for db_write
+    or (db_base, data_id) for the deletion of data_id.
+    Every record is written as 4 byte length (little endian) + pickle, such that a record truncated by a crash is detected
+    and dropped on the next open.
+
+    Input:
+        path: str (path of the journal file)
+
+    External Functions:
+        reset(snapshot_id,parent_snapshot_id=None): Starts a new (empty) journal for the snapshot snapshot_id
+        open_append(snapshot_id): Opens an existing journal of snapshot_id for appending (returns False if it does not match)
+        append(db_base,data_id,display_property,display_property_value): Appends a record
+        append_delete(db_base,data_id): Appends the deletion of data_id
+        sync(): Flushes and fsyncs the journal
+        header(): Returns the first record of the journal file
+        read(snapshot_id): Returns all records if the journal belongs to snapshot_id
+        replay(db_prop,snapshot_id,child=False): Applies all records to db_prop
+        size(): Size of the journal in bytes
+        close()
+    """
+
+    header_struct = struct.Struct('<I')
+
+    def __init__(self,path:str):
+        self.path = path
+        self.handle = None
+
+    ### Write ###
+
+    def reset(self,snapshot_id,parent_snapshot_id=None):
+        """
+        Starts a new journal for the snapshot snapshot_id (an existing journal is discarded).
+        parent_snapshot_id is the snapshot on disk until snapshot_id is written.
+        """
+        self.close()
+        self.handle = open(self.path,'wb')
+        self.write_record({'snapshot':snapshot_id,'parent':parent_snapshot_id})
+        self.sync()
+
+    def open_append(self,snapshot_id):
+        """
+        Opens the journal for appending, if it belongs to snapshot_id. A truncated last record is removed.
+
+        Output:
+            bool: True if the journal was opened
+        """
+        self.close()
+        if not os.path.isfile(self.path):
+            return False
+        records,valid_size = self.read_records()
+        if len(records) == 0 or records[0].get('snapshot') != snapshot_id:
+            return False
+        self.handle = open(self.path,'r+b')
+        self.handle.truncate(valid_size)
+        self.handle.seek(valid_size)
+        return True
+
+    def append(self,db_base:str,data_id,display_property:str,display_property_value):
+        """Appends a single db_write to the journal and hands it to the operating system"""
+        if self.handle == None:
+            return
+        self.write_record((db_base,data_id,display_property,display_property_value))
+        self.handle.flush()
+
+    def append_delete(self,db_base:str,data_id):
+        """Appends the deletion of data_id to the journal and hands it to the operating system"""
+        if self.handle == None:
+            return
+        self.write_record((db_base,data_id))
+        self.handle.flush()
+
+    def write_record(self,record):
+        record_bytes = pickle.dumps(record,protocol=pickle.HIGHEST_PROTOCOL)
+        self.handle.write(self.header_struct.pack(len(record_bytes))+record_bytes)
+
+    def sync(self):
+        """Flushes and fsyncs the journal"""
+        if self.handle != None:
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+
+    ### Read ###
+
+    def read_records(self):
+        """
+        Reads all complete records of the journal file.
+
+        Output:
+            records: list
+            valid_size: int (bytes up to the end of the last complete record)
+        """
+        records = []
+        valid_size = 0
+        with open(self.path,'rb') as handle:
+            journal_bytes = handle.read()
+        position = 0
+        while position + self.header_struct.size <= len(journal_bytes):
+            (record_size,) = self.header_struct.unpack_from(journal_bytes,position)
+            record_end = position + self.header_struct.size + record_size
+            if record_end > len(journal_bytes):
+                break
+            try:
+                records.append(pickle.loads(journal_bytes[position+self.header_struct.size:record_end]))
+            except Exception:
+                break
+            position = record_end
+            valid_size = position
+        return records,valid_size
+
+    def header(self):
+        """Returns the first record of the journal file ({'snapshot','parent'}) or None"""
+        if not os.path.isfile(self.path):
+            return None
+        records,_ = self.read_records()
+        if len(records) == 0:
+            return None
+        return records[0]
+
+    def read(self,snapshot_id,child:bool=False):
+        """
+        Returns the db_write records of the journal, if it belongs to snapshot_id
+        (child == True: if it belongs to a snapshot whose parent is snapshot_id).
+
+        Output:
+            records: list of (db_base,data_id,display_property,display_property_value) and (db_base,data_id)
+        """
+        if not os.path.isfile(self.path):
+            return []
+        records,_ = self.read_records()
+        if len(records) == 0:
+            return []
+        if child:
+            if records[0].get('parent') != snapshot_id:
+                return []
+        elif records[0].get('snapshot') != snapshot_id:
+            return []
+        return records[1:]
+
+    def replay(self,db_prop:dict,snapshot_id,child:bool=False):
+        """
+        Applies all records of the journal of snapshot_id (child == True: of a child snapshot of snapshot_id) to db_prop.
+
+        Output:
+            number_of_records: int
+        """
+        records = self.read(snapshot_id,child=child)
+        for record in records:
+            if len(record) == 2:
+                db_base,data_id = record
+                db_prop.get(db_base,{}).pop(data_id,None)
+                continue
+            db_base,data_id,display_property,display_property_value = record
+            if db_base == 'super' or db_base == 'link':
+                db_prop.setdefault(db_base,{}).update({display_property:display_property_value})
+            else:
+                db_prop.setdefault(db_base,{}).setdefault(data_id,{}).update({display_property:display_property_value})
+        return len(records)
+
+    def size(self):
+        """Size of the journal in bytes"""
+        if self.handle != None:
+            return self.handle.tell()
+        if os.path.isfile(self.path):
+            return os.path.getsize(self.path)
+        return 0
+
+    def close(self):
+        if self.handle != None:
+            self.handle.flush()
+            self.handle.close()
+            self.handle = None
@@ -7,12 +7,30 @@ Description:    database manager class for python based Nanonis data browser
 ### Load libraries
 import os
 import pickle
+import copy
+import numpy as np
 import sys
 sys.path.append('K:/Labs205/labs/THz-STM/Software/spmpy')
 from spmpy_terry import spm
 import spmpy_terry as spmpy
 from helpers import fname_generator
+from db_sqlite_store import db_sqlite_store
+from db_array_store import db_array_store
+from db_data_cache import db_data_cache, db_data_stream
+from db_journal import db_journal
+from db_diff import directory_diff, diff_is_empty, file_content_hash
+from file_indexer import file_indexer
+from file_cache import file_cache
+from db_index import db_index
+from db_metadata import db_metadata, extract_metadata, metadata_version
+from db_spatial_index import db_spatial_index
+from db_time_index import db_time_index
+from db_manifest import write_manifest, read_manifest, hashing_writer, hashing_reader
 import datetime
+import time
+import threading
+import weakref
+import sqlite3
 
 
 class db_manager():
@@ -30,12 +48,21 @@ class db_manager():
                    super:{super_display_property1:super_display_property_value1,...}
                    link:{link_property1:link_property_value1,...}}
 
+    Storage backends (self.database_backend):
+        'pickle': db_prop (and db_data) are pickled to self.database_file (snapshot), every db_write is appended to a
+                  journal (see db_journal) that is replayed on load and compacted into a new snapshot by save_db
+        'sqlite': db_prop is stored with one row per (data_id, property), db_write persists the changed rows (see db_sqlite_store)
+    Data stores (self.database_data_store), used if the database is saved with_data:
+        'pickle': db_data is pickled together with db_prop (only database_backend 'pickle')
+        'mmap': signals are stored in a memory-mapped container and mapped lazily on load (see db_array_store)
+
     """
     def __init__(self):
         
         # global directory
 
-        self.db_data = {}
+        self.db_data_memory_limit = None # bytes of loaded signals in db_data, above the least recently used files are evicted (None: no limit)
+        self.db_data = db_data_cache(memory_limit=self.db_data_memory_limit,loader=self.db_data_reload) # {data_id:spm}
         self.db_prop = {'data_prop':{},'stitch':{},'super':{},'link':{}}
         self.database_loaded = False
         self.database_saved = False
@@ -43,15 +70,47 @@ class db_manager():
         self.database_path_latest = None
         self.database_overwrite_save = None
         self.database_save_with_data = None
+        self.database_backend = 'pickle' # 'pickle' or 'sqlite'
+        self.db_store = None # db_sqlite_store, if database_backend == 'sqlite'
+        self.db_store_pending = None # rows of db_write and db_delete while save_db_sqlite writes a new db_sqlite_store
+        self.database_data_store = 'pickle' # 'pickle' or 'mmap' (db_data in a memory-mapped db_array_store)
+        self.db_journal = None # db_journal of the last snapshot, if database_backend == 'pickle'
+        self.database_journal_max_size = 8*1024*1024 # bytes, above this size save_db compacts the journal into a new snapshot
+        self.database_snapshot_id = None # db_save_time of the last saved or loaded snapshot
+        self.database_snapshot_data_ids = set() # data_ids of db_data in the last snapshot
+        self.database_snapshot_with_data = False # True if the last snapshot contains db_data (or a db_data_store)
+        self.database_snapshot_checksum = None # checksum of the last pickle snapshot (see db_manifest)
+        self.database_journal_slot = 0 # journal file of the current snapshot (0 or 1, alternating with every snapshot)
+        self.database_journal_child_replayed = False # True if changes of an unfinished snapshot were replayed on load
+        self.db_lock = threading.RLock() # db_write, db_delete and the snapshot of save_db
+        self.save_lock = threading.Lock() # one save_db at a time
+        self.save_condition = threading.Condition() # save_db_async requests
+        self.save_request = None # (directory,kwargs) of the next save of the writer thread
+        self.save_writer_running = False
         self.directory = None
+        self.ingest_workers = None # processes used by update_db_data (None: os.cpu_count())
+        self.ingest_min_parallel = 16 # fewer new files are loaded serially
+        self.ingest_progress_callback = None # function(number_loaded, number_total, path)
+        self.ingest_cancel_event = None # threading.Event to cancel update_db_data
+        self.ingest_lazy = True # if True, only the headers of .dat files are read on import, the data on the first get_channel (.sxm files are always memory-mapped)
+        self.file_cache = file_cache() # parsed headers (and .dat columns) in .cache next to the data files, None: no cache
+        self.prerender_service = None # prerender_service that renders the thumbnails of new and modified files (set by databrowser)
+        self.database_content_hash = False # if True, 'file_hash' is stored for every file and used to confirm renames
+        self.directory_diff_last = None # diff of the last create or update (see db_diff.directory_diff)
+        self.file_indexer = file_indexer(recursive=False) # set recursive=True to index session subfolders
+        self.db_index = db_index() # tag, liked, checked and filename_ending indexes of db_prop['data_prop'], kept up to date by db_write
+        self.db_metadata = db_metadata() # columnar table of the header parameters ('metadata' display property), kept up to date by db_write
+        self.db_spatial_index = db_spatial_index(self.db_metadata) # scan frames of db_metadata, rebuilt on the first query after a change
+        self.db_time_index = db_time_index() # data_ids sorted by acquisition time (or file_modified_date), kept up to date by db_write
 
         # External shared variables
         self.open_with_viewer_data_id = None
 
         # db_prop keys
         self.db_meta_keys = ['filename_full','filename_ending','file_size','file_modified_date']
-        self.super_keys = [("data_id_time_sorted",None),("sxm_viewer_value",None),("dat_viewer_value",None),('dat_viewer_value_2',None),('sxm_show_value',None),('db_save_time',None),('multi_y_plot_value',None)]
+        self.super_keys = [("sxm_viewer_value",None),("dat_viewer_value",None),('dat_viewer_value_2',None),('sxm_show_value',None),('db_save_time',None),('multi_y_plot_value',None),('metadata_categories',None)]
         self.stitch_keys = [("file_modified_date")]
+        self.derived_super_keys = {'data_id_time_sorted':self.data_id_time_sorted} # super properties that are derived from the indexes on db_get
 
         # Standard display properties
         self.display_properties_all = [("liked",False),("group",None),("checked",False),("tags",[]),("channel_names",[]),("prerender",None)]
@@ -72,8 +131,8 @@ class db_manager():
         # Create super properties
         self.create_super_properties()
 
-        # Create file index
-        db_meta_new = self.file_indexing(directory)
+        # Create file index (all directories are listed, files rewritten in place since the last load are detected)
+        db_meta_new = self.file_indexing(directory,full=True)
         self.data_checks(db_meta_new)
 
         # Should the database be loaded
@@ -81,38 +140,28 @@ class db_manager():
             # Check for database in directory
             if os.path.isfile(directory+'\\'+self.database_file):
                 db_prop_loaded, db_data_loaded = db_manager.load_db(self,directory)
-                """
-                TODO:
-                    # Self consistency check
-                    # Can files be found in directory?
-                    # Are all files in db_prop contained in db_data?
-                    # Check for inconsistencies between file index db_meta_new and loaded database db_prop_loaded
-                    # Create db_meta from db_prop['data_prop']
-                """
                 db_meta_loaded = self.db_meta_from_db_prop(db_prop_loaded)
-
-                if len(db_meta_loaded) > len(db_meta_new):
-                    print('db_manager.create: More files loaded than in directory.')
-                    force_new_import = True
+                diff = self.directory_diff(db_meta_loaded,db_meta_new)
+
+                # Continue with the loaded database and patch only the changed files
+                self.db_data.reset(db_data_loaded)
+                self.db_prop = db_prop_loaded
+                self.db_index.rebuild(self.db_prop)
+                self.db_metadata.rebuild(self.db_prop)
+                self.db_time_index.rebuild(self.db_prop)
+                self.database_loaded = True
+                if self.database_backend == 'sqlite':
+                    self.db_store_attach(directory+'\\'+self.database_file)
                 else:
-                    new_data_bool,file_incombability_bool,db_meta_new_elements = self.metadata_comparision(db_meta_loaded,db_meta_new)
-
-                    if file_incombability_bool == True:
-                        print('db_manager.create: File incompatibility detected. Importing from directory.')
-                        force_new_import = True
-                    else:
-                        if new_data_bool == True:
-                            print('db_manager.create: New files in directory.')
-                            print('db_manager.create:',db_meta_new_elements)
-                            force_new_import = False
-                            self.add_new_elements(directory,db_meta_new_elements)
-                        else:
-                            print('db_manager.create: No new files in directory.')
-                            force_new_import = False
-                            self.db_data = db_data_loaded
-                            self.db_prop = db_prop_loaded
-                            self.update_db_data(directory=self.directory)
-                            self.database_loaded = True
+                    self.db_journal_attach(directory)
+                # Metadata of databases saved by an older version, once per load (update_db_data checks only its data_ids)
+                self.backfill_metadata()
+                if diff_is_empty(diff):
+                    print('db_manager.create: No new files in directory.')
+                    self.update_db_data(directory=self.directory)
+                    self.update_super_properties(data_ids=[])
+                else:
+                    self.apply_directory_diff(directory,diff)
             else:
                 print('db_manager.create: No pickle files found. Importing from directory.')
                 force_new_import = True
@@ -120,7 +169,22 @@ class db_manager():
             print('db_manager.create: force_new_import is True. Forcing new import from directory.')
         
         if force_new_import == True:
+            database_backend = self.database_backend
+            database_data_store = self.database_data_store
+            self.wait_for_save()
+            database_content_hash = self.database_content_hash
+            indexer = self.file_indexer
+            db_data_memory_limit = self.db_data_memory_limit
+            ingest_settings = (self.ingest_workers,self.ingest_min_parallel,self.ingest_progress_callback,self.ingest_cancel_event,self.ingest_lazy,self.file_cache,self.prerender_service)
+            self.db_store_close()
+            self.db_journal_close()
             self.__init__()
+            self.set_database_backend(database_backend)
+            self.database_data_store = database_data_store
+            self.database_content_hash = database_content_hash
+            self.file_indexer = indexer
+            self.set_db_data_memory_limit(db_data_memory_limit)
+            self.ingest_workers,self.ingest_min_parallel,self.ingest_progress_callback,self.ingest_cancel_event,self.ingest_lazy,self.file_cache,self.prerender_service = ingest_settings
             self.directory = directory
             self.create_super_properties()
             self.add_new_elements(directory,db_meta_new)
@@ -135,138 +199,233 @@ class db_manager():
         print('db_manager.add_new_elements: Adding new elements to database.')
 
         # Write metadata from db_meta_new_elements to db_prop
+        new_data_ids = []
         for d_meta_new_element in db_meta_new_elements:
             data_id = d_meta_new_element['filename_full']
             write_data_id = True
             for key in self.db_meta_keys:
                 self.db_write(data_id,key,d_meta_new_element[key],write_data_id=write_data_id,write_display_property=True)
                 write_data_id = False
+            new_data_ids.append(data_id)
         
         # Add new elements to db_data
-        self.update_db_data(directory)
+        self.update_db_data(directory,data_ids=new_data_ids)
 
-        # Update display_properties in db_prop
-        self.create_standard_display_properties()
-        self.update_standard_display_properties()
+        # Update display_properties in db_prop (only of the new elements)
+        self.create_standard_display_properties(data_ids=new_data_ids)
+        self.update_standard_display_properties(data_ids=new_data_ids)
+        if self.database_content_hash:
+            self.write_file_hash(directory,new_data_ids)
         
-        # Update super_properties in db_prop
-        self.update_super_properties()
+        # Update super_properties in db_prop (the new elements are inserted into the time order)
+        self.update_super_properties(data_ids=new_data_ids)
+
+        # Render the thumbnails of the new elements in the background
+        if self.prerender_service != None:
+            self.prerender_service.submit(new_data_ids,priority='new')
         
-    def update(self,directory:str):
+    def update(self,directory:str,**kwargs):
         """
         This function updates the database from the directory of files.
+        Added, modified, deleted and renamed files are patched in the database (see apply_directory_diff).
+        All directories are listed again, such that files modified in place are detected as well. With full=False,
+        directories without created, deleted or renamed files are not listed again (see file_indexing), use it only
+        together with the events of a file_watcher (see update_files) that report the modified files.
+
+        Optional Arguments:
+            full: bool (default: True)
+
+        Output:
+            new_data_bool: True if the directory has changed
         """
+        if 'full' in kwargs: full = kwargs['full']
+        else: full = True
+
         # Create file index
-        db_meta_new = self.file_indexing(directory)
+        db_meta_new = self.file_indexing(directory,full=full)
         db_meta_internal = self.db_meta_from_db_prop(self.db_prop)
 
-        new_data_bool,file_incombability_bool,db_meta_new_elements = self.metadata_comparision(db_meta_internal,db_meta_new)
+        diff = self.directory_diff(db_meta_internal,db_meta_new)
     
-        if file_incombability_bool == True:
-            print('db_manager.update: File incompatibility detected.')
-            # Save current database
-            print('db_manager.update: !!! Saving current database.... Not implemented yet.')
-            # Create new database
-            force_new_import = True
-        
-        if new_data_bool == True:
-            print('db_manager.update: New files in directory.')
-            self.add_new_elements(directory,db_meta_new_elements)
-            self.database_saved = False
-        
-        if new_data_bool == False:
+        if diff_is_empty(diff):
             print('db_manager.update: No new files in directory.')
+            self.directory_diff_last = diff
+            return False
         
-        return new_data_bool
+        print('db_manager.update: New files in directory.')
+        self.apply_directory_diff(directory,diff)
+        self.database_saved = False
+        return True
+
+    def update_files(self,directory:str,filenames):
+        """
+        This function updates the database for the files filenames only (e.g. reported by file_watcher),
+        without indexing the whole directory. Only these files are stat-ed.
+
+        Input:
+            directory: str
+            filenames: iterable of filename_full (new, modified, deleted or renamed files)
+        Output:
+            new_data_bool: True if the database has changed
+        """
+        filenames = [filename for filename in filenames if filename.endswith('.sxm') or filename.endswith('.dat')]
+        db_meta_old = []
+        db_meta_new = []
+        for filename in filenames:
+            d_prop = self.db_prop['data_prop'].get(filename)
+            if d_prop != None:
+                d_meta = {key:d_prop.get(key) for key in self.db_meta_keys}
+                if 'file_hash' in d_prop:
+                    d_meta.update({'file_hash':d_prop['file_hash']})
+                db_meta_old.append(d_meta)
+            d_meta = self.file_meta(directory,filename)
+            if d_meta != None:
+                db_meta_new.append(d_meta)
+
+        diff = self.directory_diff(db_meta_old,db_meta_new,partial=True)
+        if diff_is_empty(diff):
+            return False
+        self.apply_directory_diff(directory,diff)
+        self.database_saved = False
+        return True
 
     def db_meta_from_db_prop(self,db_prop):
         """
         Create db_meta from db_prop
 
         Output:
-            db_meta with self.db_meta_keys
+            db_meta with self.db_meta_keys (and 'file_hash', if stored)
         """
         db_meta = [] # local
-        for fname in db_prop['data_prop'].keys():
-            d_meta = {}
-            for key in self.db_meta_keys:
-                d_meta.update({key:self.db_get(fname,key,db_prop=db_prop)})
+        for fname,d_prop in db_prop['data_prop'].items():
+            d_meta = {key:d_prop.get(key) for key in self.db_meta_keys}
+            if 'file_hash' in d_prop:
+                d_meta.update({'file_hash':d_prop['file_hash']})
             db_meta.append(d_meta)
         return db_meta
 
-    def metadata_comparision(self,db_meta_old,db_meta_new):
+    def directory_diff(self,db_meta_old,db_meta_new,**kwargs):
         """
-        Compare metadata in db_meta_old and db_meta_new.
-        If new elements in db_meta_new is found, return new_data_bool = True and db_meta_new_elements.
-        If file incompatibilities are found, return file_incombability_bool = True.
+        Compare metadata in db_meta_old and db_meta_new (see db_diff.directory_diff).
+        If self.database_content_hash is True, renames are confirmed by the content hash of the files.
 
         Input:
             db_meta_old: db_meta with self.db_meta_keys
             db_meta_new: db_meta with self.db_meta_keys
+
+        Optional Arguments:
+            partial: bool, True if db_meta_new is not the index of the whole directory (an empty db_meta_new
+                     then means that the files were deleted)
         Output:
-            new_data_bool: boolean, True if new data is found
-            file_incombability_bool: boolean, True if the metadata of the files in the directory are not compatible with the metadata of the elements in data_meta_dic
-            data_meta_dic_new_elements: dictionary of data metadata [{filename_full, filename_ending, file_size, file_modified_date},...] of the new elements in data_meta_dic_new not contained in data_meta_dic
+            diff: {'added':[d_meta,...],'modified':[d_meta,...],'deleted':[d_meta,...],'renamed':[(d_meta_old,d_meta_new),...],'unchanged':int}
         """
-        # Output variables
-        db_meta_new_elements = []
-        new_data_bool = False
-        file_incombability_bool = False
-
-        print('db_manager.metadata_comparision: comparing meta_data')
+        print('db_manager.directory_diff: comparing meta_data')
+        if self.database_content_hash:
+            diff = directory_diff(db_meta_old,db_meta_new,content_hash=lambda d_meta: file_content_hash(d_meta['path']))
+        else:
+            diff = directory_diff(db_meta_old,db_meta_new)
+
+        if 'partial' in kwargs: partial = kwargs['partial']
+        else: partial = False
+
+        if not partial and len(db_meta_new) == 0 and len(diff['deleted']) > 0:
+            print('db_manager.directory_diff: WARNING: no files found in directory, deleted files are kept in the database')
+            diff['deleted'] = []
+        for key in ['added','modified','deleted']:
+            for d_meta in diff[key]:
+                print('db_manager.directory_diff: '+key+': ',d_meta['filename_full'])
+        for d_meta_old,d_meta_new in diff['renamed']:
+            print('db_manager.directory_diff: renamed: ',d_meta_old['filename_full'],'->',d_meta_new['filename_full'])
+        return diff
+
+    def apply_directory_diff(self,directory,diff):
+        """
+        Patches db_prop and db_data with a diff of directory_diff. Display properties (likes, tags, ...) of modified
+        and renamed files are kept, only the file metadata and the channel information are updated.
 
-        filenames_new_elements = []
-        for i in range(0,len(db_meta_new)):
-            filenames_new_elements.append(db_meta_new[i]['filename_full'])
-        
-        filenames_old_elements = []
-        for i in range(0,len(db_meta_old)):
-            filenames_old_elements.append(db_meta_old[i]['filename_full'])
-        
-        for i in range(0,len(filenames_new_elements)):
-            try:
-                index_old_element = filenames_old_elements.index(filenames_new_elements[i])
-                if db_meta_old[index_old_element]['file_modified_date'] == db_meta_new[i]['file_modified_date']and db_meta_old[index_old_element]['file_size'] == db_meta_new[i]['file_size']:
-                    pass
-                else:
-                    print('db_manager.metadata_comparison: WARNING: metadata is different for same filename',db_meta_new[i]['filename_full'])
-                    file_incombability_bool = True
-                    new_data_bool = False
-                    db_meta_new_elements = []
-                    return new_data_bool, file_incombability_bool, db_meta_new_elements
-            except ValueError:
-                new_data_bool = True
-                db_meta_new_elements.append(db_meta_new[i])
-                print('db_manager.metadata_comparision: new data found: ',db_meta_new[i]['filename_full'])
-        return new_data_bool,file_incombability_bool,db_meta_new_elements
-    
-    def file_indexing(self,directory):
+        Input:
+            directory: str
+            diff: dict (see directory_diff)
+        """
+        # Deleted files
+        for d_meta in diff['deleted']:
+            self.db_delete(d_meta['filename_full'])
+
+        # Renamed files: move the display properties to the new data_id
+        for d_meta_old,d_meta_new in diff['renamed']:
+            self.db_rename(d_meta_old['filename_full'],d_meta_new['filename_full'])
+
+        # Modified and renamed files: new metadata, the file is loaded again
+        changed_data_ids = []
+        removed_data_ids = [d_meta['filename_full'] for d_meta in diff['deleted']] + [d_meta_old['filename_full'] for d_meta_old,_ in diff['renamed']]
+        for d_meta in diff['modified'] + [d_meta_new for _,d_meta_new in diff['renamed']]:
+            data_id = d_meta['filename_full']
+            for key in self.db_meta_keys:
+                self.db_write(data_id,key,d_meta[key])
+            self.db_data.pop(data_id,None)
+            changed_data_ids.append(data_id)
+        # Prerendered images of modified files are outdated
+        for d_meta in diff['modified']:
+            self.db_write(d_meta['filename_full'],'prerender',None)
+
+        # Added files
+        if len(diff['added']) > 0:
+            self.add_new_elements(directory,diff['added'])
+        self.update_db_data(directory,data_ids=changed_data_ids)
+        self.update_super_properties(data_ids=removed_data_ids + changed_data_ids)
+
+        self.update_standard_display_properties(data_ids=changed_data_ids)
+        if self.database_content_hash:
+            self.write_file_hash(directory,changed_data_ids)
+        if self.prerender_service != None:
+            self.prerender_service.submit(changed_data_ids,priority='new')
+        self.directory_diff_last = diff
+
+    def write_file_hash(self,directory,data_ids):
+        """Writes the content hash 'file_hash' of the files data_ids to db_prop['data_prop']"""
+        for data_id in data_ids:
+            self.db_write(data_id,'file_hash',file_content_hash(directory+'\\'+data_id),write_display_property=True)
+
+    def file_indexing(self,directory,**kwargs):
         ''' 
         This function returns a reverse time-sorted list of dict of files db_meta with meta-data in specified directory
         db_meta=[{filename_full, filename_ending, file_size, file_modified_date},...]
+        The directory is indexed by self.file_indexer (one stat per file). With full=False, directories without
+        created, deleted or renamed files are not listed again (files modified in place are missed).
         
         Input:
             global directory
+        Optional Arguments:
+            full: bool, if True all directories are listed again (default: True)
         Output:
             db_meta: reverse time-sorted dict of files with meta-data [{filename_full, filename_ending, file_size, file_modified_date},...]
 
         Example:
             db_meta = db_manager.file_indexing(directory)
         '''
-        db_meta = []
-        files = os.listdir(directory)
-        files.sort(key=lambda x: os.path.getctime(os.path.join(directory, x)))
-        files.reverse()
-
-        for file in files:
-            if file.endswith('.sxm') or file.endswith('.dat'):
-                db_meta.append({"path":directory+'\\'+file,
-                                "filename_full":file,
-                                "filename_ending":file.split('.')[-1],
-                                "file_size":os.path.getsize(os.path.join(directory,file)),
-                                "file_modified_date":os.path.getmtime(os.path.join(directory, file))
-                                })
-        return db_meta
+        if 'full' in kwargs: full = kwargs['full']
+        else: full = True
+
+        file_index = self.file_indexer.index(directory,full=full)
+        return file_indexer.to_db_meta(file_index,directory)
+
+    def file_meta(self,directory,filename):
+        """
+        Returns the metadata of a single file with a single stat (None if the file does not exist).
+
+        Output:
+            d_meta: {path, filename_full, filename_ending, file_size, file_modified_date}
+        """
+        try:
+            stat = os.stat(os.path.join(directory,filename))
+        except OSError:
+            return None
+        return {"path":directory+'\\'+filename,
+                "filename_full":filename,
+                "filename_ending":filename.split('.')[-1],
+                "file_size":stat.st_size,
+                "file_modified_date":stat.st_mtime
+                }
 
     def data_checks(self,db_meta):
         """
@@ -288,51 +447,66 @@ class db_manager():
             super_display_property_value = key_pair[1]
             self.db_write([],super_display_property,super_display_property_value,super_prop=True,write_display_property=True)
         
-    def update_super_properties(self):
+    def update_super_properties(self,**kwargs):
         """
         Wrapper function for updating super_properties in db_prop['super']
+
+        Optional Arguments:
+            data_ids: list of data_id that were added, deleted or changed (see filetime_sorter)
         """
-        self.filetime_sorter()
+        self.filetime_sorter(**kwargs)
 
-    def filetime_sorter(self):
+    def filetime_sorter(self,**kwargs):
         """
-        This function creates a time-sorted list of data_id from db_prop['data_prop'] and writes it to
-        db_prop['super']['data_id_sorted']
-        
+        This function orders db_prop['data_prop'] by time (newest first, data_ids without a time at the end).
+        The time order itself is kept by self.db_time_index (acquisition time or file_modified_date), which is
+        updated by db_write, db_prop['super']['data_id_time_sorted'] is derived from it (see data_id_time_sorted).
+
+        Optional Arguments:
+            data_ids: list of data_id that were added, deleted or changed since the last call. These are already
+                      at their position in self.db_time_index, db_prop['data_prop'] is only reordered if the index
+                      was rebuilt or the time of other data_ids changed as well (e.g. new metadata of update_db_data).
+                      Default: db_prop['data_prop'] is reordered.
         """
         print('db_manager.filetime_sorter: update this function to work with stitched data')
-        # Get the time of the data
-        data_id_list = list(self.db_prop['data_prop'].keys())
-        data_time_list = []
-        for data_id in data_id_list:
-            data_time_list.append(self.db_get(data_id,'file_modified_date'))
-
-        # Sort the data_id by time
-        data_id_time_sorted = [x for x, _ in sorted(zip(data_id_list, data_time_list), key=lambda pair: pair[1])]
-        data_id_time_sorted.reverse()
-
-        # Write the sorted data_id to db_prop['super']['data_id_sorted']
-        super_display_property = 'data_id_time_sorted'
-        super_display_property_value = data_id_time_sorted
-        self.db_write([],super_display_property,super_display_property_value,super_prop=True)
+        if 'data_ids' in kwargs and not self.db_time_index.changed_since_clear(set(kwargs['data_ids'])):
+            self.db_time_index.clear_changed()
+            return
 
         # Reorder db_prop['data_prop']
         unsorted_data_prop = self.db_prop['data_prop']
-        sorted_data_prop = {key: unsorted_data_prop[key] for key in data_id_time_sorted}
+        sorted_data_prop = {key: unsorted_data_prop[key] for key in self.data_id_time_sorted()}
         self.db_prop['data_prop'] = sorted_data_prop
+        self.db_time_index.clear_changed()
+
+    def data_id_time_sorted(self):
+        """
+        Returns the data_ids sorted by time (newest first) from self.db_time_index, data_ids without a time at the end.
+        This is the value of db_get('super','data_id_time_sorted',super_prop=True), the list is not stored in db_prop.
+        """
+        data_id_time_sorted = self.db_time_index.sorted_ids(descending=True)
+        if len(data_id_time_sorted) != len(self.db_prop['data_prop']):
+            data_id_time_sorted = data_id_time_sorted + [data_id for data_id in self.db_prop['data_prop'] if self.db_time_index.time(data_id) == None]
+        return data_id_time_sorted
 
     ##### display_property functions #####
 
-    def create_standard_display_properties(self):
+    def create_standard_display_properties(self,**kwargs):
         """
         Creates standard display properties (from __init__) for all files in db_prop['data_prop']
+
+        Optional Arguments:
+            data_ids: list of data_id, only these files are (re)set to the standard display properties
         """
+        if 'data_ids' in kwargs: data_ids = kwargs['data_ids']
+        else: data_ids = list(self.db_prop['data_prop'].keys())
 
-        for data_id in self.db_prop['data_prop'].keys():
+        for data_id in data_ids:
             for display_property_pair in self.display_properties_all:
                 # Check if display_properties exist
                 #if self.db_get(data_id,display_property_pair[0]) == None:
-                self.db_write(data_id,display_property_pair[0],display_property_pair[1],write_display_property=True)
+                # Copy the default value, the lists (e.g. tags) are changed in place by the widgets
+                self.db_write(data_id,display_property_pair[0],copy.copy(display_property_pair[1]),write_display_property=True)
             if self.db_get(data_id,'filename_ending') == 'dat':
                 for display_property_pair in self.display_properties_dat:
                     self.db_write(data_id,display_property_pair[0],display_property_pair[1],write_display_property=True)
@@ -340,18 +514,27 @@ class db_manager():
                 for display_property_pair in self.display_properties_sxm:
                     self.db_write(data_id,display_property_pair[0],display_property_pair[1],write_display_property=True)
 
-    def update_standard_display_properties(self):
+    def update_standard_display_properties(self,**kwargs):
         """
         Wrapper function for various standard initialization functions for display properties.
+
+        Optional Arguments:
+            data_ids: list of data_id, only these files are updated
         """
-        self.favourite_channel()
-        self.all_channels()
+        self.favourite_channel(**kwargs)
+        self.all_channels(**kwargs)
 
-    def favourite_channel(self):
+    def favourite_channel(self,**kwargs):
         """
         Find the favourite channel for each file in db_prop['data_prop'].
+
+        Optional Arguments:
+            data_ids: list of data_id, only these files are updated
         """
-        for data_id in self.db_prop['data_prop'].keys():
+        if 'data_ids' in kwargs: data_ids = kwargs['data_ids']
+        else: data_ids = list(self.db_prop['data_prop'].keys())
+
+        for data_id in data_ids:
             
             filename_full = data_id
             filename_ending = self.db_get(data_id,'filename_ending')
@@ -408,8 +591,11 @@ class db_manager():
                 except KeyError:
                     print('db_manager.favourite_channel: dat file '+ filename_full +' not loaded')
 
-    def all_channels(self):
-        for data_id in self.db_get_all_ids():
+    def all_channels(self,**kwargs):
+        if 'data_ids' in kwargs: data_ids = kwargs['data_ids']
+        else: data_ids = self.db_get_all_ids()
+
+        for data_id in data_ids:
             try:
                 spm_loaded = self.db_data[data_id]
                 channels = spm_loaded.channels
@@ -464,6 +650,8 @@ class db_manager():
         
         # super_prop query
         if 'super_prop' in kwargs and kwargs['super_prop'] == True:
+            if display_property in self.derived_super_keys and db_prop is self.db_prop:
+                return self.derived_super_keys[display_property]()
             try:
                 display_property_value = db_prop[db_base][display_property]
             except KeyError:
@@ -520,83 +708,180 @@ class db_manager():
             db_manager.db_write([],super_display_property,super_display_property_value,super_prop=True,write_data_id=True)
             db_manager.db_write([],link_property,link_property_value,link_prop=True)
         """
+        with self.db_lock:
 
-        if 'write_data_id' in kwargs: write_data_id = kwargs['write_data_id']
-        else: write_data_id = False
-        if 'write_display_property' in kwargs: write_display_property = kwargs['write_display_property']
-        else: write_display_property = False
+            if 'write_data_id' in kwargs: write_data_id = kwargs['write_data_id']
+            else: write_data_id = False
+            if 'write_display_property' in kwargs: write_display_property = kwargs['write_display_property']
+            else: write_display_property = False
 
-        if 'stitch_prop' in kwargs and kwargs['stitch_prop']: db_base = 'stich'
-        elif 'super_prop' in kwargs and kwargs['super_prop']: db_base = 'super'
-        elif 'link_prop' in kwargs and kwargs['link_prop']: db_base = 'link'
-        else: db_base = 'data_prop'
+            if 'stitch_prop' in kwargs and kwargs['stitch_prop']: db_base = 'stich'
+            elif 'super_prop' in kwargs and kwargs['super_prop']: db_base = 'super'
+            elif 'link_prop' in kwargs and kwargs['link_prop']: db_base = 'link'
+            else: db_base = 'data_prop'
         
-        # Input error handling
-        if 'stitch_prop' in kwargs and 'super_prop' in kwargs:
-            print('db_manager.db_write: Error: stitch_prop and super_prop cannot be kwards at the same time')
-            return None
-        if 'stitch_prop' in kwargs and 'link_prop' in kwargs:
-            print('db_manager.db_write: Error: stitch_prop and link_prop cannot be kwards at the same time')
-            return None
-        if 'super_prop' in kwargs and 'link_prop' in kwargs:
-            print('db_manager.db_write: Error: super_prop and link_prop cannot be kwards at the same time')
-            return None
-
-        if write_data_id:
-            if data_id not in list(self.db_prop[db_base]):
-                if db_base=='super' or db_base=='link':
-                    pass
+            # Input error handling
+            if 'stitch_prop' in kwargs and 'super_prop' in kwargs:
+                print('db_manager.db_write: Error: stitch_prop and super_prop cannot be kwards at the same time')
+                return None
+            if 'stitch_prop' in kwargs and 'link_prop' in kwargs:
+                print('db_manager.db_write: Error: stitch_prop and link_prop cannot be kwards at the same time')
+                return None
+            if 'super_prop' in kwargs and 'link_prop' in kwargs:
+                print('db_manager.db_write: Error: super_prop and link_prop cannot be kwards at the same time')
+                return None
+
+            # Derived super properties are rebuilt from the indexes, they are neither stored nor journaled
+            if db_base == 'super' and display_property in self.derived_super_keys:
+                print('db_manager.db_write: Error: '+str(display_property)+' is derived from the indexes and cannot be written')
+                return None
+
+            if write_data_id:
+                if data_id not in self.db_prop[db_base]:
+                    if db_base=='super' or db_base=='link':
+                        pass
+                    else:
+                        self.db_prop[db_base].update({data_id:{}})
                 else:
-                    self.db_prop[db_base].update({data_id:{}})
-            else:
-                print('db_manager.db_write: cannot create existing data_id in db_prop[+'+str(db_base)+']')
+                    print('db_manager.db_write: cannot create existing data_id in db_prop[+'+str(db_base)+']')
         
-        database_was_changed = False
-        try:
-            # Does data_id in in database db_prop[db_base] exsist?
-            if db_base=='super' or db_base=='link':
-                pass
-            else:
-                _ = self.db_prop[db_base][data_id]
+            database_was_changed = False
+            value_was_written = False
             try:
-                # Does display_property in database db_prop[db_base][data_id] exsist?
-                if db_base=='super':
-                    _ = self.db_prop[db_base][display_property]
-                    # Write display_property_value
-                    self.db_prop[db_base][display_property] = display_property_value
-                elif db_base=='link':
-                    _ = self.db_prop[db_base][display_property]
-                    # Write link_property_value
-                    self.db_prop[db_base][display_property] = display_property_value
+                # Does data_id in in database db_prop[db_base] exsist?
+                if db_base=='super' or db_base=='link':
+                    pass
                 else:
-                    _ = self.db_prop[db_base][data_id][display_property]
-                    # Write display_property_value
-                    self.db_prop[db_base][data_id][display_property] = display_property_value
-                database_was_changed = True
-            except KeyError:
-                if write_display_property:
+                    _ = self.db_prop[db_base][data_id]
+                try:
+                    # Does display_property in database db_prop[db_base][data_id] exsist?
                     if db_base=='super':
-                        self.db_prop[db_base].update({display_property:display_property_value})
+                        _ = self.db_prop[db_base][display_property]
+                        # Write display_property_value
+                        self.db_prop[db_base][display_property] = display_property_value
                     elif db_base=='link':
-                        self.db_prop[db_base].update({display_property:display_property_value})
+                        _ = self.db_prop[db_base][display_property]
+                        # Write link_property_value
+                        self.db_prop[db_base][display_property] = display_property_value
                     else:
-                        self.db_prop[db_base][data_id].update({display_property:display_property_value})
+                        _ = self.db_prop[db_base][data_id][display_property]
+                        # Write display_property_value
+                        self.db_prop[db_base][data_id][display_property] = display_property_value
                     database_was_changed = True
-                else:
-                    print('KeyError: display_property '+str(display_property)+' not in database')
-                database_was_changed = True
-        except KeyError:
-            print('db_manager.dp_write: KeyError: data_id '+str(data_id)+' not in db_prop[+'+str(db_base)+']')
-            database_was_changed = False
+                    value_was_written = True
+                except KeyError:
+                    if write_display_property:
+                        if db_base=='super':
+                            self.db_prop[db_base].update({display_property:display_property_value})
+                        elif db_base=='link':
+                            self.db_prop[db_base].update({display_property:display_property_value})
+                        else:
+                            self.db_prop[db_base][data_id].update({display_property:display_property_value})
+                        database_was_changed = True
+                        value_was_written = True
+                    else:
+                        print('KeyError: display_property '+str(display_property)+' not in database')
+                    database_was_changed = True
+            except KeyError:
+                print('db_manager.dp_write: KeyError: data_id '+str(data_id)+' not in db_prop[+'+str(db_base)+']')
+                database_was_changed = False
         
-        if database_was_changed == True:
+            if database_was_changed == True:
+                self.database_saved = False
+
+            # Persist only the changed row (sqlite backend) or append it to the journal (pickle backend)
+            if value_was_written and self.db_store != None:
+                self.db_store.write(db_base,data_id,display_property,display_property_value)
+            if value_was_written and self.db_store_pending != None:
+                self.db_store_pending.append((db_base,data_id,display_property,display_property_value))
+            if value_was_written and self.db_journal != None:
+                self.db_journal.append(db_base,data_id,display_property,display_property_value)
+            if value_was_written and db_base == 'data_prop':
+                self.db_index.update(data_id,display_property,display_property_value)
+                self.db_metadata.update(data_id,display_property,display_property_value)
+                self.db_time_index.update(data_id,display_property,display_property_value)
+
+    def db_delete(self,data_id:str,**kwargs):
+        """
+        This function deletes data_id from db_prop (and db_data).
+
+        Optional kwargs:
+            stitch_prop: bool, True then the stitched_id is deleted
+
+        Input:
+            data_id (str): fname or stitched_id
+        """
+        with self.db_lock:
+            if 'stitch_prop' in kwargs and kwargs['stitch_prop']: db_base = 'stich'
+            else: db_base = 'data_prop'
+
+            if data_id not in self.db_prop.get(db_base,{}):
+                print('db_manager.db_delete: KeyError: data_id '+str(data_id)+' not in db_prop['+str(db_base)+']')
+                return
+            self.db_prop[db_base].pop(data_id)
+            if db_base == 'data_prop':
+                self.db_data.pop(data_id,None)
+                self.db_index.remove(data_id)
+                self.db_metadata.remove(data_id)
+                self.db_time_index.remove(data_id)
             self.database_saved = False
+
+            if self.db_store != None:
+                self.db_store.delete(db_base,data_id)
+            if self.db_store_pending != None:
+                self.db_store_pending.append((db_base,data_id))
+            if self.db_journal != None:
+                self.db_journal.append_delete(db_base,data_id)
+
+    def db_rename(self,data_id_old:str,data_id_new:str):
+        """
+        This function moves all display properties of data_id_old to data_id_new (e.g. for a renamed file).
+        References to data_id_old in 'sxm_ref' are renamed as well.
+
+        Input:
+            data_id_old (str)
+            data_id_new (str)
+        """
+        d_prop = self.db_prop['data_prop'].get(data_id_old)
+        if d_prop == None:
+            print('db_manager.db_rename: KeyError: data_id '+str(data_id_old)+' not in db_prop[data_prop]')
+            return
+        self.db_delete(data_id_old)
+        write_data_id = True
+        for display_property,display_property_value in d_prop.items():
+            self.db_write(data_id_new,display_property,display_property_value,write_data_id=write_data_id,write_display_property=True)
+            write_data_id = False
+        for data_id,d_prop_other in self.db_prop['data_prop'].items():
+            if d_prop_other.get('sxm_ref') == data_id_old:
+                self.db_write(data_id,'sxm_ref',data_id_new)
         
     ##### db_data functions #####
 
     def db_get_data(self,data_id:str):
+        """Returns the spm object of data_id (reloaded from the file or the data store if it was evicted, see db_data_cache)"""
         return self.db_data[data_id]
 
+    def db_data_reload(self,data_id:str,store):
+        """Loader of db_data_cache: remaps data_id from the data store or reads its header again from the file"""
+        if store != None and data_id in store.index:
+            return store.get_spm(data_id)
+        return spmpy.spm(self.directory+'\\'+data_id,lazy=True,cache=self.file_cache)
+
+    def set_db_data_memory_limit(self,memory_limit):
+        """
+        Sets the memory budget of db_data. If the loaded signals exceed it, the least recently used spm objects are
+        evicted and reloaded on their next access.
+
+        Input:
+            memory_limit: int, bytes (None: no limit)
+        """
+        self.db_data_memory_limit = memory_limit
+        self.db_data.set_memory_limit(memory_limit)
+
+    def db_data_stats(self):
+        """Returns the statistics of db_data (hits, misses, evictions, resident_bytes, ..., see db_data_cache.stats)"""
+        return self.db_data.stats()
+
     def load_file(self,directory,filename_full):
         """
         This function loads file defined by path and filename_full and writes the loaded data to db_data.
@@ -619,20 +904,184 @@ class db_manager():
 
         ## Load data file
         path = directory+'\\'+filename_full
-        loaded = spmpy.spm(path)
+        loaded = spmpy.spm(path,lazy=self.ingest_lazy,cache=self.file_cache)
         self.db_data.update({filename_full:loaded})
+        if filename_full in self.db_prop['data_prop']:
+            self.update_metadata(filename_full)
     
-    def update_db_data(self,directory):
+    def update_db_data(self,directory,**kwargs):
         """
         This function updates the db_data by loading all files in db_prop['data_prop'] that are not yet loaded.
+        The files are loaded in a process pool with self.ingest_workers processes (see spmpy_terry.import_parallel),
+        batches smaller than self.ingest_min_parallel are loaded serially. If self.ingest_lazy is True, only the
+        headers of .dat files are read and their data is parsed on the first get_channel (.sxm files are always
+        memory-mapped). Unchanged files are read from
+        self.file_cache (see file_cache).
 
         Input:
             directory: str
+
+        Optional Arguments:
+            data_ids: list of data_id, only these files are loaded if missing and their metadata version is
+                      checked (default: all files of db_prop['data_prop'])
+            progress_callback: function(number_loaded, number_total, path), default self.ingest_progress_callback
+            cancel_event: threading.Event, default self.ingest_cancel_event. If set, loading stops and the
+                          files loaded so far are kept (the rest is loaded by the next update_db_data)
         """
+        if 'progress_callback' in kwargs:
+            progress_callback = kwargs['progress_callback']
+        else:
+            progress_callback = self.ingest_progress_callback
+        if 'cancel_event' in kwargs:
+            cancel_event = kwargs['cancel_event']
+        else:
+            cancel_event = self.ingest_cancel_event
+
+        if 'data_ids' in kwargs:
+            data_ids = [data_id for data_id in kwargs['data_ids'] if data_id in self.db_prop['data_prop']]
+        else:
+            data_ids = list(self.db_prop['data_prop'].keys())
+
         loaded_files = self.db_data.keys()
-        for fname in self.db_prop['data_prop'].keys():
-            if fname not in loaded_files:
-                self.db_data.update({'fname':self.load_file(directory,fname)})
+        fnames = [fname for fname in data_ids if fname not in loaded_files]
+        if len(fnames) > 0:
+            paths = [directory+'\\'+fname for fname in fnames]
+
+            loaded = spmpy.import_parallel(paths,workers=self.ingest_workers,min_parallel=self.ingest_min_parallel,
+                                           progress_callback=progress_callback,cancel_event=cancel_event,lazy=self.ingest_lazy,
+                                           cache=self.file_cache)
+            with self.db_lock:
+                for fname,spm_object in zip(fnames,loaded):
+                    if spm_object is not None:
+                        self.db_data.update({fname:spm_object})
+                        self.update_metadata(fname)
+
+        # Files without metadata (or with metadata of an older extract_metadata)
+        self.backfill_metadata(data_ids)
+
+    def backfill_metadata(self,data_ids=None):
+        """
+        Extracts the metadata of the loaded files data_ids whose metadata is missing or was written by an older
+        extract_metadata (see metadata_version). Called for all files once after a database was loaded (see create),
+        afterwards only for the files that are added or changed.
+
+        Optional Arguments:
+            data_ids: list of data_id (default: all files of db_prop['data_prop'])
+        """
+        if data_ids == None:
+            data_ids = list(self.db_prop['data_prop'].keys())
+        for data_id in data_ids:
+            d_prop = self.db_prop['data_prop'].get(data_id)
+            if d_prop != None and (d_prop.get('metadata') or {}).get('metadata_version') != metadata_version and data_id in self.db_data:
+                self.update_metadata(data_id)
+
+    def update_metadata(self,data_id:str):
+        """Extracts the header parameters of the loaded file data_id into the display property 'metadata' (see db_metadata)"""
+        try:
+            metadata = extract_metadata(self.db_data[data_id])
+        except Exception as e:
+            print('db_manager.update_metadata: Error: could not read the header of '+str(data_id)+': ',e)
+            return
+        self.db_write(data_id,'metadata',metadata,write_display_property=True)
+
+    def metadata_query(self,expression:str):
+        """
+        Returns the data_ids whose header parameters match expression (see db_metadata.query).
+
+        Input:
+            expression: str, e.g. "abs(V) < 0.05 and temperature < 6 sort time desc"
+        Output:
+            data_ids: list of str, None if the expression is not valid
+        """
+        try:
+            return self.db_metadata.query(expression)
+        except ValueError as e:
+            print(e)
+            return None
+
+    def spectrum_positions(self,data_ids):
+        """Returns the positions x, y (nm) of data_ids from their metadata as array (n,2), NaN if unknown"""
+        return np.stack((self.db_metadata.values(data_ids,'x'),self.db_metadata.values(data_ids,'y')),axis=-1)
+
+    def scans_at_positions(self,positions):
+        """
+        Returns the scans whose frame contains the positions (see db_spatial_index.query).
+
+        Input:
+            positions: array (n,2) of x, y in nm, e.g. spectrum_positions(data_ids)
+        Output:
+            result: dict of arrays {'position_index','data_ids','x_rel','y_rel','column','row','time'}
+        """
+        return self.db_spatial_index.query(positions)
+
+    def suggest_sxm_ref(self,data_id:str):
+        """
+        Returns the scan that is suggested as 'sxm_ref' of the spectrum data_id: of the scans that contain the
+        position of the spectrum, the last one recorded before the spectrum (or the closest in time if all were
+        recorded after it). If no scan contains the position, the last scan recorded before the spectrum
+        (see preceding_scan). None if there is no such scan.
+        """
+        result = self.scans_at_positions(self.spectrum_positions([data_id]))
+        if len(result['data_ids']) == 0:
+            return self.preceding_scan(data_id)
+        spectrum_time = self.db_time_index.time(data_id)
+        if spectrum_time == None:
+            spectrum_time = np.nan
+        time_difference = spectrum_time - np.array([self.db_time_index.time(scan_id) or np.nan for scan_id in result['data_ids']])
+        before = time_difference >= 0
+        if np.any(before):
+            candidates = np.flatnonzero(before)
+            return result['data_ids'][candidates[np.argmin(time_difference[candidates])]]
+        return result['data_ids'][np.nanargmin(np.abs(time_difference))] if np.any(np.isfinite(time_difference)) else result['data_ids'][0]
+
+    def preceding_scan(self,data_id:str):
+        """Returns the last .sxm file recorded before data_id (None if there is none, see db_time_index)"""
+        time = self.db_time_index.time(data_id)
+        if time == None:
+            return None
+        scan_ids = self.db_time_index.times('sxm')
+        if self.db_time_index.data_id_ending.get(data_id) == 'sxm':
+            # scans with the same time are ordered by data_id (as in db_time_index)
+            i = scan_ids.position(time,data_id)
+        else:
+            i = scan_ids.range(float('-inf'),time).stop
+        return scan_ids.data_ids[i-1] if i > 0 else None
+
+    def scans_within(self,data_id:str,delta:float):
+        """Returns the .sxm files recorded at most delta seconds before or after data_id (in time order)"""
+        time = self.db_time_index.time(data_id)
+        if time == None:
+            return []
+        return [scan_id for scan_id in self.db_time_index.within(time,delta,'sxm') if scan_id != data_id]
+
+    def files_in_window(self,time_start,time_end,filename_ending=None):
+        """
+        Returns the data_ids recorded in the time window (in time order).
+
+        Input:
+            time_start, time_end: float (s since the epoch) or datetime.datetime
+        Optional Arguments:
+            filename_ending: str, e.g. 'sxm' or 'dat' (default: None, all files)
+        """
+        if isinstance(time_start,datetime.datetime): time_start = time_start.timestamp()
+        if isinstance(time_end,datetime.datetime): time_end = time_end.timestamp()
+        return self.db_time_index.window(time_start,time_end,filename_ending)
+
+    def metadata_categories(self):
+        """Returns the saved metadata categories {category_name:expression}"""
+        categories = self.db_prop['super'].get('metadata_categories')
+        if categories == None:
+            return {}
+        return dict(categories)
+
+    def metadata_category_write(self,category_name:str,expression):
+        """Saves (or deletes, if expression is None) the metadata category category_name in db_prop['super']"""
+        categories = self.metadata_categories()
+        if expression == None:
+            categories.pop(category_name,None)
+        else:
+            categories.update({category_name:expression})
+        self.db_write([],'metadata_categories',categories,super_prop=True,write_display_property=True)
 
     def db_get_all_ids(self):
         """
@@ -659,8 +1108,21 @@ class db_manager():
             directory: of self.database_file
             
         Optional Arguments:
-            overwrite: if True, the database is overwritten
+            overwrite: if False, the previous save is kept in its own file whenever a full snapshot is written (first
+                       save into an existing file, compaction or compact=True). Saves of the journal (pickle) or of the
+                       changed rows (sqlite) always go to the current file.
             with_data: if True, db_data is saved as well
+            compact: if True, a new snapshot is written even if the journal is below self.database_journal_max_size
+
+        If a journal (db_journal) of the current snapshot is open, only the journal is synced to disk
+        until it exceeds self.database_journal_max_size. Then the journal is compacted into a new snapshot.
+
+        A new snapshot is a copy of db_prop (and the references of the spm objects in db_data) taken under
+        self.db_lock, db_write is only blocked while it is copied. The copy is written to a temporary file, fsynced
+        and renamed to self.database_file, such that a crash never leaves a partially written database. Changes made
+        while the snapshot is written go to the journal of the new snapshot (see db_journal_switch). The data store,
+        the journal and the snapshot are written outside of self.db_lock. Use save_db_async to save without
+        blocking the caller.
         """
 
         if 'overwrite' in kwargs:
@@ -678,24 +1140,299 @@ class db_manager():
             else:
                 with_data = False
 
-        self.db_write([],'db_save_time',datetime.datetime.now(),super_prop=True)
+        if 'compact' in kwargs:
+            compact = kwargs['compact']
+        else:
+            compact = False
 
-        if os.path.isfile(directory+'\\'+self.database_file) and not overwrite:
-            proposed_filebase = self.database_file.split('.')[0]
-            file_ending = self.database_file.split('.')[1]
-            self.database_file = fname_generator(directory,proposed_filebase,file_ending)
+        with self.save_lock:
+            if self.database_backend == 'sqlite':
+                self.save_db_sqlite(directory,overwrite,with_data,compact)
+                return
 
-        db_export_group = {'db_prop':self.db_prop}
-        db_export_group.update({'this_is_a_database_for_the_databrowser':True})
-        if with_data:
-            db_export_group.update({'db_data':self.db_data})
-        
-        with open(directory+'\\'+self.database_file, 'wb') as handle:
-            pickle.dump(db_export_group, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            with self.db_lock:
+                self.db_write([],'db_save_time',datetime.datetime.now(),super_prop=True)
+
+                # Journal only save: O(changes since the last save)
+                journal_only = False
+                if self.db_journal != None and not compact and self.db_journal.size() < self.database_journal_max_size:
+                    new_data_in_db_data = set(self.db_data.keys()) != self.database_snapshot_data_ids
+                    journal_only = not (with_data and self.database_data_store == 'pickle' and new_data_in_db_data) and not (with_data and not self.database_snapshot_with_data)
+
+                if journal_only:
+                    journal = self.db_journal
+                else:
+                    # The journal of the new snapshot is started next to the current snapshot, a snapshot under a
+                    # new name (overwrite == False) takes it over once it is written (see db_journal_move)
+                    snapshot_id = self.db_get('super','db_save_time',super_prop=True)
+                    parent_file = self.database_file
+                    self.db_journal_switch(directory,snapshot_id)
+                    if os.path.isfile(directory+'\\'+self.database_file) and not overwrite:
+                        proposed_filebase = self.database_file.split('.')[0]
+                        file_ending = self.database_file.split('.')[1]
+                        self.database_file = fname_generator(directory,proposed_filebase,file_ending)
+
+                    # Consistent snapshot
+                    db_export_group = {'db_prop':self.db_prop_snapshot()}
+                    db_export_group.update({'this_is_a_database_for_the_databrowser':True})
+                    db_export_group.update({'snapshot_id':snapshot_id})
+                    db_export_group.update({'parent_file':parent_file})
+                    database_path = directory+'\\'+self.database_file
+                data_ids = list(self.db_data.keys()) if with_data else []
+                self.database_saved = True
+
+            # Write the data and the journal or the snapshot (db_write is not blocked)
+            if journal_only:
+                if with_data and self.database_data_store == 'mmap':
+                    self.save_db_data_mmap(directory,data_ids)
+                journal.sync()
+                with self.db_lock:
+                    self.save_db_manifest(directory)
+                print('db_manager.save_db: journal synced: ',journal.path, ' size: ',journal.size(),' bytes')
+                return
+
+            if with_data:
+                if self.database_data_store == 'mmap':
+                    db_export_group.update({'db_data_store':self.save_db_data_mmap(directory,data_ids)})
+                else:
+                    # spm objects imported header-only or memory-mapped are saved with their data, one at a time
+                    db_export_group.update({'db_data':db_data_stream(self.db_data,data_ids)})
+            try:
+                checksum = self.write_snapshot(database_path,db_export_group)
+            except Exception as e:
+                print('db_manager.save_db: Error: database could not be written: ',e)
+                with self.db_lock:
+                    self.database_file = parent_file
+                    self.database_saved = False
+                return
+
+            with self.db_lock:
+                self.database_snapshot_id = snapshot_id
+                self.database_snapshot_checksum = checksum
+                self.database_snapshot_with_data = with_data
+                if with_data:
+                    if 'db_data' in db_export_group:
+                        self.database_snapshot_data_ids = set(db_export_group['db_data'].written_data_ids)
+                    else:
+                        self.database_snapshot_data_ids = set(data_ids)
+                if self.database_file != parent_file:
+                    self.db_journal_move(directory,parent_file,snapshot_id)
+                    self.db_journal_attach(directory)
+                self.save_db_manifest(directory)
         
-        self.database_saved = True
         print('db_manager.save_db: directory: ',directory, ' self.database_file: ',self.database_file, ' with_data: ',with_data, ' overwrite: ',overwrite)
+
+    def save_db_async(self,directory:str,**kwargs):
+        """
+        This function saves the database with save_db(directory,**kwargs) on a writer thread and returns immediately.
+        Saves requested while a save is running are merged into one save (with_data and compact if any
+        of the merged requests asked for it).
+
+        Input:
+            directory: of self.database_file
+
+        Optional Arguments:
+            see save_db
+        """
+        with self.save_condition:
+            if self.save_request == None:
+                self.save_request = (directory,dict(kwargs))
+            else:
+                pending_kwargs = self.save_request[1]
+                for key,value in kwargs.items():
+                    if key in ['with_data','compact']:
+                        pending_kwargs.update({key:value or pending_kwargs.get(key,False)})
+                    else:
+                        pending_kwargs.update({key:value})
+                self.save_request = (directory,pending_kwargs)
+            if not self.save_writer_running:
+                self.save_writer_running = True
+                threading.Thread(target=self.save_writer,daemon=True).start()
+
+    def save_writer(self):
+        """Writer thread of save_db_async, runs until no save is requested"""
+        while True:
+            with self.save_condition:
+                if self.save_request == None:
+                    self.save_writer_running = False
+                    self.save_condition.notify_all()
+                    return
+                directory,kwargs = self.save_request
+                self.save_request = None
+            try:
+                self.save_db(directory,**kwargs)
+            except Exception as e:
+                print('db_manager.save_writer: Error: ',e)
+
+    def wait_for_save(self,timeout=None):
+        """
+        Waits until all saves requested with save_db_async are written.
+
+        Output:
+            bool: False if the timeout expired
+        """
+        with self.save_condition:
+            return self.save_condition.wait_for(lambda: not self.save_writer_running,timeout=timeout)
+
+    def write_snapshot(self,database_path:str,db_export_group:dict):
+        """
+        Pickles db_export_group to a temporary file, fsyncs it and renames it to database_path.
+
+        Output:
+            checksum: str (see db_manifest.hashing_writer)
+        """
+        path_tmp = database_path + '.tmp'
+        with open(path_tmp,'wb') as handle:
+            writer = hashing_writer(handle)
+            pickle.dump(db_export_group, writer, protocol=pickle.HIGHEST_PROTOCOL)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(path_tmp,database_path)
+        return writer.checksum()
+
+    def db_prop_snapshot(self):
+        """
+        Returns a copy of db_prop that is not changed by following db_write calls
+        (dicts of all levels and list or dict values are copied, other values are shared).
+        """
+        def copy_value(value):
+            if isinstance(value,list): return list(value)
+            if isinstance(value,dict): return dict(value)
+            return value
+        db_prop_copy = {}
+        for db_base,base_prop in self.db_prop.items():
+            if db_base == 'super' or db_base == 'link':
+                db_prop_copy.update({db_base:{key:copy_value(value) for key,value in base_prop.items()}})
+            else:
+                db_prop_copy.update({db_base:{data_id:{key:copy_value(value) for key,value in d_prop.items()} for data_id,d_prop in base_prop.items()}})
+        return db_prop_copy
+
+    def save_db_sqlite(self,directory:str,overwrite:bool,with_data:bool,compact:bool=False):
+        """
+        This function saves db_prop to the SQLite file self.database_file (database_backend == 'sqlite').
+
+        If a db_sqlite_store is attached, only the rows changed by db_write since the last save are committed
+        (overwrite is ignored, like the journal-only saves of the pickle backend). With compact == True and
+        overwrite == False the last save is copied to a new timestamped file (e.g. database_20240101_120000.sqlite)
+        before, the attached file keeps the current state.
+        Otherwise the complete db_prop is written once to a new (overwrite == False) or the existing file
+        and the store is attached for the following saves. The copy of db_prop is written outside of self.db_lock,
+        rows written by db_write in the meantime are kept in self.db_store_pending and added before the store is attached.
+
+        Input:
+            directory: of self.database_file
+            overwrite: bool
+            with_data: bool
+
+        Optional Arguments:
+            compact: bool (default: False)
+        """
+        backup_path = None
+        with self.db_lock:
+            self.db_write([],'db_save_time',datetime.datetime.now(),super_prop=True)
+            if self.db_store != None:
+                store = None
+                if compact and not overwrite:
+                    proposed_filebase = self.database_file.split('.')[0]+'_'+datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+                    file_ending = self.database_file.split('.')[1]
+                    backup_path = directory+'\\'+fname_generator(directory,proposed_filebase,file_ending)
+                else:
+                    self.db_store.commit()
+            else:
+                if os.path.isfile(directory+'\\'+self.database_file) and not overwrite:
+                    proposed_filebase = self.database_file.split('.')[0]
+                    file_ending = self.database_file.split('.')[1]
+                    self.database_file = fname_generator(directory,proposed_filebase,file_ending)
+                store = db_sqlite_store(directory+'\\'+self.database_file)
+                db_prop_copy = self.db_prop_snapshot()
+                self.db_store_pending = []
+            data_ids = list(self.db_data.keys()) if with_data and self.database_data_store == 'mmap' else []
+            self.database_saved = True
+
+        if backup_path != None:
+            # The last save is kept in a new file before the changed rows are committed (like the snapshots of the pickle backend)
+            try:
+                self.db_store.backup(backup_path)
+                manifest = read_manifest(directory+'\\'+self.database_file)
+                if manifest != None:
+                    write_manifest(backup_path,**{key:manifest.get(key) for key in ['database_backend','db_save_time','file_count','with_data','checksum']})
+            except (sqlite3.Error,OSError) as e:
+                print('db_manager.save_db_sqlite: Error: could not back up '+self.database_file+': ',e)
+            with self.db_lock:
+                self.db_store.commit()
+
+        if store != None:
+            # The complete db_prop is written outside of self.db_lock, the rows written meanwhile are added afterwards
+            store.dump_db_prop(db_prop_copy)
+            with self.db_lock:
+                for record in self.db_store_pending:
+                    if len(record) == 2:
+                        store.delete(*record)
+                    else:
+                        store.write(*record)
+                store.commit()
+                self.db_store_pending = None
+                self.db_store = store
+
+        if with_data:
+            if self.database_data_store == 'mmap':
+                data_store_name = self.save_db_data_mmap(directory,data_ids)
+                with self.db_lock:
+                    self.db_store.write_meta('db_data_store',data_store_name)
+                    self.database_snapshot_with_data = True
+            else:
+                print('db_manager.save_db_sqlite: db_data is only stored with database_data_store = "mmap" in the SQLite backend.')
+        with self.db_lock:
+            self.save_db_manifest(directory)
+
+        print('db_manager.save_db_sqlite: directory: ',directory, ' self.database_file: ',self.database_file, ' overwrite: ',overwrite)
     
+    def save_db_manifest(self,directory:str):
+        """
+        Writes the manifest of self.database_file (see db_manifest) with the save time, the number of files,
+        whether data is included and the checksum of the snapshot. newest_db and load_db(database_check=True)
+        read only the manifest.
+        """
+        write_manifest(directory+'\\'+self.database_file,
+                       database_backend=self.database_backend,
+                       db_save_time=self.db_get('super','db_save_time',super_prop=True),
+                       file_count=len(self.db_prop['data_prop']),
+                       with_data=self.database_snapshot_with_data,
+                       checksum=self.database_snapshot_checksum if self.database_backend == 'pickle' else None)
+
+    def save_db_data_mmap(self,directory:str,data_ids:list):
+        """
+        This function appends the signals of the spm objects of data_ids in db_data, that are not yet stored, to the
+        memory-mapped container next to self.database_file (see db_array_store) and replaces them in self.db_data by
+        their mapped versions (unless they were replaced in the meantime). The spm objects are loaded and written one
+        at a time, evicted spm objects that are stored in the container are not loaded.
+
+        Input:
+            directory: of self.database_file
+            data_ids: list of data_id (taken from self.db_data under self.db_lock)
+        Output:
+            data_store_name: str (filename of the container without file ending)
+        """
+        data_store_name = self.database_file.split('.')[0] + '_data'
+        store = db_array_store(directory+'\\'+data_store_name)
+        spm_objects_old = {} # {data_id:weakref of the written spm object}
+
+        def items():
+            for data_id in data_ids:
+                evicted_store = self.db_data.evicted_store(data_id)
+                if evicted_store != None and evicted_store.path_base == store.path_base and data_id in store.index:
+                    continue
+                spm_object = self.db_data.get(data_id)
+                if spm_object is not None:
+                    spm_objects_old.update({data_id:weakref.ref(spm_object)})
+                    yield data_id,spm_object
+
+        for data_id,spm_object in store.write_items(items()).items():
+            spm_object_old = spm_objects_old[data_id]()
+            if spm_object_old is not None:
+                self.db_data.replace(data_id,spm_object_old,spm_object)
+        return data_store_name
+
     def load_db(self,directory: str,**kwargs):
         """
         This function loads the db_prop and (db_data, if available)
@@ -732,19 +1469,85 @@ class db_manager():
         else:
             contains_data_check = False
 
-        # Load pickle file
-        with open(directory+'\\'+self.database_file, 'rb') as handle:
-            db_export_group = pickle.load(handle)
-        
-        # Extract db_prop and db_data
-        db_prop_loaded = db_export_group['db_prop']
-        is_this_a_database = db_export_group['this_is_a_database_for_the_databrowser']
-        if 'db_data' in db_export_group:
-            does_it_contain_data = True
-            db_data_loaded = db_export_group['db_data']
+        # Checks are answered by the manifest without reading the database
+        manifest = read_manifest(directory+'\\'+self.database_file)
+        if manifest != None and (database_check == True or contains_data_check == True):
+            is_this_a_database = True
+            does_it_contain_data = manifest.get('with_data') == True
+            if database_check == True and contains_data_check == True:
+                return is_this_a_database, does_it_contain_data
+            if database_check == True:
+                return is_this_a_database
+            return does_it_contain_data
+
+        if self.database_backend_from_file(self.database_file) == 'sqlite':
+            # Open SQLite file, db_prop is only read if it is returned
+            path = directory+'\\'+self.database_file
+            if db_sqlite_store.is_sqlite_file(path):
+                store = db_sqlite_store(path)
+                is_this_a_database = store.is_database()
+                data_store_name = store.read_meta('db_data_store')
+                if database_check == False and contains_data_check == False:
+                    db_prop_loaded = self.db_prop_without_derived(store.read_db_prop())
+                else:
+                    db_prop_loaded = {}
+                store.close()
+            else:
+                is_this_a_database = False
+                data_store_name = None
+                db_prop_loaded = {}
+            if data_store_name != None:
+                does_it_contain_data = True
+                if database_check == False and contains_data_check == False:
+                    db_data_loaded = db_array_store(directory+'\\'+data_store_name).load_db_data()
+                else:
+                    db_data_loaded = {}
+            else:
+                does_it_contain_data = False
+                db_data_loaded = {}
+            if database_check == False and contains_data_check == False:
+                self.database_snapshot_with_data = does_it_contain_data
         else:
-            does_it_contain_data = False
-            db_data_loaded = {}
+            # Load pickle file (the checksum is compared with the manifest)
+            with open(directory+'\\'+self.database_file, 'rb') as handle:
+                reader = hashing_reader(handle)
+                db_export_group = pickle.load(reader)
+                checksum = reader.checksum()
+            if manifest != None and manifest.get('checksum') != None and manifest['checksum'] != checksum:
+                print('db_manager.load_db: WARNING: checksum of ',self.database_file,' does not match its manifest.')
+            
+            # Extract db_prop and db_data
+            db_prop_loaded = db_export_group['db_prop']
+            is_this_a_database = db_export_group['this_is_a_database_for_the_databrowser']
+
+            # Replay the journal of the snapshot
+            if database_check == False and contains_data_check == False and 'snapshot_id' in db_export_group:
+                self.database_snapshot_id = db_export_group['snapshot_id']
+                if db_export_group.get('parent_file') not in [None,self.database_file]:
+                    # journal of a snapshot that was saved under a new name, if it was not moved yet
+                    self.db_journal_move(directory,db_export_group['parent_file'],self.database_snapshot_id)
+                number_of_records = self.db_journal_replay(directory,db_prop_loaded,self.database_snapshot_id)
+                if number_of_records > 0:
+                    print('db_manager.load_db: ',number_of_records,' changes replayed from journal.')
+            db_prop_loaded = self.db_prop_without_derived(db_prop_loaded)
+
+            if 'db_data' in db_export_group:
+                does_it_contain_data = True
+                db_data_loaded = db_export_group['db_data']
+            elif 'db_data_store' in db_export_group:
+                # Arrays are mapped lazily from the db_array_store container
+                does_it_contain_data = True
+                if database_check == False and contains_data_check == False:
+                    db_data_loaded = db_array_store(directory+'\\'+db_export_group['db_data_store']).load_db_data()
+                else:
+                    db_data_loaded = {}
+            else:
+                does_it_contain_data = False
+                db_data_loaded = {}
+            if database_check == False and contains_data_check == False:
+                self.database_snapshot_data_ids = set(db_data_loaded.keys())
+                self.database_snapshot_with_data = does_it_contain_data
+                self.database_snapshot_checksum = checksum
 
         # Returns
         if database_check == True:
@@ -769,13 +1572,7 @@ class db_manager():
             file_type_found: True if any file_type is found, False if not
         """
 
-        all_data_ids = self.db_get_all_ids()
-        data_id_with_wanted_file_type= []
-
-        for data_id in all_data_ids:
-            file_type = self.db_get(data_id,'filename_ending')
-            if file_type == wanted_file_type:
-                data_id_with_wanted_file_type.append(data_id)
+        data_id_with_wanted_file_type = self.db_index.ids_with_ending(wanted_file_type)
         if len(data_id_with_wanted_file_type) == 0:
             print("db_manager.file_type_finder: no files of type: ", wanted_file_type, " found")
             file_type_found = False
@@ -785,7 +1582,7 @@ class db_manager():
     
     def newest_db(self,directory: str,**kargs):
         """
-        This function returns the newest database file with the ending '.pickle' by checking 'super_prop' 'db_save_time' in the specified directory.
+        This function returns the newest database file with the ending '.pickle' or '.sqlite' by checking 'super_prop' 'db_save_time' in the specified directory.
 
         Input:
             directory: str (folder_path)
@@ -809,18 +1606,40 @@ class db_manager():
             print('db_manager.newest_db: directory is not a folder.')
             return None
         
-        # Search for pickle files in directory
+        # Search for pickle and sqlite files in directory
         all_files = os.listdir(directory)
         pickle_files = [f for f in all_files if f.split('.')[-1] == 'pickle']
+        sqlite_files = [f for f in all_files if f.split('.')[-1] == 'sqlite']
         if print_pickle_files:
             print('db_manager.newest_db: pickle_files: ',pickle_files)
-        if len(pickle_files) == 0:
+            print('db_manager.newest_db: sqlite_files: ',sqlite_files)
+        if len(pickle_files) == 0 and len(sqlite_files) == 0:
             return None
         
 
-        # Find newest pickle file
+        # Find newest database file (from the manifests, databases without a valid manifest are read)
         db_save_times = []
         db_names = []
+        for db in sqlite_files + pickle_files:
+            manifest = read_manifest(directory+'\\'+db)
+            if manifest != None and manifest.get('db_save_time') != None:
+                db_save_times.append(manifest['db_save_time'])
+                db_names.append(db)
+        sqlite_files = [db for db in sqlite_files if db not in db_names]
+        pickle_files = [db for db in pickle_files if db not in db_names]
+        for db in sqlite_files:
+            # Only the db_save_time row is read
+            if not db_sqlite_store.is_sqlite_file(directory+'\\'+db):
+                print('db_manager.newest_db: ',db,' is not a SQLite file.')
+                continue
+            store = db_sqlite_store(directory+'\\'+db)
+            db_save_time = store.read_property('super',None,'db_save_time')
+            store.close()
+            if db_save_time != None:
+                db_save_times.append(db_save_time)
+                db_names.append(db)
+            else:
+                print('db_manager.newest_db: ',db,' does not contain db_save_time.')
         for db in pickle_files:
             with open(directory+'\\'+db, 'rb') as handle:
                 db_export_group = pickle.load(handle)
@@ -849,6 +1668,130 @@ class db_manager():
 
         return newest_db
 
+    def set_database_backend(self,backend:str):
+        """
+        Selects the storage backend of db_prop and the corresponding default self.database_file.
+
+        Input:
+            backend: str ('pickle' or 'sqlite')
+        """
+        if backend not in ['pickle','sqlite']:
+            raise ValueError('db_manager.set_database_backend: backend must be "pickle" or "sqlite"')
+        if backend != self.database_backend:
+            self.db_store_close()
+            self.db_journal_close()
+        self.database_backend = backend
+        self.database_file = '_database.' + backend
+
+    def database_backend_from_file(self,filename:str):
+        """
+        Returns the storage backend ('pickle' or 'sqlite') of a database file by its file ending.
+        """
+        if filename.split('.')[-1] == 'sqlite':
+            return 'sqlite'
+        return 'pickle'
+
+    def db_store_attach(self,path:str):
+        """
+        Opens the SQLite file at path as self.db_store. All following db_write calls are persisted to it.
+        """
+        self.db_store_close()
+        self.db_store = db_sqlite_store(path)
+
+    def db_store_close(self):
+        """Closes self.db_store (if attached)"""
+        if self.db_store != None:
+            self.db_store.close()
+            self.db_store = None
+
+    def db_journal_path(self,directory:str,slot=None,database_file=None):
+        """
+        Returns the path of the journal of database_file (default: self.database_file) in slot
+        (0 or 1, default: self.database_journal_slot)
+        """
+        if slot == None:
+            slot = self.database_journal_slot
+        if database_file == None:
+            database_file = self.database_file
+        return directory+'\\'+database_file.split('.')[0]+['.journal','.journal.1'][slot]
+
+    def db_journal_attach(self,directory:str):
+        """
+        Opens the journal of the loaded snapshot for appending. If it does not belong to the snapshot
+        (or changes of an unfinished snapshot were replayed), no journal is attached and the next save_db writes a new snapshot.
+        """
+        self.db_journal_close()
+        if self.database_journal_child_replayed:
+            return
+        journal = db_journal(self.db_journal_path(directory))
+        if self.database_snapshot_id != None and journal.open_append(self.database_snapshot_id):
+            self.db_journal = journal
+
+    def db_journal_switch(self,directory:str,snapshot_id):
+        """
+        Starts the journal of the new snapshot snapshot_id in the other journal slot. The journal of the current
+        snapshot is kept, such that the current snapshot stays complete until the new snapshot is written.
+        """
+        parent_snapshot_id = self.database_snapshot_id
+        self.db_journal_close()
+        self.database_journal_slot = 1 - self.database_journal_slot
+        self.db_journal = db_journal(self.db_journal_path(directory))
+        self.db_journal.reset(snapshot_id,parent_snapshot_id)
+        self.database_journal_child_replayed = False
+
+    def db_journal_move(self,directory:str,parent_file:str,snapshot_id):
+        """
+        Moves the journal of snapshot_id from the journal slots of parent_file to the same slot of self.database_file.
+        The journal of a snapshot that is saved under a new name (overwrite == False) is started next to its parent,
+        such that the parent replays it if the new snapshot is never written (see save_db).
+        """
+        self.db_journal_close()
+        for slot in [0,1]:
+            journal_path = self.db_journal_path(directory,slot,parent_file)
+            header = db_journal(journal_path).header()
+            if header != None and header.get('snapshot') == snapshot_id:
+                os.replace(journal_path,self.db_journal_path(directory,slot))
+                self.database_journal_slot = slot
+
+    def db_journal_replay(self,directory:str,db_prop:dict,snapshot_id):
+        """
+        Applies the journal of snapshot_id and the journal of an unfinished child snapshot (if any) to db_prop.
+
+        Output:
+            number_of_records: int
+        """
+        number_of_records = 0
+        self.database_journal_slot = 0
+        self.database_journal_child_replayed = False
+        for slot in [0,1]:
+            header = db_journal(self.db_journal_path(directory,slot)).header()
+            if header != None and header.get('snapshot') == snapshot_id:
+                number_of_records += db_journal(self.db_journal_path(directory,slot)).replay(db_prop,snapshot_id)
+                self.database_journal_slot = slot
+        for slot in [0,1]:
+            header = db_journal(self.db_journal_path(directory,slot)).header()
+            if header != None and header.get('parent') == snapshot_id and header.get('snapshot') != snapshot_id:
+                number_of_records += db_journal(self.db_journal_path(directory,slot)).replay(db_prop,snapshot_id,child=True)
+                self.database_journal_child_replayed = True
+        return number_of_records
+
+    def db_journal_close(self):
+        """Closes self.db_journal (if attached)"""
+        if self.db_journal != None:
+            self.db_journal.close()
+            self.db_journal = None
+
+    def db_prop_without_derived(self,db_prop):
+        """
+        Removes the derived super properties (see self.derived_super_keys) from a loaded db_prop. Databases of older
+        versions stored them in the snapshot, the journal or the SQLite file; they are rebuilt from the indexes
+        after the load (db_prop['data_prop'] is ordered by time by filetime_sorter, see create).
+        """
+        if 'super' in db_prop:
+            for display_property in self.derived_super_keys:
+                db_prop['super'].pop(display_property,None)
+        return db_prop
+
     def db_get_unused_link_property_name(self,proposed_name):
         """
         This function returns an unused link_property name based on the proposed_name.
@@ -872,4 +1815,69 @@ class db_manager():
                     i += 1
 
 
-    
\ No newline at end of file
+    
+
+def ingest_benchmark(directory:str,filename:str,sizes=(1000,5000,20000),repeats=10,**params):
+    """
+    Measures the time of db_manager.add_new_elements for a single new file in databases of different sizes.
+    The database is filled with copies of the display properties of filename (other data_ids and times, sharing
+    the loaded file), then filename is deleted and added again repeats times.
+
+    Input:
+        directory: str
+        filename: str, filename_full of a sxm or dat file in directory
+    Optional Arguments:
+        sizes: numbers of files in the database (default: (1000,5000,20000))
+        repeats: the median time of repeats runs is reported
+        show: print the results (default: True)
+
+    Output:
+        times: dict {size:{'add_new_elements':s,'filetime_sorter_full':s}}
+    """
+    if 'show' in params: show = params['show']
+    else: show = True
+
+    db = db_manager()
+    d_meta = db.file_meta(directory,filename)
+    if d_meta == None:
+        print('db_manager.ingest_benchmark: Error: file not found: ',directory,filename)
+        return None
+    db.directory = directory
+    db.create_super_properties()
+    db.add_new_elements(directory,[d_meta])
+    d_prop = dict(db.db_prop['data_prop'][filename])
+    loaded = db.db_data[filename]
+
+    times = {}
+    number_files = 1
+    for size in sorted(sizes):
+        # Fill the database with copies of filename, older than filename
+        for i in range(number_files,size):
+            data_id = 'benchmark_'+str(i)+'.'+d_meta['filename_ending']
+            write_data_id = True
+            for display_property,display_property_value in d_prop.items():
+                if display_property == 'filename_full': display_property_value = data_id
+                if display_property == 'file_modified_date': display_property_value = d_meta['file_modified_date'] - i
+                db.db_write(data_id,display_property,copy.copy(display_property_value),write_data_id=write_data_id,write_display_property=True)
+                write_data_id = False
+            db.db_data.update({data_id:loaded})
+        number_files = size
+        db.filetime_sorter()
+
+        # Add filename again, the file itself is read from db.file_cache
+        seconds = []
+        for _ in range(repeats):
+            db.db_delete(filename)
+            start = time.perf_counter()
+            db.add_new_elements(directory,[d_meta])
+            seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        db.filetime_sorter()
+        seconds_full = time.perf_counter() - start
+        times.update({size:{'add_new_elements':float(np.median(seconds)),'filetime_sorter_full':seconds_full}})
+
+    if show:
+        for size,size_times in times.items():
+            print('db_manager.ingest_benchmark: '+str(size)+' files: add_new_elements '+f"{size_times['add_new_elements']*1e3:.2f}"+' ms, '
+                  'full filetime_sorter '+f"{size_times['filetime_sorter_full']*1e3:.2f}"+' ms')
+    return times
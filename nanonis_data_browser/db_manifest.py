@@ -0,0 +1,134 @@
+"""
+Description:    database manifest sidecar for the db_manager of the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import os
+import json
+import hashlib
+import datetime
+
+manifest_version = 1
+schema_version = 1 # version of the db_prop layout
+
+
+def manifest_path(database_path:str):
+    """Returns the path of the manifest of the database file at database_path"""
+    return database_path + '.manifest'
+
+
+def write_manifest(database_path:str,**fields):
+    """
+    Writes the manifest of the database file at database_path (temporary file + atomic replace).
+
+    Input:
+        database_path: str
+
+    Optional Arguments (stored in the manifest):
+        database_backend: 'pickle' or 'sqlite'
+        db_save_time: datetime.datetime
+        file_count: int (number of data_ids in db_prop['data_prop'])
+        with_data: bool
+        checksum: str (checksum of the snapshot, see hashing_writer) or None
+    """
+    manifest = {'manifest_version':manifest_version,
+                'schema_version':schema_version,
+                'database_file':os.path.basename(database_path.replace('\\','/')),
+                'snapshot_size':os.path.getsize(database_path) if os.path.isfile(database_path) else None}
+    for key,value in fields.items():
+        if isinstance(value,datetime.datetime):
+            value = value.isoformat()
+        manifest.update({key:value})
+
+    path = manifest_path(database_path)
+    path_tmp = path + '.tmp'
+    with open(path_tmp,'w') as handle:
+        json.dump(manifest,handle)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(path_tmp,path)
+
+
+def read_manifest(database_path:str):
+    """
+    Reads the manifest of the database file at database_path. Only the manifest and the size of the database
+    file are read.
+
+    Output:
+        manifest: dict (db_save_time as datetime.datetime) or None if there is no valid manifest
+                  (missing, unreadable, other version or the size of a pickle snapshot does not match)
+    """
+    path = manifest_path(database_path)
+    if not os.path.isfile(path) or not os.path.isfile(database_path):
+        return None
+    try:
+        with open(path,'r') as handle:
+            manifest = json.load(handle)
+    except (OSError,ValueError):
+        return None
+    if not isinstance(manifest,dict) or manifest.get('manifest_version') != manifest_version:
+        return None
+    if manifest.get('database_backend') == 'pickle' and manifest.get('snapshot_size') != os.path.getsize(database_path):
+        # The snapshot was written after the manifest (or by an older version)
+        return None
+    if manifest.get('db_save_time') != None:
+        try:
+            manifest['db_save_time'] = datetime.datetime.fromisoformat(manifest['db_save_time'])
+        except (TypeError,ValueError):
+            return None
+    return manifest
+
+
+class hashing_writer():
+    """
+    File wrapper that computes the checksum of all bytes written through it (e.g. by pickle.dump).
+
+    Input:
+        handle: binary file opened for writing
+    """
+
+    def __init__(self,handle):
+        self.handle = handle
+        self.hash = hashlib.blake2b(digest_size=16)
+
+    def write(self,data):
+        self.hash.update(data)
+        return self.handle.write(data)
+
+    def checksum(self):
+        return 'blake2b:' + self.hash.hexdigest()
+
+
+class hashing_reader():
+    """
+    File wrapper that computes the checksum of all bytes read through it (e.g. by pickle.load).
+
+    Input:
+        handle: binary file opened for reading
+    """
+
+    def __init__(self,handle):
+        self.handle = handle
+        self.hash = hashlib.blake2b(digest_size=16)
+
+    def read(self,size=-1):
+        data = self.handle.read(size)
+        self.hash.update(data)
+        return data
+
+    def readline(self,size=-1):
+        data = self.handle.readline(size)
+        self.hash.update(data)
+        return data
+
+    def readinto(self,buffer):
+        size = self.handle.readinto(buffer)
+        self.hash.update(memoryview(buffer)[:size])
+        return size
+
+    def checksum(self):
+        """Checksum of the whole file (the rest of the file is read first)"""
+        while len(self.read(1024*1024)) > 0:
+            pass
+        return 'blake2b:' + self.hash.hexdigest()
@@ -0,0 +1,308 @@
+"""
+Description:    columnar metadata table and filter/sort expressions for the db_manager of the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import ast
+import re
+import datetime
+import operator
+import numpy as np
+import spmpy_terry as spmpy
+
+
+# Numeric parameters of spmpy (ParamNickname with a scaling), in the units of spm.get_param
+metadata_params = [(d['ParamNickname'],d['ParamName'],d['ParamScaling']) for d in spmpy.ParamListReference if d['ParamScaling'] != 'na']
+
+metadata_dtype = np.dtype([('ending','U3'),('time','f8'),('width','f8'),('height','f8'),('pixels_x','i4'),('pixels_y','i4'),
+                           ('offset_x','f8'),('offset_y','f8'),('acquisition_time','f8')]
+                          + [(nickname,'f8') for nickname,_,_ in metadata_params])
+
+# version of extract_metadata, the metadata of files extracted by an older version is extracted again
+metadata_version = 3
+
+metadata_missing = np.zeros((),dtype=metadata_dtype) # row of a data_id without metadata
+for name in metadata_dtype.names:
+    metadata_missing[name] = '' if name == 'ending' else (-1 if name in ['pixels_x','pixels_y'] else np.nan)
+
+metadata_functions = {'abs':np.abs,'sqrt':np.sqrt,'log10':np.log10,'isnan':np.isnan,'min':np.minimum,'max':np.maximum}
+
+
+def extract_metadata(spm_object):
+    """
+    Extracts the numeric header parameters of spm_object (only the header is used, the data is not loaded).
+
+    Input:
+        spm_object: spmpy_terry.spm
+    Output:
+        metadata: dict {ParamNickname:float,...,'width':float (nm),'height':float (nm),'pixels_x':int,'pixels_y':int,
+                  'offset_x':float (nm),'offset_y':float (nm),'acquisition_time':float (s since the epoch),
+                  'metadata_version':int},
+                  parameters that are not in the header are missing
+    """
+    header = spm_object.header
+    metadata = {'metadata_version':metadata_version}
+    for nickname,name,scaling in metadata_params:
+        value = header.get(name)
+        if value is None:
+            value = header.get(name.lower()) # nanonispy lowercases the keys of .sxm headers
+        try:
+            metadata.update({nickname:float(value)*scaling})
+        except (TypeError,ValueError):
+            pass
+
+    if spm_object.type == 'scan':
+        try:
+            scanfield = header['scan>scanfield'].split(';')
+            metadata.update({'width':float(scanfield[2])*10**9,'height':float(scanfield[3])*10**9})
+        except (KeyError,IndexError,ValueError,AttributeError):
+            try:
+                metadata.update({'width':float(header['scan_range'][0])*10**9,'height':float(header['scan_range'][1])*10**9})
+            except (KeyError,IndexError,TypeError,ValueError):
+                pass
+        try:
+            metadata.update({'offset_x':float(header['scan_offset'][0])*10**9,'offset_y':float(header['scan_offset'][1])*10**9})
+        except (KeyError,IndexError,TypeError,ValueError):
+            pass
+        try:
+            metadata.update({'pixels_x':int(header['scan_pixels'][0]),'pixels_y':int(header['scan_pixels'][1])})
+        except (KeyError,IndexError,TypeError,ValueError):
+            pass
+
+    # acquisition time: 'rec_date' and 'rec_time' of .sxm files, 'Date' of .dat files (local time of the measurement computer)
+    if spm_object.type == 'scan':
+        date = str(header.get('rec_date','')).strip() + ' ' + str(header.get('rec_time','')).strip()
+    else:
+        date = str(header.get('Date','')).strip()
+    try:
+        metadata.update({'acquisition_time':datetime.datetime.strptime(date,'%d.%m.%Y %H:%M:%S').timestamp()})
+    except ValueError:
+        pass
+    return metadata
+
+
+class db_metadata():
+    """
+    db_metadata keeps the header parameters of all files in a columnar table (NumPy structured array, one row
+    per data_id) that is updated by db_manager.db_write and db_delete (display properties 'metadata',
+    'filename_ending' and 'file_modified_date'). Missing values are NaN (-1 for pixels_x and pixels_y).
+
+    Columns:
+        ending ('sxm' or 'dat'), time (file_modified_date), width, height (nm), pixels_x, pixels_y, offset_x,
+        offset_y (nm, center of a scan frame), acquisition_time (header, s since the epoch) and the numeric spm.ParamNickname parameters (e.g. V, setpoint,
+        temperature, x, y) in the units of spm.get_param
+
+    self.version is increased with every change of the table (see db_spatial_index).
+
+    Expressions (see query):
+        "<filter> sort <key> [desc]", filter and sort are optional
+        filter: comparisons of columns and numbers (<, <=, >, >=, ==, !=, also chained), combined with and, or, not,
+                arithmetic (+, -, *, /, **) and the functions abs, sqrt, log10, isnan, min, max
+        Examples:
+            "abs(V) < 0.05 and temperature < 6"
+            "ending == 'sxm' and width >= 20 sort time desc"
+            "sort abs(V)"
+
+    External Functions:
+        rebuild(db_prop): Creates the table of all data_ids of db_prop['data_prop']
+        update(data_id,display_property,display_property_value): Called by db_write
+        remove(data_id): Called by db_delete
+        query(expression): Returns the data_ids that match the expression (sorted if the expression has a sort key)
+        columns(): Returns the column names
+    """
+
+    def __init__(self):
+        self.table = np.zeros(0,dtype=metadata_dtype)
+        self.data_ids = np.zeros(0,dtype=object)
+        self.rows = {} # {data_id:row}
+        self.length = 0
+        self.version = 0
+
+    def rebuild(self,db_prop:dict):
+        """Creates the table of all data_ids of db_prop['data_prop'] (after db_prop was replaced)"""
+        d_props = list(db_prop['data_prop'].values())
+        self.version += 1
+        self.length = len(d_props)
+        self.table = np.full(max(1024,self.length),metadata_missing,dtype=metadata_dtype)
+        self.data_ids = np.zeros(len(self.table),dtype=object)
+        self.data_ids[:self.length] = list(db_prop['data_prop'].keys())
+        self.rows = {data_id:row for row,data_id in enumerate(db_prop['data_prop'].keys())}
+
+        # Fill the table column by column
+        self.table['ending'][:self.length] = [d_prop.get('filename_ending') or '' for d_prop in d_props]
+        self.table['time'][:self.length] = [d_prop.get('file_modified_date',np.nan) for d_prop in d_props]
+        metadata = [d_prop.get('metadata') or {} for d_prop in d_props]
+        for name in metadata_dtype.names:
+            if name not in ['ending','time']:
+                self.table[name][:self.length] = [d_metadata.get(name,metadata_missing[name]) for d_metadata in metadata]
+
+    def columns(self):
+        return list(metadata_dtype.names)
+
+    def values(self,data_ids,column:str):
+        """Returns the array of column for data_ids (missing value for data_ids that are not in the table)"""
+        rows = np.array([self.rows.get(data_id,-1) for data_id in data_ids],dtype=int)
+        values = self.table[column][rows] if self.length > 0 else np.full(len(rows),metadata_missing[column])
+        values[rows < 0] = metadata_missing[column]
+        return values
+
+    ### Update ###
+
+    def row(self,data_id):
+        """Returns the row of data_id (a new empty row is appended if data_id is not in the table)"""
+        row = self.rows.get(data_id)
+        if row is None:
+            if self.length == len(self.table):
+                capacity = max(1024,2*len(self.table))
+                table = np.full(capacity,metadata_missing,dtype=metadata_dtype)
+                table[:self.length] = self.table[:self.length]
+                data_ids = np.zeros(capacity,dtype=object)
+                data_ids[:self.length] = self.data_ids[:self.length]
+                self.table,self.data_ids = table,data_ids
+            row = self.length
+            self.table[row] = metadata_missing
+            self.data_ids[row] = data_id
+            self.rows.update({data_id:row})
+            self.length += 1
+        return row
+
+    def update(self,data_id,display_property:str,display_property_value):
+        """Updates the row of data_id (other display properties are ignored)"""
+        if display_property in ['metadata','filename_ending','file_modified_date']:
+            self.version += 1
+        if display_property == 'metadata':
+            row = self.row(data_id)
+            ending,time = self.table['ending'][row],self.table['time'][row]
+            self.table[row] = metadata_missing
+            self.table['ending'][row],self.table['time'][row] = ending,time
+            if display_property_value != None:
+                for name,value in display_property_value.items():
+                    if name in self.table.dtype.names:
+                        self.table[name][row] = value
+        elif display_property == 'filename_ending':
+            row = self.row(data_id)
+            self.table['ending'][row] = display_property_value
+        elif display_property == 'file_modified_date':
+            row = self.row(data_id)
+            self.table['time'][row] = display_property_value
+
+    def remove(self,data_id):
+        """Removes the row of data_id (the last row is moved into its place)"""
+        row = self.rows.pop(data_id,None)
+        if row is None:
+            return
+        self.version += 1
+        last = self.length - 1
+        if row != last:
+            self.table[row] = self.table[last]
+            self.data_ids[row] = self.data_ids[last]
+            self.rows.update({self.data_ids[row]:row})
+        self.data_ids[last] = None
+        self.length = last
+
+    ### Query ###
+
+    def query(self,expression:str):
+        """
+        Returns the data_ids that match the filter of expression, sorted by its sort key (NaN last) or in table order.
+
+        Input:
+            expression: str, "<filter> sort <key> [desc]" (see class docstring)
+        Output:
+            data_ids: list
+        Raises:
+            ValueError if the expression is not valid
+        """
+        filter_expression,sort_expression,descending = self.split_expression(expression)
+        table = self.table[:self.length]
+
+        if filter_expression == '':
+            rows = np.arange(self.length)
+        else:
+            mask = self.evaluate(filter_expression,table)
+            if np.ndim(mask) == 0:
+                mask = np.full(self.length,bool(mask))
+            if mask.dtype != bool:
+                raise ValueError('db_metadata.query: filter is not a condition: '+filter_expression)
+            rows = np.flatnonzero(mask)
+
+        if sort_expression != '':
+            key = np.broadcast_to(self.evaluate(sort_expression,table),(self.length,))[rows]
+            if key.dtype.kind == 'f':
+                order = np.lexsort((-key if descending else key,np.isnan(key)))
+            else:
+                order = np.argsort(key,kind='stable')
+                if descending:
+                    order = order[::-1]
+            rows = rows[order]
+        return self.data_ids[rows].tolist()
+
+    def split_expression(self,expression:str):
+        """Splits expression into (filter, sort key, descending)"""
+        parts = re.split(r'(?:^|\s)sort\s',' '+expression.strip()+' ')
+        if len(parts) > 2:
+            raise ValueError('db_metadata.query: more than one sort in: '+expression)
+        filter_expression = parts[0].strip()
+        sort_expression = parts[1].strip() if len(parts) == 2 else ''
+        descending = False
+        for suffix,is_descending in [(' desc',True),(' asc',False)]:
+            if sort_expression.endswith(suffix):
+                sort_expression = sort_expression[:-len(suffix)].strip()
+                descending = is_descending
+        if len(parts) == 2 and sort_expression == '':
+            raise ValueError('db_metadata.query: sort without key in: '+expression)
+        return filter_expression,sort_expression,descending
+
+    def evaluate(self,expression:str,table):
+        """Evaluates expression on the columns of table (only the syntax described in the class docstring)"""
+        try:
+            node = ast.parse(expression,mode='eval').body
+        except SyntaxError as e:
+            raise ValueError('db_metadata.query: invalid expression: '+expression+' ('+str(e.msg)+')')
+        return self.evaluate_node(node,table)
+
+    def evaluate_node(self,node,table):
+        if isinstance(node,ast.Name):
+            if node.id not in table.dtype.names:
+                raise ValueError('db_metadata.query: unknown column: '+node.id+' (columns: '+', '.join(table.dtype.names)+')')
+            return table[node.id]
+        if isinstance(node,ast.Constant) and isinstance(node.value,(int,float,str)) and not isinstance(node.value,bool):
+            return node.value
+        if isinstance(node,ast.UnaryOp):
+            operand = self.evaluate_node(node.operand,table)
+            if isinstance(node.op,ast.Not): return self.apply(node,np.logical_not,operand)
+            if isinstance(node.op,ast.USub): return self.apply(node,np.negative,operand)
+            if isinstance(node.op,ast.UAdd): return operand
+        if isinstance(node,ast.BoolOp):
+            values = [self.evaluate_node(value,table) for value in node.values]
+            if isinstance(node.op,ast.And): return self.apply(node,np.logical_and.reduce,values)
+            return self.apply(node,np.logical_or.reduce,values)
+        if isinstance(node,ast.BinOp):
+            binary_operators = {ast.Add:operator.add,ast.Sub:operator.sub,ast.Mult:operator.mul,ast.Div:operator.truediv,ast.Pow:operator.pow}
+            if type(node.op) in binary_operators:
+                return self.apply(node,binary_operators[type(node.op)],self.evaluate_node(node.left,table),self.evaluate_node(node.right,table))
+        if isinstance(node,ast.Compare):
+            compare_operators = {ast.Lt:operator.lt,ast.LtE:operator.le,ast.Gt:operator.gt,ast.GtE:operator.ge,ast.Eq:operator.eq,ast.NotEq:operator.ne}
+            result = True
+            left = self.evaluate_node(node.left,table)
+            for op,comparator in zip(node.ops,node.comparators):
+                if type(op) not in compare_operators:
+                    break
+                right = self.evaluate_node(comparator,table)
+                result = np.logical_and(result,self.apply(node,compare_operators[type(op)],left,right))
+                left = right
+            else:
+                return result
+        if isinstance(node,ast.Call) and isinstance(node.func,ast.Name) and node.func.id in metadata_functions and len(node.keywords) == 0:
+            return self.apply(node,metadata_functions[node.func.id],*[self.evaluate_node(arg,table) for arg in node.args])
+        raise ValueError('db_metadata.query: not supported: '+ast.unparse(node))
+
+    def apply(self,node,function,*args):
+        # function(*args) of node, NumPy errors of wrong operands (e.g. a text column compared with a number,
+        # TypeError or numpy UFuncTypeError) are raised as ValueError
+        try:
+            with np.errstate(invalid='ignore',divide='ignore'):
+                return function(*args)
+        except TypeError as e:
+            raise ValueError('db_metadata.query: invalid operands in: '+ast.unparse(node)+' ('+str(e)+')')
@@ -0,0 +1,113 @@
+"""
+Description:    spatial index of the scan frames for the db_manager of the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import numpy as np
+import spmpy_terry as spmpy
+
+
+class db_spatial_index():
+    """
+    db_spatial_index keeps the frames of all scans of db_metadata (rotated rectangles: center offset_x, offset_y,
+    width, height in nm and angle in deg) and returns the scans that contain a set of positions (e.g. of spectra)
+    in one vectorized query.
+
+    The frames are sorted by the left edge of their axis aligned bounding box, a query only tests the frames whose
+    bounding box can contain a position (binary search) before the exact test in the rotated frame. The index is
+    rebuilt from db_metadata on the first query after the table changed (see db_metadata.version).
+
+    Input:
+        metadata: db_metadata
+
+    External Functions:
+        query(positions): Returns the scans that contain the positions and the relative coordinates
+        frames(): Returns the number of indexed scan frames
+    """
+
+    def __init__(self,metadata):
+        self.metadata = metadata
+        self.version = None
+        self.data_ids = np.zeros(0,dtype=object)
+        self.frame = {name:np.zeros(0) for name in ['offset_x','offset_y','width','height','angle','pixels_x','pixels_y','time']}
+        self.x_min = np.zeros(0)
+        self.x_max = np.zeros(0)
+        self.y_min = np.zeros(0)
+        self.y_max = np.zeros(0)
+        self.max_width = 0.0
+
+    def rebuild(self):
+        """Indexes the frames of all scans of db_metadata"""
+        table = self.metadata.table[:self.metadata.length]
+        data_ids = self.metadata.data_ids[:self.metadata.length]
+        valid = (table['ending'] == 'sxm') & np.isfinite(table['offset_x']) & np.isfinite(table['offset_y']) \
+                & (table['width'] > 0) & (table['height'] > 0)
+        table = table[valid]
+        angle = np.nan_to_num(table['angle'])
+
+        # bounding boxes of the rotated frames
+        radians = angle*np.pi/180
+        half_x = (np.abs(np.cos(radians))*table['width'] + np.abs(np.sin(radians))*table['height'])/2
+        half_y = (np.abs(np.sin(radians))*table['width'] + np.abs(np.cos(radians))*table['height'])/2
+        order = np.argsort(table['offset_x'] - half_x,kind='stable')
+
+        self.data_ids = data_ids[valid][order]
+        self.frame = {name:table[name][order].astype(float) for name in ['offset_x','offset_y','width','height','pixels_x','pixels_y','time']}
+        self.frame.update({'angle':angle[order]})
+        self.x_min = (table['offset_x'] - half_x)[order]
+        self.x_max = (table['offset_x'] + half_x)[order]
+        self.y_min = (table['offset_y'] - half_y)[order]
+        self.y_max = (table['offset_y'] + half_y)[order]
+        self.max_width = float(np.max(self.x_max - self.x_min)) if len(order) > 0 else 0.0
+        self.version = self.metadata.version
+
+    def frames(self):
+        if self.version != self.metadata.version:
+            self.rebuild()
+        return len(self.data_ids)
+
+    def query(self,positions):
+        """
+        Returns all pairs (position, scan) where the scan frame contains the position.
+
+        Input:
+            positions: array (n,2) of x, y in nm (e.g. the metadata columns x and y of spectra)
+        Output:
+            result: dict of arrays of the same length (one entry per pair)
+                'position_index': index of the position in positions
+                'data_ids': data_id of the scan
+                'x_rel','y_rel': position relative to the lower left corner of the scan frame (nm, like
+                                 spmpy_terry.relative_position)
+                'column','row': pixel of the position in the scan (NaN if the scan has no pixel number)
+                'time': time of the scan (db_metadata column time)
+        """
+        if self.version != self.metadata.version:
+            self.rebuild()
+        positions = np.asarray(positions,dtype=float).reshape(-1,2)
+
+        # candidates: frames with x_min in [x - max_width, x]
+        low = np.searchsorted(self.x_min,positions[:,0] - self.max_width,side='left')
+        high = np.searchsorted(self.x_min,positions[:,0],side='right')
+        counts = np.maximum(high - low,0)
+        position_index = np.repeat(np.arange(len(positions)),counts)
+        frame_index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,counts) + np.repeat(low,counts)
+
+        # bounding boxes, then the exact test in the rotated frame
+        x = positions[position_index,0]
+        y = positions[position_index,1]
+        inside = (x <= self.x_max[frame_index]) & (y >= self.y_min[frame_index]) & (y <= self.y_max[frame_index])
+        position_index,frame_index = position_index[inside],frame_index[inside]
+        frame = {name:values[frame_index] for name,values in self.frame.items()}
+        relative = spmpy.relative_positions(frame,positions[position_index])
+        inside = (relative[:,0] >= 0) & (relative[:,0] <= frame['width']) & (relative[:,1] >= 0) & (relative[:,1] <= frame['height'])
+
+        pixels_x = np.where(frame['pixels_x'] > 0,frame['pixels_x'],np.nan)
+        pixels_y = np.where(frame['pixels_y'] > 0,frame['pixels_y'],np.nan)
+        return {'position_index':position_index[inside],
+                'data_ids':self.data_ids[frame_index[inside]],
+                'x_rel':relative[inside,0],
+                'y_rel':relative[inside,1],
+                'column':(relative[:,0]/frame['width']*pixels_x)[inside],
+                'row':(relative[:,1]/frame['height']*pixels_y)[inside],
+                'time':frame['time'][inside]}
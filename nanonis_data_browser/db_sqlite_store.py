@@ -0,0 +1,202 @@
+"""
+Description:    SQLite property store for the db_manager of the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import os
+import pickle
+import sqlite3
+
+
+class db_sqlite_store():
+    """
+    db_sqlite_store keeps db_prop in an SQLite file with one row per (db_base, data_id, property).
+
+    Every value is pickled on its own, such that a change of a single display_property only rewrites a single row.
+    Rows of db_prop['super'] and db_prop['link'] are stored with data_id = ''.
+
+    Input:
+        path: str (path of the SQLite file)
+
+    Tables:
+        db_prop = (db_base, data_id, property, value)
+        data_ids = (position, db_base, data_id)     order in which the data_ids were created
+        meta = (key, value)                         e.g. 'this_is_a_database_for_the_databrowser', 'schema_version'
+
+    External Functions:
+        write(db_base,data_id,display_property,display_property_value): Writes a single row (in the open transaction)
+        delete(db_base,data_id): Deletes all rows of data_id (in the open transaction)
+        commit(): Commits all rows written since the last commit
+        backup(path): Copies the last committed state of the file to path
+        dump_db_prop(db_prop): Replaces the content of the file with db_prop
+        read_db_prop(): Returns db_prop
+        read_property(db_base,data_id,display_property): Reads a single row
+        write_meta(key,value), read_meta(key): Values of the meta table
+        is_database(): True if the file is a database for the databrowser
+        close()
+    """
+
+    schema_version = 1
+    base_without_data_id = ['super','link']
+
+    def __init__(self,path:str):
+        self.path = path
+        self.connection = sqlite3.connect(path,check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.create_tables()
+
+    def create_tables(self):
+        """Creates the tables if they do not exist yet"""
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS db_prop (db_base TEXT NOT NULL, data_id TEXT NOT NULL, property TEXT NOT NULL, value BLOB, '
+                                    'PRIMARY KEY (db_base,data_id,property)) WITHOUT ROWID')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS data_ids (position INTEGER PRIMARY KEY AUTOINCREMENT, db_base TEXT NOT NULL, data_id TEXT NOT NULL, '
+                                    'UNIQUE (db_base,data_id))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB)')
+
+    ### Write ###
+
+    def write(self,db_base:str,data_id,display_property:str,display_property_value):
+        """
+        Writes a single row. The row is part of the open transaction until commit() is called.
+
+        Input:
+            db_base: str ('data_prop','stitch','super' or 'link')
+            data_id: str (ignored for 'super' and 'link')
+            display_property: str
+            display_property_value: any picklable value
+        """
+        data_id = self.row_data_id(db_base,data_id)
+        value = pickle.dumps(display_property_value,protocol=pickle.HIGHEST_PROTOCOL)
+        if db_base not in self.base_without_data_id:
+            self.connection.execute('INSERT OR IGNORE INTO data_ids (db_base,data_id) VALUES (?,?)',(db_base,data_id))
+        self.connection.execute('INSERT OR REPLACE INTO db_prop (db_base,data_id,property,value) VALUES (?,?,?,?)',
+                                (db_base,data_id,display_property,value))
+
+    def delete(self,db_base:str,data_id):
+        """
+        Deletes all rows of data_id. The deletion is part of the open transaction until commit() is called.
+
+        Input:
+            db_base: str ('data_prop' or 'stitch')
+            data_id: str
+        """
+        data_id = self.row_data_id(db_base,data_id)
+        self.connection.execute('DELETE FROM db_prop WHERE db_base=? AND data_id=?',(db_base,data_id))
+        self.connection.execute('DELETE FROM data_ids WHERE db_base=? AND data_id=?',(db_base,data_id))
+
+    def commit(self):
+        """Commits all rows written since the last commit in one transaction"""
+        self.connection.commit()
+
+    def backup(self,path:str):
+        """
+        Copies the last committed state of the file to the new SQLite file path (sqlite3.Connection.backup).
+        A separate connection is used as the source, the rows written since the last commit are not copied.
+        """
+        source = sqlite3.connect(self.path)
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    def dump_db_prop(self,db_prop:dict):
+        """
+        Replaces the content of the file with db_prop in one transaction.
+
+        Input:
+            db_prop: dict (see db_manager)
+        """
+        with self.connection:
+            self.connection.execute('DELETE FROM db_prop')
+            self.connection.execute('DELETE FROM data_ids')
+            for db_base in db_prop.keys():
+                if db_base in self.base_without_data_id:
+                    rows = [(db_base,'',key,pickle.dumps(value,protocol=pickle.HIGHEST_PROTOCOL)) for key,value in db_prop[db_base].items()]
+                else:
+                    self.connection.executemany('INSERT OR IGNORE INTO data_ids (db_base,data_id) VALUES (?,?)',
+                                                [(db_base,data_id) for data_id in db_prop[db_base].keys()])
+                    rows = [(db_base,data_id,key,pickle.dumps(value,protocol=pickle.HIGHEST_PROTOCOL))
+                            for data_id,d_prop in db_prop[db_base].items() for key,value in d_prop.items()]
+                self.connection.executemany('INSERT OR REPLACE INTO db_prop (db_base,data_id,property,value) VALUES (?,?,?,?)',rows)
+            self.connection.execute('INSERT OR REPLACE INTO meta (key,value) VALUES (?,?)',('this_is_a_database_for_the_databrowser',pickle.dumps(True)))
+            self.connection.execute('INSERT OR REPLACE INTO meta (key,value) VALUES (?,?)',('schema_version',pickle.dumps(self.schema_version)))
+
+    def write_meta(self,key:str,value):
+        """Writes (and commits) a value to the meta table"""
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key,value) VALUES (?,?)',(key,pickle.dumps(value,protocol=pickle.HIGHEST_PROTOCOL)))
+
+    ### Read ###
+
+    def read_db_prop(self):
+        """
+        Reads the complete db_prop from the file.
+
+        Output:
+            db_prop: dict
+        """
+        db_prop = {'data_prop':{},'stitch':{},'super':{},'link':{}}
+        for db_base,data_id in self.connection.execute('SELECT db_base,data_id FROM data_ids ORDER BY position'):
+            db_prop.setdefault(db_base,{}).update({data_id:{}})
+        for db_base,data_id,display_property,value in self.connection.execute('SELECT db_base,data_id,property,value FROM db_prop'):
+            if db_base in self.base_without_data_id:
+                db_prop.setdefault(db_base,{}).update({display_property:pickle.loads(value)})
+            else:
+                db_prop.setdefault(db_base,{}).setdefault(data_id,{}).update({display_property:pickle.loads(value)})
+        return db_prop
+
+    def read_property(self,db_base:str,data_id,display_property:str):
+        """
+        Reads a single row without reading the rest of the database.
+
+        Output:
+            display_property_value or None if the row does not exist
+        """
+        data_id = self.row_data_id(db_base,data_id)
+        row = self.connection.execute('SELECT value FROM db_prop WHERE db_base=? AND data_id=? AND property=?',
+                                      (db_base,data_id,display_property)).fetchone()
+        if row == None:
+            return None
+        return pickle.loads(row[0])
+
+    def read_meta(self,key:str):
+        """Reads a value from the meta table (None if it does not exist)"""
+        row = self.connection.execute('SELECT value FROM meta WHERE key=?',(key,)).fetchone()
+        if row == None:
+            return None
+        return pickle.loads(row[0])
+
+    def is_database(self):
+        """Returns True if the file was written by db_sqlite_store.dump_db_prop"""
+        if self.read_meta('this_is_a_database_for_the_databrowser') == True:
+            return True
+        return False
+
+    ### Helper functions ###
+
+    def row_data_id(self,db_base,data_id):
+        """Returns the data_id used in the rows ('' for 'super' and 'link')"""
+        if db_base in self.base_without_data_id:
+            return ''
+        return str(data_id)
+
+    def close(self):
+        """Commits open changes and closes the connection"""
+        try:
+            self.connection.commit()
+            self.connection.close()
+        except sqlite3.ProgrammingError:
+            pass
+
+    @staticmethod
+    def is_sqlite_file(path:str):
+        """Returns True if the file at path starts with the SQLite header"""
+        if not os.path.isfile(path):
+            return False
+        with open(path,'rb') as handle:
+            return handle.read(16) == b'SQLite format 3\x00'
@@ -0,0 +1,191 @@
+"""
+Description:    time-ordered index of the files for the db_manager of the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import bisect
+import math
+
+
+class time_sorted_list():
+    """
+    data_ids sorted by time (two parallel lists, ordered by (time, data_id)). Lookups are binary searches,
+    insertions and removals move the tail of the lists.
+    """
+
+    def __init__(self,pairs=()):
+        pairs = sorted(pairs)
+        self.times = [time for time,_ in pairs]
+        self.data_ids = [data_id for _,data_id in pairs]
+
+    def position(self,time,data_id):
+        # position of (time, data_id) in the order of the lists
+        low = bisect.bisect_left(self.times,time)
+        high = bisect.bisect_right(self.times,time,lo=low)
+        return bisect.bisect_left(self.data_ids,data_id,lo=low,hi=high)
+
+    def insert(self,time,data_id):
+        i = self.position(time,data_id)
+        self.times.insert(i,time)
+        self.data_ids.insert(i,data_id)
+
+    def remove(self,time,data_id):
+        i = self.position(time,data_id)
+        if i < len(self.data_ids) and self.data_ids[i] == data_id and self.times[i] == time:
+            del self.times[i]
+            del self.data_ids[i]
+
+    def range(self,time_start,time_end):
+        # slice of the data_ids with time_start <= time <= time_end
+        return slice(bisect.bisect_left(self.times,time_start),bisect.bisect_right(self.times,time_end))
+
+
+class db_time_index():
+    """
+    db_time_index keeps all data_ids sorted by their time, updated by db_manager.db_write and db_delete, such that
+    time queries are binary searches and the time order of the database does not have to be sorted again.
+
+    The time of a data_id is its acquisition time from the header (metadata 'acquisition_time', see db_metadata)
+    or, if the header has none, its 'file_modified_date'. Times are seconds since the epoch.
+
+    Indexes:
+        all_times: time_sorted_list of all data_ids
+        ending_times: {filename_ending:time_sorted_list}
+
+    External Functions:
+        rebuild(db_prop): Indexes all data_ids of db_prop['data_prop']
+        update(data_id,display_property,display_property_value): Called by db_write
+        remove(data_id): Called by db_delete
+        changed_since_clear(data_ids): True if other data_ids than data_ids were moved since clear_changed
+        clear_changed(): Called after the time order of the database was written (see db_manager.filetime_sorter)
+        time(data_id): Returns the time of data_id (None if it has none)
+        sorted_ids(descending,filename_ending): Returns the data_ids in time order
+        preceding(time,filename_ending): Returns the last data_id before time
+        within(time,delta,filename_ending): Returns the data_ids with a time difference of at most delta
+        window(time_start,time_end,filename_ending): Returns the data_ids in the time window
+    """
+
+    def __init__(self):
+        self.all_times = time_sorted_list()
+        self.ending_times = {}
+        self.data_id_time = {} # {data_id:time in the index}
+        self.data_id_ending = {}
+        self.data_id_modified = {} # {data_id:file_modified_date}
+        self.data_id_acquired = {} # {data_id:acquisition_time}
+        self.changed = set() # data_ids whose time or filename_ending changed since the last clear_changed
+        self.rebuilt = True # True if the index was rebuilt since the last clear_changed
+
+    def rebuild(self,db_prop:dict):
+        """Indexes all data_ids of db_prop['data_prop'] (after db_prop was replaced), sorted once"""
+        self.__init__()
+        self.rebuilt = True
+        pairs = []
+        ending_pairs = {}
+        for data_id,d_prop in db_prop['data_prop'].items():
+            ending = d_prop.get('filename_ending')
+            modified = self.valid_time(d_prop.get('file_modified_date'))
+            metadata = d_prop.get('metadata')
+            acquired = self.valid_time(metadata.get('acquisition_time')) if metadata else None
+            self.data_id_ending[data_id] = ending
+            self.data_id_modified[data_id] = modified
+            self.data_id_acquired[data_id] = acquired
+            time = acquired if acquired != None else modified
+            if time != None:
+                self.data_id_time[data_id] = time
+                pairs.append((time,data_id))
+                ending_pairs.setdefault(ending,[]).append((time,data_id))
+        self.all_times = time_sorted_list(pairs)
+        self.ending_times = {ending:time_sorted_list(ending_pairs[ending]) for ending in ending_pairs}
+
+    ### Update ###
+
+    def valid_time(self,time):
+        if type(time) is float:
+            return time if math.isfinite(time) else None
+        try:
+            time = float(time)
+        except (TypeError,ValueError):
+            return None
+        return time if math.isfinite(time) else None
+
+    def index_time(self,data_id):
+        acquired = self.data_id_acquired.get(data_id)
+        return acquired if acquired != None else self.data_id_modified.get(data_id)
+
+    def update(self,data_id,display_property:str,display_property_value):
+        """Updates the time or filename_ending of data_id (other display properties are ignored)"""
+        if display_property == 'file_modified_date':
+            self.data_id_modified.update({data_id:self.valid_time(display_property_value)})
+        elif display_property == 'metadata':
+            self.data_id_acquired.update({data_id:self.valid_time((display_property_value or {}).get('acquisition_time'))})
+        elif display_property != 'filename_ending':
+            return
+        time_old = self.data_id_time.get(data_id)
+        ending_old = self.data_id_ending.get(data_id)
+        self.unindex(data_id)
+        if display_property == 'filename_ending':
+            self.data_id_ending.update({data_id:display_property_value})
+        time = self.index_time(data_id)
+        if time != time_old or self.data_id_ending.get(data_id) != ending_old:
+            self.changed.add(data_id)
+        if time != None:
+            self.data_id_time.update({data_id:time})
+            self.all_times.insert(time,data_id)
+            self.ending_times.setdefault(self.data_id_ending.get(data_id),time_sorted_list()).insert(time,data_id)
+
+    def unindex(self,data_id):
+        time = self.data_id_time.pop(data_id,None)
+        if time != None:
+            self.all_times.remove(time,data_id)
+            ending_times = self.ending_times.get(self.data_id_ending.get(data_id))
+            if ending_times != None:
+                ending_times.remove(time,data_id)
+
+    def remove(self,data_id):
+        """Removes data_id from the index"""
+        if data_id in self.data_id_ending:
+            self.changed.add(data_id)
+        self.unindex(data_id)
+        self.data_id_ending.pop(data_id,None)
+        self.data_id_modified.pop(data_id,None)
+        self.data_id_acquired.pop(data_id,None)
+
+    def changed_since_clear(self,data_ids=()):
+        """True if the index was rebuilt or data_ids other than data_ids were moved since the last clear_changed"""
+        return self.rebuilt or not self.changed.issubset(data_ids)
+
+    def clear_changed(self):
+        self.changed = set()
+        self.rebuilt = False
+
+    ### Queries ###
+
+    def times(self,filename_ending=None):
+        if filename_ending == None:
+            return self.all_times
+        return self.ending_times.get(filename_ending,time_sorted_list())
+
+    def time(self,data_id):
+        """Returns the time of data_id (None if it has none)"""
+        return self.data_id_time.get(data_id)
+
+    def sorted_ids(self,descending=False,filename_ending=None):
+        """Returns the data_ids (with filename_ending) in time order"""
+        data_ids = self.times(filename_ending).data_ids
+        return data_ids[::-1] if descending else list(data_ids)
+
+    def preceding(self,time,filename_ending=None):
+        """Returns the last data_id (with filename_ending) with a time before or equal to time (None if there is none)"""
+        times = self.times(filename_ending)
+        i = bisect.bisect_right(times.times,time)
+        return times.data_ids[i-1] if i > 0 else None
+
+    def within(self,time,delta,filename_ending=None):
+        """Returns the data_ids (with filename_ending) with time - delta <= time <= time + delta, in time order"""
+        return self.window(time - delta,time + delta,filename_ending)
+
+    def window(self,time_start,time_end,filename_ending=None):
+        """Returns the data_ids (with filename_ending) with time_start <= time <= time_end, in time order"""
+        times = self.times(filename_ending)
+        return times.data_ids[times.range(time_start,time_end)]
@@ -0,0 +1,254 @@
+"""
+Description:    persistent sidecar cache of parsed data files for the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import os
+import math
+import pickle
+import hashlib
+import struct
+import numpy as np
+
+
+class file_cache():
+    """
+    file_cache stores the parsed header (and optionally parsed arrays) of data files in a binary sidecar file per
+    data file, such that unchanged files do not have to be parsed again after a restart.
+
+    An entry is valid for the key (absolute path, file size, mtime and parser version) it was written with. Every
+    entry contains a checksum of its metadata and a checksum of its arrays; entries that do not match their key or
+    checksum are ignored and overwritten. If the cache grows above max_size, the least recently used entries are
+    deleted.
+
+    Entry file (<blake2b of the path>.spmc):
+        magic b'SPMC', format version (uint32), length of the metadata (uint64), blake2b of the metadata (16 bytes),
+        metadata (pickle), arrays (raw bytes, 64 byte aligned)
+
+    Optional Arguments:
+        cache_directory: str, folder of the cache (default: None, the folder '.cache' next to every data file)
+        max_size: int, bytes of all entries of a cache folder (default: 1 GiB, None: no limit)
+        evict: bool, if False put does not evict (default: True, see without_eviction)
+
+    External Functions:
+        get(path,parser_version): Returns the metadata of the valid entry of path (or None)
+        get_arrays(path,meta): Returns the arrays of an entry {name:array} (or None if they are not valid)
+        put(path,parser_version,header,fields,arrays): Writes the entry of path
+        clear(directory): Deletes all entries of a cache folder
+        without_eviction(): Returns a copy of the cache that does not evict (e.g. for worker processes)
+        evict_folders(paths): Evicts the cache folders of the data files at paths
+    """
+
+    magic = b'SPMC'
+    format_version = 1
+    fixed_header = struct.Struct('<4sIQ16s')
+    alignment = 64
+
+    def __init__(self,**kwargs):
+        if 'cache_directory' in kwargs: self.cache_directory = kwargs['cache_directory']
+        else: self.cache_directory = None
+        if 'max_size' in kwargs: self.max_size = kwargs['max_size']
+        else: self.max_size = 1024**3
+        if 'evict' in kwargs: self.evict_on_put = kwargs['evict']
+        else: self.evict_on_put = True
+
+        self.folder_sizes = {} # {folder:bytes}, counted from the last scan of the folder and the entries written since
+
+    ### Paths and keys ###
+
+    def cache_folder(self,path:str):
+        """Folder of the entry of the data file at path"""
+        if self.cache_directory != None:
+            return self.cache_directory
+        return os.path.join(os.path.dirname(os.path.abspath(path)),'.cache')
+
+    def entry_path(self,path:str):
+        path = os.path.abspath(path)
+        name = hashlib.blake2b(path.encode('utf-8'),digest_size=16).hexdigest()
+        return os.path.join(self.cache_folder(path),name + '.spmc')
+
+    def key(self,path:str,parser_version):
+        """Key of the current content of the data file at path (None if it does not exist)"""
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return {'path':path,'size':stat.st_size,'mtime_ns':stat.st_mtime_ns,'parser_version':parser_version}
+
+    ### Read ###
+
+    def get(self,path:str,parser_version):
+        """
+        Returns the metadata of the entry of path if it is valid for the current file.
+
+        Output:
+            meta: dict {'key','header','fields','arrays':{name:(offset,shape,dtype)},'arrays_checksum'} or None
+        """
+        key = self.key(path,parser_version)
+        if key is None:
+            return None
+        entry_path = self.entry_path(key['path'])
+        try:
+            with open(entry_path,'rb') as handle:
+                magic,format_version,meta_length,meta_checksum = self.fixed_header.unpack(handle.read(self.fixed_header.size))
+                if magic != self.magic or format_version != self.format_version:
+                    return None
+                meta_raw = handle.read(meta_length)
+        except (OSError,struct.error):
+            return None
+        if len(meta_raw) != meta_length or hashlib.blake2b(meta_raw,digest_size=16).digest() != meta_checksum:
+            print('file_cache.get: Checksum of the cache entry does not match, the file is parsed again: ',path)
+            return None
+        try:
+            meta = pickle.loads(meta_raw)
+        except Exception:
+            return None
+        if meta.get('key') != key:
+            return None
+        meta.update({'entry_path':entry_path,'data_offset':self.fixed_header.size + meta_length})
+        self.touch(entry_path)
+        return meta
+
+    def get_arrays(self,path:str,meta:dict):
+        """
+        Returns the arrays of the entry meta (from get) after their checksum was validated.
+
+        Output:
+            arrays: {name:np.ndarray} or None
+        """
+        if meta is None or len(meta['arrays']) == 0:
+            return None
+        try:
+            with open(meta['entry_path'],'rb') as handle:
+                handle.seek(meta['data_offset'])
+                arrays_raw = handle.read()
+        except OSError:
+            return None
+        if hashlib.blake2b(arrays_raw,digest_size=16).hexdigest() != meta['arrays_checksum']:
+            print('file_cache.get_arrays: Checksum of the cached arrays does not match, the file is parsed again: ',path)
+            return None
+        arrays = {}
+        for name,(offset,shape,dtype) in meta['arrays'].items():
+            dtype = np.dtype(dtype)
+            arrays.update({name:np.frombuffer(arrays_raw,dtype=dtype,count=math.prod(shape),offset=offset).reshape(shape).copy()})
+        return arrays
+
+    def touch(self,entry_path:str):
+        # the mtime of an entry is the time of its last use (for the eviction)
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+    ### Write ###
+
+    def put(self,path:str,parser_version,header,fields:dict,arrays:dict=None):
+        """
+        Writes the entry of the data file at path (temporary file + atomic replace).
+
+        Input:
+            path: str
+            parser_version: version of the parser (entries of other versions are not valid)
+            header: parsed header (picklable)
+            fields: dict of further picklable values of the parser (e.g. the offset of the data)
+            arrays: dict {name:np.ndarray} or None
+        """
+        key = self.key(path,parser_version)
+        if key is None:
+            return
+        path = key['path']
+        if arrays is None:
+            arrays = {}
+
+        arrays_raw = bytearray()
+        arrays_index = {}
+        for name,array in arrays.items():
+            array = np.ascontiguousarray(array)
+            arrays_raw += b'\0'*((-len(arrays_raw)) % self.alignment)
+            arrays_index.update({name:(len(arrays_raw),array.shape,array.dtype.str)})
+            arrays_raw += array.tobytes()
+        meta = {'key':key,'header':header,'fields':fields,'arrays':arrays_index,
+                'arrays_checksum':hashlib.blake2b(bytes(arrays_raw),digest_size=16).hexdigest()}
+        meta_raw = pickle.dumps(meta,protocol=pickle.HIGHEST_PROTOCOL)
+
+        entry_path = self.entry_path(path)
+        entry_path_tmp = entry_path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            os.makedirs(os.path.dirname(entry_path),exist_ok=True)
+            with open(entry_path_tmp,'wb') as handle:
+                handle.write(self.fixed_header.pack(self.magic,self.format_version,len(meta_raw),hashlib.blake2b(meta_raw,digest_size=16).digest()))
+                handle.write(meta_raw)
+                handle.write(arrays_raw)
+            os.replace(entry_path_tmp,entry_path)
+            entry_size = self.fixed_header.size + len(meta_raw) + len(arrays_raw)
+        except OSError as e:
+            print('file_cache.put: Error: could not write the cache entry of ',path,e)
+            try:
+                os.remove(entry_path_tmp)
+            except OSError:
+                pass
+            return
+        folder = os.path.dirname(entry_path)
+        if folder in self.folder_sizes:
+            self.folder_sizes[folder] += entry_size
+        if self.evict_on_put and self.max_size is not None and (folder not in self.folder_sizes or self.folder_sizes[folder] > self.max_size):
+            self.evict(folder)
+
+    ### Eviction ###
+
+    def evict(self,folder:str):
+        """Deletes the least recently used entries of folder until it is below self.max_size"""
+        if self.max_size is None:
+            return
+        entries = []
+        try:
+            with os.scandir(folder) as scan:
+                for entry in scan:
+                    if entry.name.endswith('.spmc'):
+                        try:
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime,stat.st_size,entry.path))
+                        except OSError:
+                            pass
+        except OSError:
+            return
+        size = sum(entry[1] for entry in entries)
+        if size > self.max_size:
+            for _,entry_size,entry_path in sorted(entries):
+                if size <= self.max_size:
+                    break
+                try:
+                    os.remove(entry_path)
+                    size -= entry_size
+                except OSError:
+                    pass
+        self.folder_sizes.update({folder:size})
+
+    def without_eviction(self):
+        """
+        Returns a copy of the cache that writes entries without evicting. A copy sent to a worker process does not
+        know the folder sizes and would scan the folder on every put, the owner of the cache evicts once after the
+        batch instead (see evict_folders and spmpy_terry.import_parallel).
+        """
+        return file_cache(cache_directory=self.cache_directory,max_size=self.max_size,evict=False)
+
+    def evict_folders(self,paths):
+        """Evicts the cache folders of the data files at paths (once per folder)"""
+        if self.max_size is None:
+            return
+        for folder in dict.fromkeys(self.cache_folder(path) for path in paths):
+            self.evict(folder)
+
+    def clear(self,directory:str):
+        """Deletes all entries of the cache folder of the data files in directory"""
+        folder = self.cache_folder(os.path.join(directory,'_'))
+        try:
+            with os.scandir(folder) as scan:
+                for entry in scan:
+                    if entry.name.endswith('.spmc'):
+                        os.remove(entry.path)
+        except OSError:
+            pass
+        self.folder_sizes.pop(folder,None)
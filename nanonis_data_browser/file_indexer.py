@@ -0,0 +1,126 @@
+"""
+Description:    scandir based directory indexer for the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import os
+import numpy as np
+
+
+class file_indexer():
+    """
+    file_indexer lists all data files of a directory with one (cached) stat per entry using os.scandir.
+
+    The rows of every indexed directory are kept together with the mtime of the directory. A directory whose mtime
+    has not changed since the last index is not listed again (the mtime of a directory changes when files are
+    created, deleted or renamed in it, but not when the content of a file is modified; use full=True to list all
+    directories again).
+
+    Optional Arguments:
+        file_endings: tuple of str (default: ('.sxm','.dat'))
+        recursive: bool, if True the files of all subdirectories (e.g. sessions) are indexed as well,
+                   their filename_full is the path relative to the indexed directory (default: False)
+
+    External Functions:
+        index(directory,full=False): Returns the columnar file index of directory
+        to_db_meta(file_index,directory): Converts a file index into db_meta (list of dict) for db_manager
+    """
+
+    def __init__(self,**kwargs):
+        if 'file_endings' in kwargs: self.file_endings = tuple(kwargs['file_endings'])
+        else: self.file_endings = ('.sxm','.dat')
+        if 'recursive' in kwargs: self.recursive = kwargs['recursive']
+        else: self.recursive = False
+
+        self.directory_cache = {} # {path:(mtime,rows,subdirectories)}
+        self.file_index_cache = {} # {directory:file_index} of the last index
+        self.directory_changed = False
+
+    def index(self,directory:str,full:bool=False):
+        """
+        Indexes directory (and its subdirectories if self.recursive).
+
+        Input:
+            directory: str
+            full: bool, if True all directories are listed again, even if their mtime has not changed
+        Output:
+            file_index: dict of columns, reverse sorted by file_created_date
+                {'filename_full':[str,...],'filename_ending':[str,...],'file_size':np.ndarray (int64),
+                 'file_modified_date':np.ndarray (float64),'file_created_date':np.ndarray (float64)}
+        """
+        rows = []
+        visited = set()
+        self.directory_changed = False
+        self.index_directory(directory,'',os.stat(directory).st_mtime,full,rows,visited)
+
+        # Forget directories that do not exist anymore
+        for path in list(self.directory_cache.keys()):
+            if path not in visited and (path == directory or path.startswith(os.path.join(directory,''))):
+                self.directory_cache.pop(path)
+                self.directory_changed = True
+
+        if not self.directory_changed and directory in self.file_index_cache:
+            return self.file_index_cache[directory]
+
+        file_created_date = np.array([row[4] for row in rows],dtype=np.float64)
+        order = np.argsort(-file_created_date,kind='stable')
+        file_index = {'filename_full':[rows[i][0] for i in order],
+                      'filename_ending':[rows[i][1] for i in order],
+                      'file_size':np.array([rows[i][2] for i in order],dtype=np.int64),
+                      'file_modified_date':np.array([rows[i][3] for i in order],dtype=np.float64),
+                      'file_created_date':file_created_date[order]}
+        self.file_index_cache.update({directory:file_index})
+        return file_index
+
+    def index_directory(self,path:str,relative_path:str,mtime:float,full:bool,rows:list,visited:set):
+        """Appends the rows of path (from the cache if its mtime has not changed) and recurses into subdirectories"""
+        visited.add(path)
+        cached = self.directory_cache.get(path)
+        if cached != None and cached[0] == mtime and not full:
+            _,directory_rows,subdirectories = cached
+        else:
+            directory_rows = []
+            subdirectories = []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir():
+                                if self.recursive:
+                                    subdirectories.append(entry.name)
+                            elif entry.name.endswith(self.file_endings):
+                                stat = entry.stat()
+                                directory_rows.append((os.path.join(relative_path,entry.name),entry.name.split('.')[-1],
+                                                       stat.st_size,stat.st_mtime,stat.st_ctime))
+                        except OSError:
+                            pass
+            except OSError as e:
+                print('file_indexer.index_directory: directory not accessible: ',path,e)
+            self.directory_cache.update({path:(mtime,directory_rows,subdirectories)})
+            self.directory_changed = True
+        rows.extend(directory_rows)
+
+        for subdirectory in subdirectories:
+            subdirectory_path = os.path.join(path,subdirectory)
+            try:
+                subdirectory_mtime = os.stat(subdirectory_path).st_mtime
+            except OSError:
+                continue
+            self.index_directory(subdirectory_path,os.path.join(relative_path,subdirectory),subdirectory_mtime,full,rows,visited)
+
+    @staticmethod
+    def to_db_meta(file_index:dict,directory:str):
+        """
+        Converts a file index into db_meta for db_manager.
+
+        Output:
+            db_meta: [{path, filename_full, filename_ending, file_size, file_modified_date},...]
+        """
+        return [{"path":directory+'\\'+filename_full,
+                 "filename_full":filename_full,
+                 "filename_ending":filename_ending,
+                 "file_size":file_size,
+                 "file_modified_date":file_modified_date}
+                for filename_full,filename_ending,file_size,file_modified_date in
+                zip(file_index['filename_full'],file_index['filename_ending'],file_index['file_size'].tolist(),file_index['file_modified_date'].tolist())]
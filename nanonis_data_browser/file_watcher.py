@@ -0,0 +1,322 @@
+"""
+Description:    file watcher for the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import os
+import sys
+import time
+import threading
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+class file_watcher():
+    """
+    file_watcher watches a directory for new, modified, deleted and renamed files and reports the affected filenames.
+
+    On Linux inotify is used, otherwise (or if inotify is not available) the directory is polled and compared
+    with an mtime/size snapshot. Events of a file are debounced: a file is reported once no event was seen for
+    debounce seconds and its size did not change during the last debounce seconds (the file is completely written).
+
+    With recursive=True the subdirectories are watched as well (including subdirectories created later), the
+    filenames are the paths relative to directory (like file_indexer(recursive=True)).
+
+    Input:
+        directory: str
+        callback: function(filenames) that is called from the watcher thread with a set of changed filenames
+                  (new, modified, deleted and both names of renamed files), or with None if a whole subdirectory
+                  was moved or events were lost (the caller compares the whole directory)
+
+    Optional Arguments:
+        file_endings: tuple of str (default: ('.sxm','.dat'))
+        recursive: bool, watch the subdirectories as well (default: False)
+        debounce: float, seconds (default: 2)
+        poll_interval: float, seconds between two snapshots of the poller (default: 5)
+        backend: 'auto', 'inotify' or 'poll' (default: 'auto')
+
+    External Functions:
+        start(): Starts the watcher thread
+        stop(): Stops the watcher thread
+        is_running(): True if the watcher thread is running
+    """
+
+    # inotify constants (linux/inotify.h)
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0x00000800
+    inotify_event_struct = struct.Struct('iIII')
+
+    def __init__(self,directory:str,callback,**kwargs):
+        self.directory = directory
+        self.callback = callback
+
+        if 'file_endings' in kwargs: self.file_endings = tuple(kwargs['file_endings'])
+        else: self.file_endings = ('.sxm','.dat')
+        if 'recursive' in kwargs: self.recursive = kwargs['recursive']
+        else: self.recursive = False
+        if 'debounce' in kwargs: self.debounce = kwargs['debounce']
+        else: self.debounce = 2
+        if 'poll_interval' in kwargs: self.poll_interval = kwargs['poll_interval']
+        else: self.poll_interval = 5
+        if 'backend' in kwargs: backend = kwargs['backend']
+        else: backend = 'auto'
+
+        if backend == 'poll':
+            self.backend = 'poll'
+        elif backend in ['auto','inotify'] and sys.platform.startswith('linux'):
+            self.backend = 'inotify'
+        else:
+            if backend == 'inotify':
+                print('file_watcher: inotify is only available on Linux, polling the directory instead')
+            self.backend = 'poll'
+
+        self.pending = {} # {filename:[time of last event, size at last check]}
+        self.snapshot = None
+        self.rescan = False # True if the whole directory has to be compared (moved subdirectory, lost events)
+        self.inotify_fd = None
+        self.watch_paths = {} # {inotify watch descriptor:path of the watched directory relative to self.directory}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    ### Thread ###
+
+    def start(self):
+        """Starts the watcher thread"""
+        if self.is_running():
+            return
+        if self.backend == 'inotify' and not self.inotify_start():
+            print('file_watcher.start: inotify could not be started, polling the directory instead')
+            self.backend = 'poll'
+        if self.backend == 'poll':
+            self.snapshot = self.take_snapshot()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run,daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the watcher thread"""
+        self.stop_event.set()
+        if self.thread != None:
+            self.thread.join()
+            self.thread = None
+        self.inotify_stop()
+
+    def is_running(self):
+        return self.thread != None and self.thread.is_alive()
+
+    def run(self):
+        tick = min(0.25,self.debounce)
+        last_poll = time.monotonic()
+        while not self.stop_event.is_set():
+            if self.backend == 'inotify':
+                self.inotify_read(tick)
+            else:
+                self.stop_event.wait(tick)
+                if time.monotonic() - last_poll >= self.poll_interval:
+                    self.poll()
+                    last_poll = time.monotonic()
+            if self.rescan:
+                self.rescan = False
+                self.pending = {}
+                try:
+                    self.callback(None)
+                except Exception as e:
+                    print('file_watcher.run: Error in callback: ',e)
+                continue
+            ready = self.ready_filenames()
+            if len(ready) > 0:
+                try:
+                    self.callback(ready)
+                except Exception as e:
+                    print('file_watcher.run: Error in callback: ',e)
+
+    ### Debounce ###
+
+    def file_event(self,filename:str):
+        """Registers an event of filename (the file is reported after it is stable for self.debounce seconds)"""
+        if not filename.endswith(self.file_endings):
+            return
+        if filename in self.pending:
+            self.pending[filename][0] = time.monotonic()
+        else:
+            self.pending.update({filename:[time.monotonic(),self.file_size(filename)]})
+
+    def ready_filenames(self):
+        """Returns (and removes from self.pending) all filenames without events and size changes for self.debounce seconds"""
+        ready = set()
+        now = time.monotonic()
+        for filename,(last_event,last_size) in list(self.pending.items()):
+            if now - last_event < self.debounce:
+                continue
+            size = self.file_size(filename)
+            if size != last_size:
+                # still being written
+                self.pending[filename] = [now,size]
+            else:
+                ready.add(filename)
+                self.pending.pop(filename)
+        return ready
+
+    def file_size(self,filename:str):
+        """Size of filename (None if it does not exist)"""
+        try:
+            return os.stat(os.path.join(self.directory,filename)).st_size
+        except OSError:
+            return None
+
+    ### Poll backend ###
+
+    def take_snapshot(self):
+        """Returns {filename:(size,mtime)} of all watched files in the directory (and its subdirectories if self.recursive)"""
+        snapshot = {}
+        try:
+            self.snapshot_directory('',snapshot)
+        except OSError as e:
+            print('file_watcher.take_snapshot: directory not accessible: ',e)
+            return None
+        return snapshot
+
+    def snapshot_directory(self,relative_path:str,snapshot:dict):
+        # one stat per file, subdirectories that are not accessible are skipped
+        with os.scandir(os.path.join(self.directory,relative_path)) as entries:
+            for entry in entries:
+                filename = os.path.join(relative_path,entry.name)
+                try:
+                    if entry.is_dir():
+                        if self.recursive:
+                            self.snapshot_directory(filename,snapshot)
+                    elif entry.name.endswith(self.file_endings):
+                        stat = entry.stat()
+                        snapshot.update({filename:(stat.st_size,stat.st_mtime)})
+                except OSError:
+                    pass
+
+    def poll(self):
+        """Compares a new snapshot with the last snapshot and registers events of all changed files"""
+        snapshot = self.take_snapshot()
+        if snapshot == None:
+            return
+        if self.snapshot != None:
+            for filename,stat in snapshot.items():
+                if self.snapshot.get(filename) != stat:
+                    self.file_event(filename)
+            for filename in self.snapshot.keys():
+                if filename not in snapshot:
+                    self.file_event(filename)
+        self.snapshot = snapshot
+
+    ### inotify backend ###
+
+    def inotify_start(self):
+        """Starts inotify for self.directory (and its subdirectories if self.recursive). Returns False if inotify is not available."""
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'),use_errno=True)
+            self.libc = libc
+            fd = libc.inotify_init1(self.IN_NONBLOCK)
+            if fd < 0:
+                return False
+            self.inotify_fd = fd
+            self.watch_paths = {}
+            if not self.inotify_add_watch(''):
+                self.inotify_stop()
+                return False
+        except (OSError,AttributeError):
+            return False
+        if self.recursive:
+            self.inotify_add_subdirectories('')
+        return True
+
+    def inotify_add_watch(self,relative_path:str):
+        """Adds an inotify watch of the directory relative_path (relative to self.directory)"""
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        wd = self.libc.inotify_add_watch(self.inotify_fd,os.fsencode(os.path.join(self.directory,relative_path)),mask)
+        if wd < 0:
+            return False
+        self.watch_paths.update({wd:relative_path})
+        return True
+
+    def inotify_add_subdirectories(self,relative_path:str,report:bool=False):
+        """
+        Watches all subdirectories of relative_path. With report=True the files in them are registered as well
+        (files of a new or moved-in subdirectory can be written before its watch exists).
+        """
+        try:
+            with os.scandir(os.path.join(self.directory,relative_path)) as entries:
+                entries = list(entries)
+        except OSError:
+            return
+        for entry in entries:
+            filename = os.path.join(relative_path,entry.name)
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                if self.inotify_add_watch(filename):
+                    self.inotify_add_subdirectories(filename,report)
+            elif report:
+                self.file_event(filename)
+
+    def inotify_remove_watches(self,relative_path:str):
+        """Removes the watches of the directory relative_path and its subdirectories (e.g. after it was moved)"""
+        for wd,path in list(self.watch_paths.items()):
+            if path == relative_path or path.startswith(os.path.join(relative_path,'')):
+                self.libc.inotify_rm_watch(self.inotify_fd,wd)
+                self.watch_paths.pop(wd)
+
+    def inotify_stop(self):
+        if self.inotify_fd != None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+        self.watch_paths = {}
+
+    def inotify_read(self,timeout:float):
+        """Waits up to timeout seconds for inotify events and registers them"""
+        readable,_,_ = select.select([self.inotify_fd],[],[],timeout)
+        if len(readable) == 0:
+            return
+        try:
+            buffer = os.read(self.inotify_fd,64*1024)
+        except BlockingIOError:
+            return
+        position = 0
+        while position + self.inotify_event_struct.size <= len(buffer):
+            wd,mask,_,name_length = self.inotify_event_struct.unpack_from(buffer,position)
+            position += self.inotify_event_struct.size
+            name = os.fsdecode(buffer[position:position+name_length].rstrip(b'\0'))
+            position += name_length
+            if mask & self.IN_Q_OVERFLOW:
+                # events were lost, report every file of the directory (the whole tree is compared if recursive)
+                if self.recursive:
+                    self.rescan = True
+                else:
+                    for filename in os.listdir(self.directory):
+                        self.file_event(filename)
+            elif mask & self.IN_IGNORED:
+                # the watched directory was deleted
+                self.watch_paths.pop(wd,None)
+            elif name != '' and wd in self.watch_paths:
+                filename = os.path.join(self.watch_paths[wd],name)
+                if mask & self.IN_ISDIR:
+                    if not self.recursive:
+                        continue
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        if self.inotify_add_watch(filename):
+                            self.inotify_add_subdirectories(filename,report=True)
+                    if mask & self.IN_MOVED_FROM:
+                        # the files of a moved subdirectory are not reported one by one
+                        self.inotify_remove_watches(filename)
+                        self.rescan = True
+                else:
+                    self.file_event(filename)
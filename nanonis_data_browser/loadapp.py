@@ -3,6 +3,7 @@ import db_manager
 import databrowser
 import sxm_viewer
 import dat_viewer
+import file_watcher
 
 import importlib
 importlib.reload(db_manager)
@@ -13,6 +14,8 @@ importlib.reload(sxm_viewer)
 sxm_viewer = sxm_viewer.sxm_viewer
 importlib.reload(dat_viewer)
 dat_viewer = dat_viewer.dat_viewer
+importlib.reload(file_watcher)
+file_watcher = file_watcher.file_watcher
 
 
 import ipywidgets as ipw
@@ -88,6 +91,10 @@ class loadapp():
         self.db_maintance_option = ipw.Dropdown(options=['Enable','Disable'],value='Disable',description='Maintance:',disabled=False,tooltip='Enable automiatic seraching for new data and saving of database',layout=ipw.Layout(width='200px'),style={'description_width': '100px'})
         self.db_save_overwrite = ipw.Dropdown(options=['Enable','Disable'],value='Enable',description='Overwrite:',disabled=False,tooltip='Overwrite existing data in database',layout=ipw.Layout(width='200px'),style={'description_width': '100px'})
         self.db_save_overwrite.observe(self.db_save_overwrite_change)
+        self.db_backend_option = ipw.Dropdown(options=['Pickle','SQLite'],value='Pickle',description='Backend:',disabled=False,tooltip='Storage backend of a new database',layout=ipw.Layout(width='200px'),style={'description_width': '100px'})
+        self.db_backend_option.observe(self.db_backend_option_change,names='value')
+        self.db_data_store_option = ipw.Dropdown(options=['Pickle','Memory-mapped'],value='Pickle',description='Data Store:',disabled=False,tooltip='Storage of the data if saved with data',layout=ipw.Layout(width='200px'),style={'description_width': '100px'})
+        self.db_data_store_option.observe(self.db_data_store_option_change,names='value')
         self.load_button = ipw.Button(description='Load',disabled=False,tooltip='Load data into database',icon='download',layout=ipw.Layout(width='150px'))
         self.database_file_default = self.db.database_file
         self.load_button.on_click(self.load_data)
@@ -110,7 +117,7 @@ class loadapp():
         self.html_background_tasks_status = ipw.HTML(value='Status: Not Running',layout=ipw.Layout(width='200px'))
         
         ## Layout
-        self.loadapp_widgets = ipw.HBox([ipw.VBox([self.html_load,self.fc,self.db_load_option,self.db_save_option,self.db_save_with_data_option,self.db_maintance_option,self.db_save_overwrite,self.load_button,self.refresh_button]),
+        self.loadapp_widgets = ipw.HBox([ipw.VBox([self.html_load,self.fc,self.db_load_option,self.db_save_option,self.db_save_with_data_option,self.db_maintance_option,self.db_save_overwrite,self.db_backend_option,self.db_data_store_option,self.load_button,self.refresh_button]),
                                  ipw.VBox([self.html_save,self.export_db_button,self.export_liked_button]),
                                  ipw.VBox([self.background_tasts_html,
                                            ipw.HBox([self.button_background_start,self.button_background_stop]),
@@ -264,6 +271,19 @@ class loadapp():
         else:
             self.db.database_save_with_data = False
     
+    def db_backend_option_change(self,change):
+        if self.db_backend_option.value == 'SQLite':
+            self.db.set_database_backend('sqlite')
+        else:
+            self.db.set_database_backend('pickle')
+        self.database_file_default = self.db.database_file
+    
+    def db_data_store_option_change(self,change):
+        if self.db_data_store_option.value == 'Memory-mapped':
+            self.db.database_data_store = 'mmap'
+        else:
+            self.db.database_data_store = 'pickle'
+    
     ### Load Data Functions ###
 
     def load_data(self,change):
@@ -286,10 +306,12 @@ class loadapp():
                     # Is a database file selected?
                     check_for_other_databases = False
                     if selected_db_filename != '':
-                        # Check if selected file is a'.pickle' file
-                        if selected_db_filename.endswith('.pickle'):
+                        # Check if selected file is a '.pickle' or '.sqlite' file
+                        default_database_filename = self.db.database_file
+                        default_database_backend = self.db.database_backend
+                        if selected_db_filename.endswith('.pickle') or selected_db_filename.endswith('.sqlite'):
                             # Check if it is a viable database file
-                            default_database_filename = self.db.database_file
+                            self.db.set_database_backend(self.db.database_backend_from_file(selected_db_filename))
                             self.db.database_file = selected_db_filename
                             is_this_a_database = self.db.load_db(directory,database_check=True)
                         else:
@@ -297,6 +319,7 @@ class loadapp():
                         if is_this_a_database == True:
                             check_for_other_databases = False
                         else:
+                            self.db.set_database_backend(default_database_backend)
                             self.db.database_file = default_database_filename
                             check_for_other_databases = True
                     else:
@@ -309,6 +332,7 @@ class loadapp():
                         if len(possible_database_file) > 0:
                             newest_db = self.db.newest_db(directory)
                             if newest_db != None:
+                                self.db.set_database_backend(self.db.database_backend_from_file(newest_db))
                                 self.db.database_file = newest_db
                 else:
                     current_force_new_import_bool = True
@@ -328,7 +352,7 @@ class loadapp():
 
                 # Saving database
                 if self.db_save_option.value == 'Enable':
-                    self.db.save_db(directory)
+                    self.db.save_db_async(directory)
 
                 # Initalizing tabs
                 self.initalize_tabs()
@@ -351,17 +375,19 @@ class loadapp():
             self.db_save_option.disabled = True
             self.load_button.disabled = True
             self.db_maintance_option.disabled = True
+            self.db_backend_option.disabled = True
         else:
             self.db_load_option.disabled = False
             self.db_save_option.disabled = False
             self.load_button.disabled = False
             self.db_maintance_option.disabled = False
+            self.db_backend_option.disabled = False
 
     def check_for_existing_database(self):
         possible_database_file = []
         files = os.listdir(self.fc.selected_path)
         for file in files:
-            if  file.endswith('.pickle'):
+            if  file.endswith('.pickle') or file.endswith('.sqlite'):
                 possible_database_file.append(file)
         return possible_database_file
             
@@ -388,8 +414,8 @@ class loadapp():
     ### Save Data Functions ###
     
     def export_db(self,change):
-        """Saves the database"""
-        self.db.save_db(self.db.directory)
+        """Saves the database (on the writer thread of the db_manager)"""
+        self.db.save_db_async(self.db.directory)
 
     def save_liked_and_tags_as_text(self,change):
         """Saves the liked and tags data as a text file"""
@@ -419,13 +445,20 @@ class loadapp():
                 print('loadapp.save_liked_and_tags_as_text: complete')
 
     ### Background Tasks Functions ###
-    # - Checks peridodically for new data
-    # - Saves database peridodically
+    # - Watches the directory for new, modified and deleted data (see file_watcher)
+    # - Saves database peridodically (if it has changed)
 
-    def background_tasks_new_data_thread(self):
-        """Checks the directory for new data and updates the database"""
-        new_data = self.db.update(self.db.directory)
+    def background_tasks_new_data_thread(self,filenames=None):
+        """
+        Updates the database with the changed files and refreshes the viewers.
+        If filenames is None, the whole directory is compared with the database.
+        """
         print('loadapp.background_tasks_new_data_thread: Checking for new data')
+        with self.background_tasks_lock:
+            if filenames == None:
+                new_data = self.db.update(self.db.directory)
+            else:
+                new_data = self.db.update_files(self.db.directory,filenames)
         if new_data == True:
             # Update the databrowser
             self.dbrowser.refresh_viewers()
@@ -439,17 +472,25 @@ class loadapp():
 
     def background_tasks_save_db_thread(self):
         """Saves the database according to options specified in the load options"""
-        self.db.save_db(self.db.directory)
+        with self.background_tasks_lock:
+            self.db.save_db(self.db.directory)
         print('loadapp.background_tasks_save_db_thread: Saving database')
 
     def background_tasks_thread_wrapper(self):
-        """Wrapper for the background tasks thread with a delay of 5 minutes"""
-        while self.stop_event.is_set() == False:
-            print('loadapp.background_tasks_thread_wrapper: Running background tasks')
-            self.background_tasks_new_data_thread()
-            time.sleep(5)
-            self.background_tasks_save_db_thread()
-            time.sleep(1*60)
+        """
+        Wrapper for the background tasks thread. Catches up with the changes of the directory, then the file watcher
+        reports changed files as soon as they are completely written (in the subdirectories as well, if the file indexer
+        of the database is recursive). The database is saved every minute if it has changed.
+        """
+        print('loadapp.background_tasks_thread_wrapper: Running background tasks')
+        self.background_tasks_new_data_thread()
+        self.watcher = file_watcher(self.db.directory,self.background_tasks_new_data_thread,recursive=self.db.file_indexer.recursive)
+        self.watcher.start()
+        print('loadapp.background_tasks_thread_wrapper: Watching directory ('+self.watcher.backend+')')
+        while self.stop_event.wait(1*60) == False:
+            if self.db.database_saved == False:
+                self.background_tasks_save_db_thread()
+        self.watcher.stop()
         
     def background_tasks_start(self,change):
         """Starts the background tasks thread"""
@@ -463,6 +504,7 @@ class loadapp():
 
         # Start thread
         self.stop_event = threading.Event()
+        self.background_tasks_lock = threading.Lock()
         self.background_tasks_thread = threading.Thread(target=self.background_tasks_thread_wrapper)
         self.background_tasks_thread.start()
 
@@ -478,6 +520,7 @@ class loadapp():
         # Stop thread
         self.stop_event.set()
         self.background_tasks_thread.join()
+        self.db.wait_for_save()
         print('loadapp.background_tasks_stop: Background tasks stopped')
         
 
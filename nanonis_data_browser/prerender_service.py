@@ -0,0 +1,208 @@
+"""
+Description:    background prerender service of the browser thumbnails for the python based Nanonis data browser
+
+"""
+
+### Load libraries
+import os
+import heapq
+import itertools
+import threading
+import thumbnail
+from helpers import tempdir_maker
+
+
+class prerender_service():
+    """
+    prerender_service renders the thumbnails of the favourite channels of the files in a pool of worker threads
+    and writes them to the prerender cache (display property 'prerender', see thumbnail.write_prerender).
+
+    Jobs are taken in the order of their priority ('visible' before 'new' before 'background', then first come
+    first served). A data_id is queued at most once, submitting it again with a higher priority moves it forward.
+    Files that already have a thumbnail of their current channel are not rendered again, the callbacks are called
+    with the cached thumbnail. Threads are used (not processes) because the spm objects live in db.db_data; the
+    rendering (NumPy, PNG encoding) releases the GIL for most of its time.
+
+    Input:
+        db: db_manager
+
+    Optional Arguments:
+        workers: int, number of worker threads (default: min(4,os.cpu_count()))
+        callback: function(data_id,key,image_bytes) that is called from the worker threads for every finished
+                  thumbnail (key: channel or '(xchannel,ychannel)', see thumbnail.prerender_key)
+
+    External Functions:
+        start(): Starts the worker threads
+        stop(): Stops the worker threads (queued jobs are dropped)
+        submit(data_ids,priority): Queues thumbnail jobs
+        prioritize(data_ids,priority): Moves queued jobs forward (e.g. of newly visible tiles)
+        pending(): Number of queued jobs
+        wait(timeout): Waits until all queued jobs are finished
+    """
+
+    priorities = {'visible':0,'new':1,'background':2}
+
+    def __init__(self,db,**kwargs):
+        self.db = db
+
+        if 'workers' in kwargs: self.workers = kwargs['workers']
+        else: self.workers = min(4,os.cpu_count() or 1)
+        self.callbacks = []
+        if 'callback' in kwargs and kwargs['callback'] != None:
+            self.callbacks.append(kwargs['callback'])
+
+        self.queue = [] # heap of (priority, sequence number, data_id)
+        self.queued = {} # {data_id:priority of its current entry in self.queue}
+        self.active = set() # data_ids that are rendered by a worker
+        self.deferred = set() # queued data_ids that were taken while they were rendered
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    ### Threads ###
+
+    def start(self):
+        """Starts the worker threads"""
+        if self.is_running():
+            return
+        self.stop_event.clear()
+        self.threads = [threading.Thread(target=self.run,daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Stops the worker threads, queued jobs are dropped"""
+        self.stop_event.set()
+        with self.condition:
+            self.queue = []
+            self.queued = {}
+            self.deferred = set()
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while len(self.queue) == 0 and not self.stop_event.is_set():
+                    self.condition.wait()
+                if self.stop_event.is_set():
+                    return
+                priority,_,data_id = heapq.heappop(self.queue)
+                # entries that were moved forward are skipped, data_ids that are rendered are queued again afterwards
+                if self.queued.get(data_id) != priority:
+                    continue
+                if data_id in self.active:
+                    self.deferred.add(data_id)
+                    continue
+                self.queued.pop(data_id)
+                self.active.add(data_id)
+            try:
+                self.render(data_id)
+            except Exception as e:
+                print('prerender_service.run: Error: could not render ',data_id,e)
+            finally:
+                with self.condition:
+                    self.active.discard(data_id)
+                    if data_id in self.deferred and data_id in self.queued:
+                        heapq.heappush(self.queue,(self.queued[data_id],next(self.sequence),data_id))
+                    self.deferred.discard(data_id)
+                    self.condition.notify_all()
+
+    ### Jobs ###
+
+    def submit(self,data_ids,priority='background'):
+        """
+        Queues the thumbnail jobs of data_ids (queued data_ids are moved forward if priority is higher).
+
+        Input:
+            data_ids: list of data_id
+            priority: 'visible', 'new' or 'background' (default: 'background')
+        """
+        self.queue_jobs(data_ids,self.priorities[priority],only_queued=False)
+
+    def prioritize(self,data_ids,priority='visible'):
+        """Moves the queued jobs of data_ids forward (data_ids that are not queued are ignored)"""
+        self.queue_jobs(data_ids,self.priorities[priority],only_queued=True)
+
+    def queue_jobs(self,data_ids,priority:int,only_queued:bool):
+        with self.condition:
+            for data_id in data_ids:
+                current = self.queued.get(data_id)
+                if current == None and only_queued:
+                    continue
+                if current == None or priority < current:
+                    self.queued.update({data_id:priority})
+                    heapq.heappush(self.queue,(priority,next(self.sequence),data_id))
+            self.condition.notify_all()
+
+    def pending(self):
+        """Number of queued and running jobs"""
+        with self.condition:
+            return len(self.queued) + len(self.active)
+
+    def wait(self,timeout=None):
+        """Waits until all jobs are finished (True) or timeout seconds passed (False)"""
+        with self.condition:
+            return self.condition.wait_for(lambda: len(self.queued) + len(self.active) == 0,timeout=timeout)
+
+    ### Rendering ###
+
+    def job(self,data_id):
+        """
+        Returns the prerender key and the thumbnail parameters of data_id (current channel of its viewer, else the
+        favourite channel), None if data_id has no channel to render.
+        """
+        filename_ending = self.db.db_get(data_id,'filename_ending')
+        if filename_ending == 'sxm':
+            channel = self.db.db_get(data_id,'current_channel') or self.db.db_get(data_id,'fchannel') \
+                      or (self.db.db_get(data_id,'channel_names') or [None])[0]
+            if channel == None:
+                return None
+            direction = self.db.db_get(data_id,'current_direction') or 'forward'
+            offset = self.db.db_get(data_id,'current_offset') or 0.0
+            return thumbnail.prerender_key('sxm',channel),{'channel':channel,'direction':direction,'offset':offset}
+        if filename_ending == 'dat':
+            xchannel = self.db.db_get(data_id,'current_xchannel') or self.db.db_get(data_id,'fxchannel')
+            ychannel = self.db.db_get(data_id,'current_ychannel') or self.db.db_get(data_id,'fychannel')
+            if xchannel == None or ychannel == None:
+                return None
+            return thumbnail.prerender_key('dat',(xchannel,ychannel)),{'xchannel':xchannel,'ychannel':ychannel}
+        return None
+
+    def render(self,data_id):
+        """Renders the thumbnail of data_id (if it is not in the prerender cache) and calls the callbacks"""
+        if data_id not in self.db.db_prop['data_prop']:
+            return
+        job = self.job(data_id)
+        if job == None:
+            return
+        key,params = job
+
+        image_bytes = None
+        prerendered = self.db.db_get(data_id,'prerender')
+        if prerendered != None and key in prerendered and os.path.isfile(prerendered[key]):
+            try:
+                with open(prerendered[key],'rb') as handle:
+                    image_bytes = handle.read()
+            except OSError:
+                image_bytes = None
+        if image_bytes == None:
+            spm_object = self.db.db_get_data(data_id)
+            if 'channel' in params:
+                image_bytes = thumbnail.sxm_thumbnail(spm_object,params['channel'],direction=params['direction'],
+                                                      offset=params['offset'],title=str(data_id))
+            else:
+                image_bytes = thumbnail.dat_thumbnail(spm_object,params['xchannel'],params['ychannel'],title=str(data_id))
+            thumbnail.write_prerender(self.db,data_id,key,image_bytes,tempdir_maker(self.db))
+
+        for callback in list(self.callbacks):
+            try:
+                callback(data_id,key,image_bytes)
+            except Exception as e:
+                print('prerender_service.render: Error in callback: ',e)
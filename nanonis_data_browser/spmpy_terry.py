@@ -18,6 +18,11 @@ Created on Tue Jan  3 15:13:13 2017
 # pip install spiepy
 
 import os as os
+import copy
+import time
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
 import numpy as np
 import nanonispy as nap
 import spiepy
@@ -91,23 +96,39 @@ class spm:
     del paName,paNickname,paScaling,paUnit
 
     # constructor
-    def __init__(self,path):
+    def __init__(self,path,**params):
         #import os as os
         #import numpy as np
         #import nanonispy as nap
+        
+        # Optional parameters:
+        # napImport: object with .header and .signals (like nanonispy) that is used instead of reading path,
+        #            e.g. memory-mapped signals of db_array_store
+        # lazy: only for .dat files (read with dat_fast_import): if True, the data is parsed on the first get_channel.
+        #       .sxm files are always read with sxm_mmap_import (header only, the data is memory-mapped on the
+        #       first get_channel), lazy has no effect for them
+        # cache: file_cache, parsed headers (and .dat columns) are read from and written to the cache
+        # channel_cache_max_bytes: memory cap of the processed channels of get_channel (see channel_cache)
               
       
         # self.path = path.replace('//', '/')
         abspath = os.path.abspath(path)
         self.path = '/'.join(abspath.split('\\')[-4:])
         self.name = self.path.split('/')[-1]
+        self.channel_cache = channel_cache(params.get('channel_cache_max_bytes',channel_cache_max_bytes))
         file_extension = os.path.splitext(path)[1]
         
         if file_extension == '.sxm':
-            self.napImport = nap.read.Scan(path)
+            if 'napImport' in params:
+                self.napImport = params['napImport']
+            else:
+                self.napImport = sxm_mmap_import(path,cache=params.get('cache'))
             self.type = 'scan'
         elif file_extension == '.dat':
-            self.napImport = nap.read.Spec(path)
+            if 'napImport' in params:
+                self.napImport = params['napImport']
+            else:
+                self.napImport = dat_fast_import(path,cache=params.get('cache'))
             self.type = 'spec'
         else:
             print('Datatype not supported.')
@@ -122,41 +143,136 @@ class spm:
  
         self.SignalsList = [SignalsListReference[i] for i in ch] #List of all recorded channels
         self.channels = [c['ChannelNickname'] for c in self.SignalsList] 
+        self.channel_numbers = channel_numbers(self.SignalsList)
         self.header = self.napImport.header
+
+        if isinstance(self.napImport,dat_fast_import):
+            # only the columns of the channels of spmpy are kept after parsing
+            self.napImport.signals.select_columns([c['ChannelName'] for c in self.SignalsList])
+            if not ('lazy' in params and params['lazy']):
+                self.napImport.signals.load()
         
         
     def __repr__(self):
         return self.path
+
+    def __getstate__(self):
+        # the processed channels are not pickled
+        state = self.__dict__.copy()
+        state.pop('channel_cache',None)
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.channel_cache = channel_cache()
+        if 'channel_numbers' not in state and 'SignalsList' in state:
+            self.channel_numbers = channel_numbers(self.SignalsList)
+    
+    def load_data(self):
+        # reads (or maps) the data of an spm object imported with sxm_mmap_import or dat_fast_import (no effect otherwise)
+        if isinstance(self.napImport.signals,(sxm_mmap_signals,dat_fast_signals)):
+            self.napImport.signals.load()
         
     #get channel
-    def get_channel(self,channel,direction = 'forward', flatten = False, offset = False,zero = False):
+    def get_channel(self,channel,direction = 'forward', flatten = False, offset = False,zero = False, scaled = True, copy = False):
+        
+        # flatten: True (mode 'xy', like spiepy.flatten_xy) or a mode of flatten_image ('plane','line','median_line')
+        # scaled: if False, the data is returned in the units of the file without ChannelScaling
+        #         (for .sxm files a view into the memory-mapped file, no copy), see get_channel_unit
+        # copy: if True, the data is returned as a new writable array
+        # Processed channels (scaled, flattened, offset or zero) are kept in self.channel_cache, repeated calls with
+        # the same arguments do not compute them again. Unprocessed channels (scaled=False or ChannelScaling 1) are
+        # views of the (memory-mapped) signals. Both are shared by all callers and returned read-only: changing the
+        # data in place (e.g. data -= data.mean()) raises ValueError, use copy=True (or np.array(data)) before changing it.
+        
+        if flatten in ('True','False'): # value of the Flatten dropdowns of the viewers
+            flatten = flatten == 'True'
+        
+        if copy:
+            (data,unit) = self.get_channel(channel,direction,flatten,offset,zero,scaled)
+            return (np.array(data),unit)
+        
+        if not scaled or not (flatten or offset or zero or self.get_channel_scaling(self.channel_nickname(channel,direction)) != 1):
+            (data,unit) = self.process_channel(channel,direction,flatten,offset,zero,scaled)
+            return (read_only_view(data),unit)
+        
+        key = (channel,direction,('xy' if flatten is True else flatten) if flatten else False,bool(offset),bool(zero))
+        signature = self.source_signature()
+        if not self.channel_cache.validate(signature):
+            self.unload_data()
+        result = self.channel_cache.get(key)
+        if result is None:
+            result = self.process_channel(channel,direction,flatten,offset,zero,scaled)
+            self.channel_cache.put(key,result)
+        return result
+    
+    def channel_number(self,channel):
+        # index of the ChannelNickname channel in self.SignalsList (ValueError if the channel was not recorded)
+        try:
+            return self.channel_numbers[channel]
+        except KeyError:
+            raise ValueError(str(channel) + ' is not a channel of ' + self.path)
+    
+    def channel_nickname(self,channel,direction):
+        # ChannelNickname of channel in direction (backward spectroscopy channels end with _bw)
+        if self.type == 'spec' and direction == 'backward':
+            return channel + '_bw'
+        return channel
+    
+    def source_signature(self):
+        # (size, modification time) of the data file, None if the data is not read from a file
+        path = getattr(self.napImport,'path',None)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_size,stat.st_mtime_ns)
+    
+    def unload_data(self):
+        # drops the read (or mapped) data, it is read again from the file on the next get_channel
+        if isinstance(self.napImport.signals,(sxm_mmap_signals,dat_fast_signals)):
+            self.napImport.signals.unload()
+    
+    def close(self):
+        # drops the memory mapping of an .sxm file (open mappings block renaming and deleting the file on Windows),
+        # the file is mapped again on the next get_channel
+        if isinstance(self.napImport.signals,sxm_mmap_signals):
+            self.napImport.signals.unload()
+    
+    def materialized(self):
+        # spm object with the data in memory for pickling with the data (e.g. a with_data snapshot of the database):
+        # a copy with an sxm_array_import for memory-mapped .sxm files, the object itself with its data read otherwise
+        if isinstance(self.napImport,sxm_mmap_import):
+            spm_copy = copy.copy(self)
+            spm_copy.napImport = self.napImport.materialize()
+            return spm_copy
+        self.load_data()
+        return self
+    
+    def process_channel(self,channel,direction,flatten,offset,zero,scaled):
+        # get_channel without the channel_cache
         
         #import spiepy
         #import numpy as np
         
         if self.type == 'scan':
-            chNum = [d['ChannelNickname'] for d in self.SignalsList].index(channel)
+            chNum = self.channel_number(channel)
             im = self.napImport.signals[self.SignalsList[chNum]['ChannelName']][direction]
-            im = im *self.SignalsList[chNum]['ChannelScaling']
+            if not scaled:
+                return (im,self.get_channel_unit(channel,scaled=False))
+            if self.SignalsList[chNum]['ChannelScaling'] != 1:
+                im = im *self.SignalsList[chNum]['ChannelScaling']
             
             if flatten:
-                if ~np.isnan(np.sum(im)):
-                    im, _ = spiepy.flatten_xy(im)
-                else:
-                    m,n = np.shape(im)
-                    i = np.argwhere(np.isnan(im))[0,0]
-                    im_cut = im[:i-1,:]
-                    im, _ = spiepy.flatten_xy(im_cut)
-                    empty = np.full((m-i,n),np.nan)
-                    im = np.vstack((im,empty))
-                    
-                    warnings.warn('NaN values in image')
-                    #im-np.nanmean(im)
+                # NaN pixels (partially acquired images) are excluded from the fit, see flatten_image
+                im, _ = flatten_image(im,mode='xy' if flatten is True else flatten)
                
             if offset:
-                im = im-np.mean(im)
+                im = im-np.nanmean(im)
             if zero:
-                im = im+abs(np.min(im))
+                im = im+abs(np.nanmin(im))
 
             unit = self.SignalsList[chNum]['ChannelUnit']
                 
@@ -168,14 +284,96 @@ class spm:
                 channel = channel + '_bw';
                 #print(channel)
             
-            chNum = [d['ChannelNickname'] for d in self.SignalsList].index(channel)
+            chNum = self.channel_number(channel)
             data =  self.napImport.signals[self.SignalsList[chNum]['ChannelName']]
-            data = data*self.SignalsList[chNum]['ChannelScaling']
+            if not scaled:
+                return (data,self.get_channel_unit(channel,scaled=False))
+            if self.SignalsList[chNum]['ChannelScaling'] != 1:
+                data = data*self.SignalsList[chNum]['ChannelScaling']
             unit = self.SignalsList[chNum]['ChannelUnit']
             
             return (data,unit)
             
         return
+
+    #get channel unit and scaling
+    def get_channel_unit(self,channel,scaled = True):
+        # returns the unit of get_channel(channel,scaled=scaled), the scaled data is data*get_channel_scaling(channel)
+        chNum = self.channel_number(channel)
+        if scaled:
+            return self.SignalsList[chNum]['ChannelUnit']
+        # unit of the file: 'Name (unit)'
+        channel_name = self.SignalsList[chNum]['ChannelName']
+        if channel_name.endswith(')') and '(' in channel_name:
+            return channel_name[channel_name.rindex('(')+1:-1]
+        if self.type == 'scan':
+            data_info = self.napImport.header.get('data_info',{})
+            if channel_name in data_info.get('Name',()):
+                return data_info['Unit'][list(data_info['Name']).index(channel_name)]
+        return ''
+
+    def get_channel_scaling(self,channel):
+        chNum = self.channel_number(channel)
+        return self.SignalsList[chNum]['ChannelScaling']
+    
+    #get several channels as one array
+    def get_channels(self,channels = None,directions = None, scaled = True):
+        
+        # channels: list of ChannelNicknames (default: all channels, for spectra without the _bw channels)
+        # directions: 'forward', 'backward' or a list of them (default: ['forward','backward'] for scans, 'forward' for spectra)
+        # scaled: if False, the data is in the units of the file without ChannelScaling (see get_channel_unit)
+        # returns (data,units): data is one array (channel x direction x y x x) for scans and (channel x direction x n)
+        #         for spectra, without the direction axis if directions is a str. units: list of the channel units.
+        #         Unscaled channels of .sxm files that are evenly spaced in the file are a read-only view into the
+        #         memory-mapped file (no copy), otherwise the channels are written into one new array.
+        
+        if channels is None:
+            channels = [c for c in self.channels if not (self.type == 'spec' and c.endswith('_bw'))]
+        if directions is None:
+            directions = ['forward','backward'] if self.type == 'scan' else 'forward'
+        direction_list = [directions] if isinstance(directions,str) else list(directions)
+        
+        names = [[self.channel_nickname(channel,direction) for direction in direction_list] for channel in channels]
+        units = [self.get_channel_unit(channel_names[0],scaled=scaled) for channel_names in names]
+        
+        view = self.get_channels_view(channels,direction_list) if not scaled else None
+        if view is not None:
+            data = read_only_view(view)
+        else:
+            sources = [[self.get_channel(name,direction,scaled=False)[0] if self.type == 'scan' else self.get_channel(name,scaled=False)[0]
+                        for name,direction in zip(channel_names,direction_list)] for channel_names in names]
+            scalings = [[self.get_channel_scaling(name) if scaled else 1 for name in channel_names] for channel_names in names]
+            shape = np.shape(sources[0][0]) if len(sources) > 0 else (0,)
+            # the dtype of get_channel (e.g. float32 data times a python scaling stays float32)
+            dtype = np.result_type(*[source.dtype for row in sources for source in row],*[scaling for row in scalings for scaling in row]) if len(sources) > 0 else float
+            data = np.empty((len(channels),len(direction_list)) + tuple(shape),dtype=dtype)
+            for i,channel_names in enumerate(names):
+                for j,name in enumerate(channel_names):
+                    scaling = scalings[i][j]
+                    if scaling != 1:
+                        np.multiply(sources[i][j],scaling,out=data[i,j])
+                    else:
+                        data[i,j] = sources[i][j]
+        
+        if isinstance(directions,str):
+            data = data[:,0]
+        return (data,units)
+    
+    def get_channels_view(self,channels,directions):
+        # view (channel x direction x y x x) into the memory-mapped .sxm file if the channels and directions are
+        # evenly spaced in the file, None otherwise
+        signals = self.napImport.signals
+        if self.type != 'scan' or not isinstance(signals,sxm_mmap_signals) or len(channels) == 0:
+            return None
+        channel_indices = [signals.channel_names.index(self.SignalsList[self.channel_number(channel)]['ChannelName']) for channel in channels]
+        direction_indices = [['forward','backward'].index(direction) for direction in directions]
+        slices = []
+        for indices in [channel_indices,direction_indices]:
+            step = indices[1] - indices[0] if len(indices) > 1 else 1
+            if step <= 0 or indices != list(range(indices[0],indices[0]+step*len(indices),step)):
+                return None
+            slices.append(slice(indices[0],indices[0]+step*len(indices),step))
+        return signals.mapped_data()[slices[0],slices[1]].view(np.ndarray)
     
     #get parameter            
     def get_param(self,param):
@@ -571,17 +769,549 @@ class spm:
  
             
 
+##############################################
+# header-only import for spm class
+##############################################
+
+# version of sxm_mmap_import and dat_fast_import, cached files of other versions are parsed again (see file_cache)
+parser_version = 1
+
+
+class dat_fast_import:
+    """
+    Native reader of .dat files, replacement for nanonispy.read.Spec (.header and .signals).
+    Only the ASCII header and the column names are read on construction. The [DATA] block is parsed in one
+    vectorized call (numpy.fromstring) on the first access of a signal, files with missing values (or values that
+    are not numbers, read as NaN) are parsed with numpy.genfromtxt like nanonispy. If columns are selected
+    (see dat_fast_signals.select_columns), only these columns are kept in memory.
+    The throughput of the last parse is stored in .parse_stats {'bytes','rows','columns','seconds','MB/s'}.
+    With a file_cache (cache), the header and the parsed columns are read from the cache if the file is unchanged.
+    """
+
+    def __init__(self,path,cache=None):
+        self.path = path
+        self.cache = cache
+        self.cache_meta = cache.get(path,parser_version) if cache is not None else None
+        if self.cache_meta is not None and self.cache_meta['fields'].get('filetype') == 'spec':
+            self.header = self.cache_meta['header']
+            self.data_offset = self.cache_meta['fields']['data_offset']
+            self.column_names = self.cache_meta['fields']['column_names']
+        else:
+            self.cache_meta = None
+            napFile = nap.read.NanonisFile(path)
+            if napFile.filetype != 'spec':
+                raise nap.read.UnhandledFileError(path + ' is not a .dat file')
+            self.header = nap.read._parse_dat_header(napFile.header_raw)
+            with open(path,'rb') as f:
+                f.seek(napFile.byte_offset)
+                column_line = f.readline()
+                self.data_offset = f.tell()
+            self.column_names = column_line.decode('utf-8',errors='replace').strip('\r\n').split('\t')
+            self.cache_put(None)
+        self.filetype = 'spec'
+        self.parse_stats = None
+        self.signals = dat_fast_signals(self)
+
+    def cache_put(self,arrays):
+        if self.cache is not None:
+            self.cache.put(self.path,parser_version,self.header,{'filetype':'spec','data_offset':self.data_offset,'column_names':self.column_names},arrays)
+            self.cache_meta = None
+
+    def parse(self,columns,cache=False):
+        """
+        Parses the [DATA] block, returns {column_name:array} of columns (list, all columns if None).
+        If cache is True, the columns are read from and written to self.cache.
+        """
+        if cache and self.cache is not None:
+            if self.cache_meta is None:
+                self.cache_meta = self.cache.get(self.path,parser_version)
+            arrays = self.cache.get_arrays(self.path,self.cache_meta)
+            if arrays is not None and all(column_name in arrays for column_name in (columns if columns is not None else self.column_names)):
+                return {column_name:arrays[column_name] for column_name in self.column_names if columns is None or column_name in columns}
+        start = time.perf_counter()
+        with open(self.path,'rb') as f:
+            f.seek(self.data_offset)
+            data_raw = f.read()
+        column_number = len(self.column_names)
+        try:
+            data = np.fromstring(data_raw,dtype=np.float64,sep=' ')
+        except ValueError:
+            # values that are not numbers
+            data = None
+        # every complete row has column_number values separated by column_number-1 tabs
+        row_number = data.size // column_number if data is not None and column_number > 0 else 0
+        if data is not None and data.size == row_number*column_number and data_raw.count(b'\t') == row_number*(column_number-1):
+            data = data.reshape(row_number,column_number)
+        else:
+            # missing values, values that are not numbers (or rows of different length)
+            with open(self.path,'rb') as f:
+                header_lines = f.read(self.data_offset).count(b'\n')
+            data = np.genfromtxt(self.path,delimiter='\t',skip_header=header_lines,ndmin=2)
+
+        signals = {}
+        for i,column_name in enumerate(self.column_names):
+            if columns is None or column_name in columns:
+                if i < data.shape[1]:
+                    signals.update({column_name:np.ascontiguousarray(data[:,i])})
+                else:
+                    signals.update({column_name:np.full(data.shape[0],np.nan)})
+        seconds = time.perf_counter() - start
+        self.parse_stats = {'bytes':len(data_raw),'rows':data.shape[0],'columns':len(signals),'seconds':seconds,
+                            'MB/s':len(data_raw)/1e6/seconds if seconds > 0 else float('inf')}
+        if cache:
+            self.cache_put(signals)
+        return signals
+
+    def load(self):
+        # reads all signals of the file
+        return self.parse(None)
+
+
+class dat_fast_signals(Mapping):
+    """
+    Read-only mapping {column_name:array} of dat_fast_import. The [DATA] block is parsed on the first access of any
+    column. Only the selected columns are kept (all if select_columns was not called), a column that was not
+    selected is parsed on its access. Parsing and unloading are locked (threads can read the same file).
+    """
+
+    def __init__(self,fast_import):
+        self.fast_import = fast_import
+        self.channel_names = fast_import.column_names
+        self.selected_columns = None
+        self.loaded_signals = None
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('lock',None)
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
+
+    def select_columns(self,columns:list):
+        self.selected_columns = list(columns)
+
+    def __getitem__(self,channel_name):
+        if channel_name not in self.channel_names:
+            raise KeyError(channel_name)
+        with self.lock:
+            self.load()
+            if channel_name not in self.loaded_signals:
+                self.loaded_signals.update(self.fast_import.parse([channel_name]))
+            return self.loaded_signals[channel_name]
+
+    def load(self):
+        with self.lock:
+            if self.loaded_signals is None:
+                self.loaded_signals = self.fast_import.parse(self.selected_columns,cache=True)
+
+    def unload(self):
+        with self.lock:
+            self.loaded_signals = None
+
+    def __contains__(self,channel_name):
+        return channel_name in self.channel_names
+
+    def __iter__(self):
+        return iter(self.channel_names)
+
+    def __len__(self):
+        return len(self.channel_names)
+
+    def is_loaded(self):
+        return self.loaded_signals is not None
+
+
+class sxm_mmap_import:
+    """
+    Native reader of .sxm files, replacement for nanonispy.read.Scan (.header and .signals).
+    Only the ASCII header is parsed on construction. The data block (big-endian float32, channels x directions
+    x lines x pixels) is memory-mapped and .signals hands out views into the mapping without copying, such that
+    only the pages of the channels that are used are read. The mapping is copy-on-write: writing to a view does
+    not change the file.
+    Scans that were stopped before the end are padded with NaN (this copies the data that was recorded).
+    Pickling keeps only the path and the header, the file is mapped again on the next access of a signal
+    (use materialize to pickle the data as well).
+    With a file_cache (cache), the header is read from the cache if the file is unchanged.
+    """
+
+    def __init__(self,path,cache=None):
+        self.path = path
+        cache_meta = cache.get(path,parser_version) if cache is not None else None
+        if cache_meta is not None and cache_meta['fields'].get('filetype') == 'scan':
+            self.header = cache_meta['header']
+            self.data_offset = cache_meta['fields']['data_offset']
+        else:
+            napFile = nap.read.NanonisFile(path)
+            if napFile.filetype != 'scan':
+                raise nap.read.UnhandledFileError(path + ' is not a .sxm file')
+            self.header = nap.read._parse_sxm_header(napFile.header_raw)
+            self.data_offset = napFile.byte_offset + 4 # the data starts after the 4 byte code \x1A\x04 following :SCANIT_END:
+            if cache is not None:
+                cache.put(path,parser_version,self.header,{'filetype':'scan','data_offset':self.data_offset})
+        self.filetype = 'scan'
+        self.signals = sxm_mmap_signals(self)
+
+    def __getstate__(self):
+        return {'path':self.path,'header':self.header,'data_offset':self.data_offset}
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.filetype = 'scan'
+        self.signals = sxm_mmap_signals(self)
+
+    def map_data(self):
+        """Returns the data block as array (channels,2,ny,nx) of big-endian float32 (memory-mapped if the scan is complete)"""
+        channel_number = len(self.header['data_info']['Name'])
+        nx, ny = [int(n) for n in self.header['scan_pixels']]
+        shape = (channel_number,2,ny,nx)
+        dtype = np.dtype('>f4')
+        nbytes = int(np.prod(shape))*dtype.itemsize
+        file_size = os.path.getsize(self.path)
+        if nbytes == 0:
+            return np.zeros(shape,dtype=dtype)
+        if file_size - self.data_offset >= nbytes:
+            return np.memmap(self.path,dtype=dtype,mode='c',offset=self.data_offset,shape=shape)
+        # incomplete scan
+        data = np.full(int(np.prod(shape)),np.nan,dtype=dtype)
+        recorded = np.fromfile(self.path,dtype=dtype,offset=self.data_offset)
+        data[:len(recorded)] = recorded[:len(data)]
+        warnings.warn('sxm_mmap_import: incomplete scan, missing data is NaN: ' + self.path)
+        return data.reshape(shape)
+
+    def materialize(self):
+        """Returns an sxm_array_import with copies of all signals (not memory-mapped, pickled with the data)"""
+        signals = {channel_name:{direction:np.array(views[direction]) for direction in views}
+                   for channel_name,views in self.signals.items()}
+        return sxm_array_import(self.path,self.header,signals)
+
+
+class sxm_array_import:
+    """
+    .sxm import with the signals in memory (.header and .signals {ChannelName:{'forward':array,'backward':array}}
+    like nanonispy.read.Scan), made by sxm_mmap_import.materialize. Pickling keeps the data.
+    """
+
+    def __init__(self,path,header,signals):
+        self.path = path
+        self.header = header
+        self.signals = signals
+        self.filetype = 'scan'
+
+
+class sxm_mmap_signals(Mapping):
+    """
+    Read-only mapping {ChannelName:{'forward':array,'backward':array}} of sxm_mmap_import. The file is mapped on
+    the first access of any channel, the views of a channel are created on its first access. Mapping and unmapping
+    are locked, such that threads (e.g. the prerender_service and the viewers) can read the same file.
+    """
+
+    def __init__(self,mmap_import):
+        self.mmap_import = mmap_import
+        self.channel_names = list(mmap_import.header['data_info']['Name'])
+        self.data = None
+        self.mapped_signals = {}
+        self.lock = threading.RLock()
+
+    def __getitem__(self,channel_name):
+        with self.lock:
+            if channel_name not in self.mapped_signals:
+                channel_number = self.channel_names.index(channel_name)
+                data = self.mapped_data()
+                self.mapped_signals.update({channel_name:{'forward':data[channel_number,0].view(np.ndarray),
+                                                          'backward':data[channel_number,1].view(np.ndarray)}})
+            return self.mapped_signals[channel_name]
+
+    def mapped_data(self):
+        # data block (channels,2,ny,nx) of the file, mapped on the first call
+        with self.lock:
+            if self.data is None:
+                self.data = self.mmap_import.map_data()
+            return self.data
+
+    def load(self):
+        for channel_name in self.channel_names:
+            self[channel_name]
+
+    def unload(self):
+        with self.lock:
+            self.data = None
+            self.mapped_signals = {}
+
+    def __contains__(self,channel_name):
+        return channel_name in self.channel_names
+
+    def __iter__(self):
+        return iter(self.channel_names)
+
+    def __len__(self):
+        return len(self.channel_names)
+
+    def is_loaded(self):
+        return self.data is not None
+
+
+##############################################
+# flattening of images (NaN aware)
+##############################################
+
+flatten_modes = ['xy','plane','line','median_line']
+
+
+def flatten_image(images,mode='xy',order=1):
+    """
+    Flattens one image or a batch of images (array (...,ny,nx)) in one vectorized call. NaN pixels (e.g. of
+    partially acquired scans) are excluded from the fits and stay NaN.
+
+    Input:
+    images: array (ny,nx) or (...,ny,nx)
+
+    Optional input:
+    mode: 'xy'          first order plane from the average slopes of line and column fits (like spiepy.flatten_xy)
+          'plane'       least squares polynomial surface of order
+          'line'        least squares polynomial of order subtracted from every line
+          'median_line' median subtracted from every line
+    order: order of the polynomials of 'plane' and 'line' (default: 1)
+
+    Output:
+    images_flat: array (float64), images minus background
+    background: array (float64), the subtracted background
+    """
+    images = np.array(images,dtype=float)
+    if images.ndim < 2:
+        raise ValueError('flatten_image: images must have at least 2 dimensions')
+    valid = ~np.isnan(images)
+    weights = valid.astype(float)
+    images_zero = np.where(valid,images,0)
+    ny,nx = images.shape[-2:]
+    
+    if mode == 'xy':
+        background = _flatten_xy_background(weights,images_zero)
+    elif mode == 'plane':
+        background = _flatten_plane_background(weights,images_zero,order)
+    elif mode == 'line':
+        x = np.linspace(-1,1,nx)
+        coefficients = _masked_polyfit(weights,images_zero,x,order)
+        background = coefficients @ np.vander(x,order+1,increasing=True).T
+    elif mode == 'median_line':
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore',RuntimeWarning) # lines without data
+            background = np.broadcast_to(np.nanmedian(images,axis=-1,keepdims=True),images.shape)
+    else:
+        raise ValueError('flatten_image: mode must be one of ' + ', '.join(flatten_modes))
+    
+    images_flat = images - background
+    if mode == 'xy':
+        # offset: mean of the flattened images
+        count = weights.sum(axis=(-2,-1),keepdims=True)
+        offset = np.where(valid,images_flat,0).sum(axis=(-2,-1),keepdims=True) / np.maximum(count,1)
+        images_flat = images_flat - offset
+        background = background + offset
+    return images_flat, background
+
+
+def _masked_polyfit(weights,values_zero,x,order):
+    # least squares polynomials of order along the last axis, weights are 0 for missing values
+    # returns the coefficients (...,order+1) in increasing order
+    powers = np.vander(x,2*order+1,increasing=True)
+    moments = weights @ powers # (...,2*order+1)
+    index = np.add.outer(np.arange(order+1),np.arange(order+1))
+    normal_matrix = moments[...,index] # (...,order+1,order+1)
+    rhs = values_zero @ powers[:,:order+1]
+    return (np.linalg.pinv(normal_matrix) @ rhs[...,None])[...,0]
+
+
+def _flatten_xy_background(weights,images_zero):
+    # plane with the weighted average slope of all lines (x) and all columns (y), weight: fraction of valid
+    # points (lines with 2 or less points are not used)
+    ny,nx = images_zero.shape[-2:]
+    slopes = []
+    for axis_length,weights_axis,images_axis in [(nx,weights,images_zero),(ny,np.swapaxes(weights,-1,-2),np.swapaxes(images_zero,-1,-2))]:
+        coordinate = np.arange(axis_length,dtype=float)
+        count = weights_axis.sum(axis=-1)
+        sum_x = weights_axis @ coordinate
+        sum_xx = weights_axis @ coordinate**2
+        sum_z = images_axis.sum(axis=-1)
+        sum_xz = images_axis @ coordinate
+        denominator = count*sum_xx - sum_x**2
+        line_weight = np.where(count > 2,count/axis_length,0)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            line_slope = np.where(line_weight > 0,(count*sum_xz - sum_x*sum_z)/np.where(denominator == 0,1,denominator),0)
+        weight_sum = line_weight.sum(axis=-1)
+        slopes.append(np.where(weight_sum > 0,(line_slope*line_weight).sum(axis=-1)/np.where(weight_sum > 0,weight_sum,1),0))
+    slope_x,slope_y = slopes
+    return slope_x[...,None,None]*np.arange(nx) + slope_y[...,None,None]*np.arange(ny)[:,None]
+
+
+def _flatten_plane_background(weights,images_zero,order):
+    # least squares polynomial surface sum c_ij x^i y^j (i+j <= order), the moments are computed line by line
+    ny,nx = images_zero.shape[-2:]
+    x_powers = np.vander(np.linspace(-1,1,nx),2*order+1,increasing=True)
+    y_powers = np.vander(np.linspace(-1,1,ny),2*order+1,increasing=True)
+    moments = np.einsum('...ya,yb->...ab',weights @ x_powers,y_powers) # sum w x^a y^b
+    rhs_moments = np.einsum('...ya,yb->...ab',images_zero @ x_powers[:,:order+1],y_powers[:,:order+1]) # sum z x^a y^b
+    terms = [(i,j) for i in range(order+1) for j in range(order+1-i)]
+    term_x = np.array([i for i,_ in terms])
+    term_y = np.array([j for _,j in terms])
+    normal_matrix = moments[...,np.add.outer(term_x,term_x),np.add.outer(term_y,term_y)]
+    rhs = rhs_moments[...,term_x,term_y]
+    coefficients = (np.linalg.pinv(normal_matrix) @ rhs[...,None])[...,0]
+    coefficient_matrix = np.zeros(coefficients.shape[:-1] + (order+1,order+1))
+    coefficient_matrix[...,term_x,term_y] = coefficients
+    return y_powers[:,:order+1] @ np.swapaxes(coefficient_matrix,-1,-2) @ x_powers[:,:order+1].T
+
+
+def flatten_benchmark(shape=(2048,2048),nan_rows=0,repeats=3,**params):
+    """
+    Compares the runtime of flatten_image with spiepy.flatten_xy (as used by get_channel before, cut at the first
+    NaN row) on a random tilted image.
+
+    Optional input:
+    shape: (ny,nx) of the image (default: (2048,2048))
+    nan_rows: number of NaN lines at the end of the image (partially acquired scan)
+    repeats: the best time of repeats runs is reported
+    modes: list of the modes of flatten_image (default: flatten_modes)
+    show: print the results (default: True)
+
+    Output:
+    times: dict {'spiepy':s,mode:s,...}, max_difference: largest difference of mode 'xy' to spiepy
+    """
+    if 'modes' in params:
+        modes = params['modes']
+    else:
+        modes = flatten_modes
+    if 'show' in params:
+        show = params['show']
+    else:
+        show = True
+    
+    ny,nx = shape
+    rng = np.random.default_rng(0)
+    image = 0.3*np.arange(nx) + 0.1*np.arange(ny)[:,None] + rng.normal(size=shape)
+    if nan_rows > 0:
+        image[ny-nan_rows:] = np.nan
+    
+    def best_time(function):
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = function()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best,seconds)
+        return best,result
+    
+    def flatten_spiepy():
+        if nan_rows == 0:
+            return spiepy.flatten_xy(image)[0]
+        return np.vstack((spiepy.flatten_xy(image[:ny-nan_rows])[0],np.full((nan_rows,nx),np.nan)))
+    
+    times = {}
+    times['spiepy'],reference = best_time(flatten_spiepy)
+    max_difference = None
+    for mode in modes:
+        times[mode],result = best_time(lambda: flatten_image(image,mode=mode)[0])
+        if mode == 'xy':
+            max_difference = float(np.nanmax(np.abs(result - reference)))
+    if show:
+        print('flatten_benchmark ' + str(shape) + ', ' + str(nan_rows) + ' NaN lines: ' +
+              ', '.join(key + ' ' + '%.1f ms' % (seconds*1000) for key,seconds in times.items()))
+    return times, max_difference
+
+
+##############################################
+# processed channel cache for spm class
+##############################################
+
+# default memory cap of the processed channels of one spm object (bytes)
+channel_cache_max_bytes = 64*1024**2
+
+
+class channel_cache:
+    """
+    LRU cache {(channel,direction,flatten,offset,zero):(data,unit)} of the processed channels of spm.get_channel.
+    The cached arrays are read-only. If the bytes of all arrays exceed max_bytes, the least recently used
+    results are dropped. All results are dropped if the signature of the data file (see spm.source_signature)
+    changes. All methods are locked, get_channel is called from several threads (prerender_service, viewers).
+    """
+
+    def __init__(self,max_bytes=None):
+        if max_bytes is None:
+            max_bytes = channel_cache_max_bytes
+        self.max_bytes = max_bytes
+        self.results = OrderedDict()
+        self.nbytes = 0
+        self.signature = None
+        self.lock = threading.RLock()
+
+    def validate(self,signature):
+        # returns False (and clears the cache) if signature differs from the one of the cached results,
+        # a file that cannot be read (signature None) keeps the cached results
+        with self.lock:
+            if signature is None or signature == self.signature:
+                return True
+            changed = self.signature is not None
+            self.clear()
+            self.signature = signature
+            return not changed
+
+    def get(self,key):
+        with self.lock:
+            result = self.results.get(key)
+            if result is not None:
+                self.results.move_to_end(key)
+            return result
+
+    def put(self,key,result):
+        data = result[0]
+        if not isinstance(data,np.ndarray) or data.nbytes > self.max_bytes:
+            return
+        data.setflags(write=False)
+        with self.lock:
+            if key in self.results:
+                self.nbytes -= self.results.pop(key)[0].nbytes
+            self.results.update({key:result})
+            self.nbytes += data.nbytes
+            while self.nbytes > self.max_bytes:
+                _,(old_data,_) = self.results.popitem(last=False)
+                self.nbytes -= old_data.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.nbytes = 0
+
+
 ##############################################
 # functions for spm class
 ##############################################
+
+def read_only_view(data):
+    # read-only view of an array that is shared by all callers (e.g. the signals of the memory-mapped file)
+    if isinstance(data,np.ndarray):
+        data = data.view()
+        data.setflags(write=False)
+    return data
+
+def channel_numbers(signals_list):
+    # {ChannelNickname:index in signals_list}, the first channel of a nickname (like list.index)
+    numbers = {}
+    for i,signal in enumerate(signals_list):
+        numbers.setdefault(signal['ChannelNickname'],i)
+    return numbers
+
         
         
 # import all files in folder as list of spm objects
-def importall(FilePath,FilePrefix = '',ImportOnly = '' ):
+def importall(FilePath,FilePrefix = '',ImportOnly = '',**params):
+    
+    # Optional parameters (see import_parallel):
+    # workers, min_parallel, progress_callback, cancel_event, lazy
     
     from os import walk
     
-    files = []
+    paths = []
     NumSpec = 0
     NumScan = 0
     
@@ -590,17 +1320,125 @@ def importall(FilePath,FilePrefix = '',ImportOnly = '' ):
         for file in filenames:
             if file.endswith(".sxm") and file.startswith(FilePrefix):
                 if not(ImportOnly == 'spec'):
-                    files.append(spm(root + '/' + file))
-                    NumScan = NumScan + 1
+                    paths.append(root + '/' + file)
             elif file.endswith(".dat") and file.startswith(FilePrefix):
                 if not(ImportOnly == 'scan'):
-                    files.append(spm(root + '/' + file))
-                    NumSpec = NumSpec + 1   
+                    paths.append(root + '/' + file)
+    
+    files = [f for f in import_parallel(paths,**params) if f is not None]
+    for f in files:
+        if f.type == 'scan':
+            NumScan = NumScan + 1
+        else:
+            NumSpec = NumSpec + 1
         
     print(str(len(files)) + ' files imported; ' + str(NumScan) + ' scan(s) and ' + str(NumSpec) + ' spectra')
 
     return files
 
+
+def _import_spm(path,lazy=False,cache=None):
+# worker of import_parallel (module level, such that it can be sent to the process pool)
+    return spm(path,lazy=lazy,cache=cache)
+
+
+def import_parallel(paths,**params):
+    """
+    Imports files as spm objects in a process pool. The results are in the order of paths.
+
+    Input:
+    paths: list of file paths (.sxm or .dat)
+
+    Optional input:
+    workers: number of processes (default: os.cpu_count())
+    min_parallel: fewer files than this are imported serially in this process (default: 16)
+    progress_callback: function(number_imported, number_total, path) called after each file
+    cancel_event: threading.Event, if set no further files are imported
+    lazy: if True, only the headers of .dat files are read (see spm), .sxm files are always memory-mapped
+    cache: file_cache of the parsed headers (see spm), the processes write to it without eviction,
+           the cache folders are evicted once after the batch
+
+    Output:
+    files: list of spm objects, None for files that failed or were cancelled
+    """
+    
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    
+    if 'workers' in params and params['workers'] != None:
+        workers = params['workers']
+    else:
+        workers = os.cpu_count() or 1
+    
+    if 'min_parallel' in params:
+        min_parallel = params['min_parallel']
+    else:
+        min_parallel = 16
+        
+    if 'progress_callback' in params:
+        progress_callback = params['progress_callback']
+    else:
+        progress_callback = None
+        
+    if 'cancel_event' in params:
+        cancel_event = params['cancel_event']
+    else:
+        cancel_event = None
+        
+    if 'lazy' in params:
+        lazy = params['lazy']
+    else:
+        lazy = False
+        
+    if 'cache' in params:
+        cache = params['cache']
+    else:
+        cache = None
+    
+    files = [None]*len(paths)
+    number_imported = 0
+    
+    # serial import for small batches
+    if workers <= 1 or len(paths) < min_parallel:
+        for i,path in enumerate(paths):
+            if cancel_event is not None and cancel_event.is_set():
+                print('import_parallel: cancelled after ' + str(number_imported) + ' of ' + str(len(paths)) + ' files')
+                break
+            try:
+                files[i] = spm(path,lazy=lazy,cache=cache)
+            except Exception as e:
+                print('import_parallel: could not import ' + str(path) + ': ' + str(e))
+            number_imported = number_imported + 1
+            if progress_callback is not None:
+                progress_callback(number_imported,len(paths),path)
+        return files
+    
+    # parallel import
+    executor = ProcessPoolExecutor(max_workers=min(workers,len(paths)))
+    worker_cache = cache.without_eviction() if cache is not None else None
+    try:
+        futures = {executor.submit(_import_spm,path,lazy,worker_cache): i for i,path in enumerate(paths)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                files[i] = future.result()
+                if getattr(files[i].napImport,'cache',None) is not None:
+                    # later (lazy) parses in this process write to the evicting cache
+                    files[i].napImport.cache = cache
+            except Exception as e:
+                print('import_parallel: could not import ' + str(paths[i]) + ': ' + str(e))
+            number_imported = number_imported + 1
+            if progress_callback is not None:
+                progress_callback(number_imported,len(paths),paths[i])
+            if cancel_event is not None and cancel_event.is_set():
+                print('import_parallel: cancelled after ' + str(number_imported) + ' of ' + str(len(paths)) + ' files')
+                break
+    finally:
+        executor.shutdown(wait=True,cancel_futures=True)
+        if cache is not None:
+            cache.evict_folders(paths)
+    
+    return files
+
 # def importspecific(FilePath,FileList,FilePrefix = '',ImportOnly = '' ):
     
 #     from os import walk
@@ -686,30 +1524,45 @@ def specs_plot(specs,**params):
     return fig
 
 
-def relative_position(img,spec,**params):
+def scan_frame(img):
+# returns the frame of the scan img: {'offset_x','offset_y' (center), 'width','height' (nm), 'angle' (deg)}
     
-    #width = ref.get_param('width')
-    #height = ref.get_param('height')
-    #[px_x,px_y] = ref.get_param('scan_pixels')
-
     [o_x,o_y] = img.get_param('scan_offset')
     width = img.get_param('width')[0]
     height = img.get_param('height')[0]
-    [o_x,o_y] = [o_x*10**9,o_y*10**9]
+    angle = float(img.get_param('scan_angle'))
+    
+    return {'offset_x':o_x*10**9,'offset_y':o_y*10**9,'width':width,'height':height,'angle':angle}
 
-    angle = float(img.get_param('scan_angle'))*-1* np.pi/180
 
+def relative_positions(frame,positions):
+# returns the positions (array (n,2), nm) relative to the lower left corner of the scan frame as array (n,2) in nm
+# frame: spm object of a scan or dict of scan_frame (the values may be arrays of the same length as positions)
+    
+    if isinstance(frame,spm):
+        frame = scan_frame(frame)
+    positions = np.asarray(positions,dtype=float).reshape(-1,2)
+    
+    angle = np.asarray(frame['angle'],dtype=float)*-1* np.pi/180
+    dx = positions[:,0]-frame['offset_x']
+    dy = positions[:,1]-frame['offset_y']
+    
+    #Transforming to relative coordinates with angle
+    x_rel = dx*np.cos(angle) + dy*np.sin(angle)+np.asarray(frame['width'])/2
+    y_rel = -dx*np.sin(angle) + dy*np.cos(angle)+np.asarray(frame['height'])/2
+    return np.stack((x_rel,y_rel),axis=-1)
+
+
+def relative_position(img,spec,**params):
+    
+    #width = ref.get_param('width')
+    #height = ref.get_param('height')
+    #[px_x,px_y] = ref.get_param('scan_pixels')
     
     x_spec = spec.get_param('x')[0]
     y_spec = spec.get_param('y')[0]
     
-    if angle != 0:
-        #Transforming to relative coordinates with angle
-        x_rel = (x_spec-o_x)*np.cos(angle) + (y_spec-o_y)*np.sin(angle)+width/2
-        y_rel = -(x_spec-o_x)*np.sin(angle) + (y_spec-o_y)*np.cos(angle)+height/2
-    else:
-        x_rel = x_spec-o_x+width/2
-        y_rel = y_spec-o_y+height/2
+    [x_rel,y_rel] = relative_positions(img,[[x_spec,y_spec]])[0]
     return [x_rel,y_rel]
 
     
@@ -810,11 +1663,25 @@ def ref_spec_plotting(ref_file,spec_files,fname_ref,fname_specs,**params):
 # returns dict list of fitted kpfm parabolas for list of spm objects
 def kpfm(files,**params):
     
+    # Optional parameters:
+    # range: [first,last] index of the points that are fitted (default: all but the last point)
+    # fit_window: (V_min,V_max) or array (number of spectra,2), only points with V_min <= V <= V_max are fitted
+    #             (per spectrum, the same window is used for the backward sweeps)
+    # The forward and backward sweeps of all spectra are fitted together in one call of fit_parabola. If only some
+    # files have a backward sweep, the backward sweeps are fitted in a second call (a fit_window per spectrum
+    # raises a ValueError then, its rows cannot be assigned to the backward sweeps).
+    # V_max is the vertex of the parabola (the LCPD), df_max the frequency shift at the vertex.
+    
     if 'range' in params:
         range = params['range'];
     else:
         range = [0,len(files[0].get_channel('V')[0])-1]
     
+    if 'fit_window' in params:
+        fit_window = params['fit_window']
+    else:
+        fit_window = None
+    
     import numpy as np
     #sys.path.append('../')
     #import analyze as an
@@ -823,50 +1690,58 @@ def kpfm(files,**params):
     
     for f in files:
         if f.type == 'spec':
-            if any(d['ChannelNickname'] == 'df' for d in f.SignalsList):
+            if 'df' in f.channel_numbers:
                 
                 data['V'].append(f.get_channel('V')[0])
                 data['df'].append(f.get_channel('df')[0])
                 
-            if any(d['ChannelNickname'] == 'df_bw' for d in f.SignalsList):
+            if 'df_bw' in f.channel_numbers:
                 
                 if not('df_bw' in data.keys()):
                     data['V_bw'] = [];
                     data['df_bw'] = [];
                     
-                else:
-                    data['V_bw'].append(f.get_channel('V_bw')[0])
-                    data['df_bw'].append(f.get_channel('df_bw')[0])
+                data['V_bw'].append(f.get_channel('V_bw')[0])
+                data['df_bw'].append(f.get_channel('df_bw')[0])
                     
             x = f.get_param('x')[0]
             y = f.get_param('y')[0]
             
         data['position'].append([x,y])
-         
-                
-    (p_fit,err_p,df_fit,V_max,err_V_max,df_max,err_df_max) = fit_parabola(np.array(data['V'])[:,range[0]:range[1]].tolist(),np.array(data['df'])[:,range[0]:range[1]].tolist(),single_spectrum=False,fitMin=False,fitMax=False)
-    
-    data['p_fit'] = p_fit;
-    data['err_p'] = err_p;
-    data['V_fit'] = np.array(data['V'])[:,range[0]:range[1]].tolist();
-    data['df_fit'] = df_fit;
-    data['V_max'] = V_max;
-    data['err_V_max'] = err_V_max;
-    data['df_max'] = df_max;
-    data['err_df_max'] = err_df_max;
     
+    # forward and backward sweeps in one stacked array, fitted separately if not every file has a backward sweep
+    sweeps = [('',np.array(data['V'],dtype=float)[:,range[0]:range[1]],np.array(data['df'],dtype=float)[:,range[0]:range[1]])]
     if 'df_bw' in data.keys():
+        sweeps.append(('_bw',np.array(data['V_bw'],dtype=float)[:,range[0]:range[1]],np.array(data['df_bw'],dtype=float)[:,range[0]:range[1]]))
+    if len(sweeps) == 2 and len(sweeps[0][1]) == len(sweeps[1][1]):
+        groups = [sweeps]
+    else:
+        groups = [[sweep] for sweep in sweeps]
     
-        (p_fit_bw,err_p_bw,df_fit_bw,V_max_bw,err_V_max_bw,df_max_bw,err_df_max_bw) = fit_parabola(np.array(data['V_bw'])[:,range[0]:range[1]].tolist(),np.array(data['df_bw'])[:,range[0]:range[1]].tolist(),single_spectrum=False,fitMin=False,fitMax=False)
+    for group in groups:
+        V = np.concatenate([V_sweep for _,V_sweep,_ in group])
+        df = np.concatenate([df_sweep for _,_,df_sweep in group])
+        
+        mask = None
+        if fit_window is not None:
+            windows = []
+            for direction,V_sweep,_ in group:
+                window = np.asarray(fit_window,dtype=float)
+                if window.ndim == 2 and len(window) != len(V_sweep):
+                    raise ValueError('kpfm: fit_window has '+str(len(window))+' rows for '+str(len(V_sweep))+' sweeps (df'+direction+')')
+                windows.append(np.broadcast_to(window,(len(V_sweep),2)))
+            windows = np.concatenate(windows)
+            mask = (V >= windows[:,:1]) & (V <= windows[:,1:])
         
-        data['p_fit_bw'] = p_fit_bw;
-        data['err_p_bw'] = err_p_bw;
-        data['V_fit_bw'] = np.array(data['V_bw'])[:,range[0]:range[1]].tolist()
-        data['df_fit_bw'] = df_fit_bw;
-        data['V_max_bw'] = V_max_bw;
-        data['err_V_max_bw'] = err_V_max_bw;
-        data['df_max_bw'] = df_max_bw;
-        data['err_df_max_bw'] = err_df_max_bw;
+        results = fit_parabola(V,df,mask=mask)
+        
+        start = 0
+        for direction,V_sweep,_ in group:
+            part = slice(start,start+len(V_sweep))
+            start += len(V_sweep)
+            (data['p_fit'+direction],data['err_p'+direction],data['df_fit'+direction],data['V_max'+direction],
+             data['err_V_max'+direction],data['df_max'+direction],data['err_df_max'+direction]) = [result[part] for result in results]
+            data['V_fit'+direction] = V[part]
         
     return data
     
@@ -884,52 +1759,92 @@ def fit_parabola(
     single_spectrum=False,
     fitMin=False,
     fitMax=False,
+    mask=None,
     ):
     
     #import numpy as np
+    
+    # Fits the parabolas df = p[0]*bias**2 + p[1]*bias + p[2] of all spectra (rows of bias and df) in one
+    # vectorized least squares solve. The errors are derived from the covariance of the fit (like np.polyfit(cov=True)).
+    # Points are excluded from the fit if they are NaN, if mask (array like bias) is False, if bias <= fitMin[i]
+    # or if bias >= fitMax[i].
 
+    bias = np.array(bias,dtype=float,ndmin=1)
+    df = np.array(df,dtype=float,ndmin=1)
     if single_spectrum:
-        bias = np.array([bias])
-        df = np.array([df])
-    p_fit = np.zeros((len(bias), 3))
-    df_fit = np.zeros((len(bias), len(bias[0])))
-    err_p = np.zeros((len(bias), 3))
-    bias_max = np.zeros(len(bias))
-    err_bias_max = np.zeros(len(bias))
-    df_max = np.zeros(len(bias))
-    err_df_max = np.zeros(len(bias))
-
-    for i in range(len(bias)):
-        if not fitMin and not fitMax:
-            (p, cov) = np.polyfit(bias[i], df[i], 2, cov=True)
-        elif fitMin and not fitMax:
-
-            fit_i = np.where(bias[i] > fitMin[i])[0]
-            (p, cov) = np.polyfit(bias[i, fit_i], df[i, fit_i], 2,
-                                  cov=True)
-        p_fit[i] = p
-        err1 = np.sqrt(abs(cov))
-        err_p[i] = np.array([err1[0, 0], err1[1, 1], err1[2, 2]])
-
-        df_fit[i] = np.polyval(p, bias[i])
-
-        bias_max[i] = -p[1] / (2 * p[0])
-
+        bias = bias[None]
+        df = df[None]
+    
+    weights = ~(np.isnan(bias) | np.isnan(df))
+    if mask is not None:
+        weights &= np.asarray(mask,dtype=bool)
+    if fitMin is not False:
+        weights &= bias > np.asarray(fitMin,dtype=float).reshape(-1,1)
+    if fitMax is not False:
+        weights &= bias < np.asarray(fitMax,dtype=float).reshape(-1,1)
+    bias_zero = np.where(weights,bias,0)
+    df_zero = np.where(weights,df,0)
+    weights = weights.astype(float)
+    count = weights.sum(axis=1)
+    
+    # bias is centered and scaled per spectrum (condition of the normal equations)
+    center = bias_zero.sum(axis=1)/np.maximum(count,1)
+    u = (bias_zero - center[:,None])*weights
+    scale = np.max(np.abs(u),axis=1)
+    scale = np.where(scale > 0,scale,1)
+    u = u/scale[:,None]
+    
+    # moments sum(w*u**k) (k = 0..4) and sum(w*df*u**k) (k = 0..2)
+    moments = []
+    rhs = []
+    power = weights
+    for k in range(5):
+        moments.append(power.sum(axis=1))
+        if k < 3:
+            rhs.append((power*df_zero).sum(axis=1))
+        power = power*u
+    moments = np.stack(moments,axis=1)
+    rhs = np.stack(rhs,axis=1)
+    normal_matrix = moments[:,np.add.outer(np.arange(3),np.arange(3))]
+    normal_inverse = np.linalg.pinv(normal_matrix)
+    q = (normal_inverse @ rhs[...,None])[...,0] # coefficients of u**0, u**1, u**2
+    
+    residuals = ((q[:,:1] + (q[:,1:2] + q[:,2:]*u)*u - df_zero)**2*weights).sum(axis=1)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        factor = residuals/(count - 3)
+    cov_u = normal_inverse*factor[:,None,None]
+    
+    # back to bias: p = jacobian @ q[::-1] with p = (p2,p1,p0)
+    jacobian = np.zeros((len(bias),3,3))
+    jacobian[:,0,0] = 1/scale**2
+    jacobian[:,1,0] = -2*center/scale**2
+    jacobian[:,1,1] = 1/scale
+    jacobian[:,2,0] = center**2/scale**2
+    jacobian[:,2,1] = -center/scale
+    jacobian[:,2,2] = 1
+    p_fit = (jacobian @ q[:,::-1,None])[...,0]
+    cov = jacobian @ cov_u[:,::-1,::-1] @ np.swapaxes(jacobian,1,2)
+    err1 = np.sqrt(np.abs(np.diagonal(cov,axis1=1,axis2=2))) # errors of p
+    err_p = err1
+    
+    a,b,c = p_fit[:,0],p_fit[:,1],p_fit[:,2]
+    df_fit = a[:,None]*bias**2 + b[:,None]*bias + c[:,None]
+    
+    with np.errstate(invalid='ignore',divide='ignore'):
+        bias_max = -b / (2 * a)
+        
         # if errors independent
-
-        #err_bias_max[i] = abs(bias_max[i]) * np.sqrt((err1[1, 1]
-        #        / p[1]) ** 2 + (err1[0, 0] / p[0]) ** 2)
-        err_bias_max[i] = np.sqrt((err1[1, 1]/ (2*p[0]))** 2 + (err1[0, 0]*p[1] /(2*p[0]**2)) ** 2)
-
+        err_bias_max = np.sqrt((err1[:,1]/ (2*a))** 2 + (err1[:,0]*b /(2*a**2)) ** 2)
+        
         # maximum error in any case (John Tayler Error analysis book)
-
-        #err_bias_max[i] = abs(bias_max[i]) * (err1[1, 1] + err1[0, 0])
-
-        df_max[i] = np.polyval(p, bias_max[i])
-        err_df_max[i] = p[0] * bias_max[i] ** 2 * (err1[0, 0] + 2
-                * err_bias_max[i] / abs(bias_max[i])) + p[1] \
-            * bias_max[i] * (err1[1, 1] + err_bias_max[i]
-                             / abs(bias_max[i])) + p[2] * err1[2, 2]
+        
+        #err_bias_max = abs(bias_max) * (err1[:,1] + err1[:,0])
+        
+        df_max = a*bias_max**2 + b*bias_max + c
+        err_df_max = a * bias_max ** 2 * (err1[:,0] + 2
+                * err_bias_max / abs(bias_max)) + b \
+            * bias_max * (err1[:,1] + err_bias_max
+                             / abs(bias_max)) + c * err1[:,2]
     return (
         p_fit,
         err_p,
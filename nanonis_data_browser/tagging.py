@@ -98,12 +98,7 @@ class tagging():
         Output:
             all_tags: list[str]
         """
-        all_tags = []
-        all_data_ids = self.db.db_get_all_ids()
-        for data_id in all_data_ids:
-            for tag in self.db.db_get(data_id,"tags"):
-                if tag not in all_tags:
-                    all_tags.append(tag)
+        all_tags = self.db.db_index.all_tags()
         return all_tags
 
     ### Callbacks for widgets ###
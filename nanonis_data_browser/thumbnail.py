@@ -0,0 +1,389 @@
+"""
+Description:    thumbnail renderer of the databrowser tiles for the python based Nanonis data browser
+                (colormap lookup tables and rasterized spectra in NumPy, no matplotlib figure per tile)
+
+"""
+
+### Load libraries
+import io
+import time
+import hashlib
+import numpy as np
+import matplotlib
+from PIL import Image, ImageDraw, ImageFont
+
+# longer side of the thumbnails (px), similar to the figsize=(2,2) plots of the databrowser viewers at dpi 100
+thumbnail_size = 160
+# height of the title strip (px)
+title_height = 12
+# colors (RGB) of the spectra (matplotlib 'C0'), the frame of the spectra and missing pixels
+line_color = (31,119,180)
+frame_color = (128,128,128)
+background_color = (255,255,255)
+
+colormap_luts = {} # {cmap:(256,3) uint8}, see colormap_lut
+title_font = None
+
+
+##############################################
+# lookup tables and normalization
+##############################################
+
+def colormap_lut(cmap='gray'):
+    """
+    Returns the 256 entry lookup table (256,3) uint8 RGB of the matplotlib colormap cmap (computed once per cmap).
+    """
+    lut = colormap_luts.get(cmap)
+    if lut is None:
+        colormap = matplotlib.colormaps[cmap].resampled(256)
+        lut = np.round(colormap(np.arange(256))[:,:3]*255).astype(np.uint8)
+        colormap_luts.update({cmap:lut})
+    return lut
+
+def normalize(data,scale='Linear'):
+    """
+    Maps data to the indices 0..255 of a lookup table (minimum to maximum of the finite values, like imshow).
+
+    Input:
+        data: np.ndarray
+    Optional Arguments:
+        scale: 'Linear' or 'Log' (absolute values, logarithmic)
+    Output:
+        indices: uint8 array of the shape of data, valid: bool array (False for NaN / inf / non-positive with 'Log')
+    """
+    data = np.asarray(data,dtype=float)
+    if scale == 'Log':
+        data = np.abs(data)
+        with np.errstate(divide='ignore'):
+            data = np.where(data > 0,np.log10(data),np.nan)
+    valid = np.isfinite(data)
+    if not valid.any():
+        return np.zeros(data.shape,dtype=np.uint8),valid
+    if valid.all():
+        low,high = data.min(),data.max()
+    else:
+        low,high = data[valid].min(),data[valid].max()
+    factor = 255/(high - low) if high > low else 0.0
+    indices = np.clip((np.where(valid,data,low) - low)*factor + 0.5,0,255).astype(np.uint8)
+    return indices,valid
+
+
+##############################################
+# rendering
+##############################################
+
+def image_shape(shape,aspect=None,size=None):
+    """Returns the (rows,columns) of the thumbnail of an image with shape, aspect = physical width/height"""
+    if size is None:
+        size = thumbnail_size
+    if aspect is None or not np.isfinite(aspect) or aspect <= 0:
+        aspect = shape[1]/shape[0]
+    if aspect >= 1:
+        return max(1,int(round(size/aspect))),size
+    return size,max(1,int(round(size*aspect)))
+
+def render_image(data,**params):
+    """
+    Renders a 2D channel to an RGB thumbnail: the channel is sampled to the thumbnail size (nearest pixel),
+    normalized to 0..255 and mapped through the colormap lookup table.
+
+    Input:
+        data: 2D np.ndarray
+    Optional Arguments:
+        cmap: matplotlib colormap name (default: 'gray')
+        scale: 'Linear' or 'Log' (default: 'Linear')
+        origin: 'lower' (first row at the bottom, like imshow) or 'upper' (default: 'lower')
+        aspect: physical width/height of the image (default: columns/rows)
+        size: longer side of the thumbnail in px (default: thumbnail_size)
+    Output:
+        rgb: (rows,columns,3) uint8
+    """
+    if 'cmap' in params: cmap = params['cmap']
+    else: cmap = 'gray'
+    if 'scale' in params: scale = params['scale']
+    else: scale = 'Linear'
+    if 'origin' in params: origin = params['origin']
+    else: origin = 'lower'
+    if 'aspect' in params: aspect = params['aspect']
+    else: aspect = None
+    if 'size' in params: size = params['size']
+    else: size = None
+
+    data = np.asarray(data)
+    rows,columns = image_shape(data.shape,aspect,size)
+    row_index = ((np.arange(rows) + 0.5)*data.shape[0]/rows).astype(int)
+    column_index = ((np.arange(columns) + 0.5)*data.shape[1]/columns).astype(int)
+    if origin == 'lower':
+        row_index = row_index[::-1]
+    sampled = data[row_index[:,None],column_index[None,:]]
+
+    indices,valid = normalize(sampled,scale)
+    rgb = colormap_lut(cmap)[indices]
+    if not valid.all():
+        rgb[~valid] = background_color
+    return rgb
+
+def render_spectrum(x,y,**params):
+    """
+    Rasterizes the polyline (x, y) into an RGB thumbnail with a frame (all segments at once, NaN points are gaps).
+
+    Input:
+        x,y: 1D np.ndarray
+    Optional Arguments:
+        size: (columns,rows) of the thumbnail in px (default: (thumbnail_size,thumbnail_size))
+        color: RGB of the line (default: line_color)
+        linewidth: px (default: 2)
+    Output:
+        rgb: (rows,columns,3) uint8
+    """
+    if 'size' in params: columns,rows = params['size']
+    else: columns,rows = thumbnail_size,thumbnail_size
+    if 'color' in params: color = params['color']
+    else: color = line_color
+    if 'linewidth' in params: linewidth = params['linewidth']
+    else: linewidth = 2
+
+    rgb = np.empty((rows,columns,3),dtype=np.uint8)
+    rgb[...] = background_color
+    rgb[[0,-1],:] = frame_color
+    rgb[:,[0,-1]] = frame_color
+
+    x = np.asarray(x,dtype=float).ravel()
+    y = np.asarray(y,dtype=float).ravel()
+    length = min(len(x),len(y))
+    x,y = x[:length],y[:length]
+    finite = np.isfinite(x) & np.isfinite(y)
+    if not finite.any():
+        return rgb
+
+    # data to pixel coordinates (5 % margin like the matplotlib axes, first row at the top)
+    margin = 0.05
+    def pixels(values,pixel_number):
+        low,high = values[finite].min(),values[finite].max()
+        span = high - low if high > low else 1.0
+        low,span = low - margin*span,span*(1 + 2*margin)
+        return 1 + (values - low)/span*(pixel_number - 3)
+    px = pixels(x,columns)
+    py = (rows - 1) - pixels(y,rows)
+
+    # points along all segments, about one per pixel
+    segment = finite[:-1] & finite[1:]
+    if not segment.any():
+        xs,ys = px[finite],py[finite]
+    else:
+        x0,y0 = px[:-1][segment],py[:-1][segment]
+        dx,dy = px[1:][segment] - x0,py[1:][segment] - y0
+        steps = np.ceil(np.maximum(np.abs(dx),np.abs(dy))).astype(int) + 1
+        start = np.cumsum(steps) - steps
+        t = (np.arange(steps.sum()) - np.repeat(start,steps))/np.repeat(np.maximum(steps - 1,1),steps)
+        xs = np.repeat(x0,steps) + t*np.repeat(dx,steps)
+        ys = np.repeat(y0,steps) + t*np.repeat(dy,steps)
+    # pixels of the line (the margin keeps all points inside the frame), widened to linewidth
+    line = np.zeros((rows,columns),dtype=bool)
+    line[np.round(ys).astype(np.intp),np.round(xs).astype(np.intp)] = True
+    widened = line.copy()
+    for offset in range(linewidth):
+        shift = offset - linewidth//2
+        if shift < 0:
+            widened[:shift] |= line[-shift:]
+        elif shift > 0:
+            widened[shift:] |= line[:-shift]
+    line = widened.copy()
+    for offset in range(linewidth):
+        shift = offset - linewidth//2
+        if shift < 0:
+            line[:,:shift] |= widened[:,-shift:]
+        elif shift > 0:
+            line[:,shift:] |= widened[:,:-shift]
+    rgb[line] = color
+    return rgb
+
+
+##############################################
+# encoding
+##############################################
+
+def encode(rgb,**params):
+    """
+    Encodes an RGB thumbnail as PNG (or JPEG), optionally with a title strip above the image.
+
+    Input:
+        rgb: (rows,columns,3) uint8
+    Optional Arguments:
+        title: str (default: None, no title)
+        format: 'png' or 'jpeg' (default: 'png')
+    Output:
+        image_bytes: bytes
+    """
+    global title_font
+    if 'title' in params: title = params['title']
+    else: title = None
+    if 'format' in params: image_format = params['format']
+    else: image_format = 'png'
+
+    image = Image.fromarray(rgb,'RGB')
+    if title != None:
+        if title_font is None:
+            title_font = ImageFont.load_default()
+        canvas = Image.new('RGB',(image.width,image.height + title_height),background_color)
+        canvas.paste(image,(0,title_height))
+        ImageDraw.Draw(canvas).text((1,0),str(title),fill=(0,0,0),font=title_font)
+        image = canvas
+
+    output = io.BytesIO()
+    if image_format == 'jpeg':
+        image.save(output,'JPEG',quality=85)
+    else:
+        image.save(output,'PNG',compress_level=1)
+    return output.getvalue()
+
+
+##############################################
+# thumbnails of spm objects
+##############################################
+
+def sxm_thumbnail(sxm,channel:str,**params):
+    """
+    Returns the thumbnail (bytes) of a channel of an sxm file, with the parameters of databrowser_sxm_viewer.
+
+    Input:
+        sxm: spmpy_terry.spm
+        channel: str
+    Optional Arguments:
+        direction: 'forward' or 'backward' (default: 'forward')
+        offset: float (default: 0)
+        scale: 'Linear' or 'Log' (default: 'Linear')
+        cmap: str (default: 'gray')
+        title: str (default: None)
+        format: 'png' or 'jpeg' (default: 'png')
+    """
+    if 'direction' in params: direction = params['direction']
+    else: direction = 'forward'
+    if 'offset' in params: offset = params['offset']
+    else: offset = 0
+
+    (chData,chUnit) = sxm.get_channel(channel,direction=direction,flatten=False,offset=offset)
+    width = sxm.get_param('width')
+    height = sxm.get_param('height')
+    origin = 'upper' if sxm.get_param('scan_dir') == 'down' else 'lower'
+    try:
+        aspect = float(width[0])/float(height[0])
+    except (TypeError,ValueError,ZeroDivisionError):
+        aspect = None
+
+    rgb = render_image(chData,origin=origin,aspect=aspect,
+                       **{key:params[key] for key in ['cmap','scale','size'] if key in params})
+    return encode(rgb,**{key:params[key] for key in ['title','format'] if key in params})
+
+def dat_thumbnail(dat,xchannel:str,ychannel:str,**params):
+    """
+    Returns the thumbnail (bytes) of ychannel over xchannel of a dat file, with the parameters of databrowser_dat_viewer.
+
+    Input:
+        dat: spmpy_terry.spm
+        xchannel,ychannel: str
+    Optional Arguments:
+        direction: 'forward' or 'backward' (default: 'forward')
+        title: str (default: None)
+        format: 'png' or 'jpeg' (default: 'png')
+    """
+    if 'direction' in params: direction = params['direction']
+    else: direction = 'forward'
+
+    (dat_x,x_unit) = dat.get_channel(xchannel,direction)
+    (dat_y,y_unit) = dat.get_channel(ychannel,direction)
+    rgb = render_spectrum(dat_x,dat_y,**{key:params[key] for key in ['size','color','linewidth'] if key in params})
+    return encode(rgb,**{key:params[key] for key in ['title','format'] if key in params})
+
+def placeholder(title=None,**params):
+    """Returns a gray thumbnail (bytes) that is shown until the thumbnail of a file is rendered"""
+    if 'size' in params: columns,rows = params['size']
+    else: columns,rows = thumbnail_size,thumbnail_size
+    rgb = np.full((rows,columns,3),235,dtype=np.uint8)
+    return encode(rgb,title=title)
+
+def prerender_key(filename_ending:str,channels):
+    """Key of a thumbnail in the display property 'prerender': channel (sxm) or '(xchannel,ychannel)' (dat)"""
+    if filename_ending == 'dat':
+        return "("+channels[0]+","+channels[1]+")"
+    return channels
+
+def prerender_path(tempdir:str,data_id:str,key:str,image_format='png'):
+    """Path of the thumbnail file of (data_id, key) in tempdir (one file per thumbnail, overwritten if rendered again)"""
+    name = hashlib.blake2b((data_id+'|'+key).encode('utf-8'),digest_size=12).hexdigest()
+    return tempdir+'/thumb_'+name+'.'+image_format
+
+def write_prerender(db,data_id:str,key:str,image_bytes:bytes,tempdir:str,image_format='png'):
+    """
+    Writes a thumbnail to tempdir and its path to the display property 'prerender' of data_id.
+
+    Output:
+        path: str
+    """
+    path = prerender_path(tempdir,data_id,key,image_format)
+    with open(path,'wb') as handle:
+        handle.write(image_bytes)
+    current_prerender = db.db_get(data_id,'prerender')
+    current_prerender = {} if current_prerender == None else dict(current_prerender)
+    current_prerender.update({key:path})
+    db.db_write(data_id,'prerender',current_prerender)
+    return path
+
+
+##############################################
+# benchmark
+##############################################
+
+def thumbnail_benchmark(shape=(512,512),points=1000,repeats=10,**params):
+    """
+    Compares the runtime of the thumbnails with the matplotlib figures of the databrowser viewers (figsize=(2,2),
+    savefig png, dpi=100) for a random image and a random spectrum.
+
+    Optional Arguments:
+        shape: (rows,columns) of the image (default: (512,512))
+        points: points of the spectrum (default: 1000)
+        repeats: the best time of repeats runs is reported
+        matplotlib: also time the matplotlib figures (default: True)
+        show: print the results (default: True)
+
+    Output:
+        times: dict {'image':s,'spectrum':s,'image_matplotlib':s,'spectrum_matplotlib':s}
+    """
+    if 'matplotlib' in params: with_matplotlib = params['matplotlib']
+    else: with_matplotlib = True
+    if 'show' in params: show = params['show']
+    else: show = True
+
+    rng = np.random.default_rng(0)
+    image = rng.normal(size=shape).cumsum(axis=1)
+    x = np.linspace(-1,1,points)
+    y = x**3 + 0.05*rng.normal(size=points)
+
+    def best_time(function):
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best,seconds)
+        return best
+
+    times = {}
+    times['image'] = best_time(lambda: encode(render_image(image),title='benchmark.sxm'))
+    times['spectrum'] = best_time(lambda: encode(render_spectrum(x,y),title='benchmark.dat'))
+
+    if with_matplotlib:
+        import matplotlib.pyplot as plt
+        def figure(plot):
+            fig,ax = plt.subplots(1,1,figsize=(2,2))
+            plot(ax)
+            plt.title('benchmark',fontsize=8)
+            fig.savefig(io.BytesIO(),format='png',dpi=100,bbox_inches='tight')
+            plt.close(fig)
+        times['image_matplotlib'] = best_time(lambda: figure(lambda ax: ax.imshow(image,aspect='equal',cmap='gray',origin='lower')))
+        times['spectrum_matplotlib'] = best_time(lambda: figure(lambda ax: ax.plot(x,y)))
+
+    if show:
+        print('thumbnail_benchmark ' + str(shape) + ', ' + str(points) + ' points: ' +
+              ', '.join(key + ' ' + '%.1f ms' % (seconds*1000) for key,seconds in times.items()))
+    return times
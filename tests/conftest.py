@@ -0,0 +1,8 @@
+import os
+import sys
+
+import matplotlib
+matplotlib.use('Agg')
+
+# the modules of nanonis_data_browser import each other by their module names
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'nanonis_data_browser'))
@@ -0,0 +1,124 @@
+import pytest
+
+from db_diff import directory_diff, diff_is_empty
+
+
+def d_meta(filename_full,file_size=100,file_modified_date=1.0,**kwargs):
+    d_meta = {'filename_full':filename_full,'filename_ending':filename_full.split('.')[-1],
+              'file_size':file_size,'file_modified_date':file_modified_date}
+    d_meta.update(kwargs)
+    return d_meta
+
+
+def names(d_metas):
+    return sorted(d_meta['filename_full'] for d_meta in d_metas)
+
+
+def test_directory_diff():
+    db_meta_old = [d_meta('a.sxm',100,1.0),d_meta('b.dat',200,2.0),d_meta('c.dat',300,3.0),d_meta('d.sxm',400,4.0)]
+    db_meta_new = [d_meta('a.sxm',100,1.0),          # unchanged
+                   d_meta('b.dat',250,5.0),          # modified in place
+                   d_meta('e.sxm',400,4.0),          # d.sxm renamed
+                   d_meta('f.dat',300,6.0)]          # added (c.dat deleted, other file_modified_date)
+    diff = directory_diff(db_meta_old,db_meta_new)
+
+    assert diff['unchanged'] == 1
+    assert names(diff['modified']) == ['b.dat']
+    assert diff['modified'][0]['file_size'] == 250
+    assert names(diff['deleted']) == ['c.dat']
+    assert names(diff['added']) == ['f.dat']
+    assert [(old['filename_full'],new['filename_full']) for old,new in diff['renamed']] == [('d.sxm','e.sxm')]
+    assert not diff_is_empty(diff)
+
+
+def test_unchanged_directory():
+    db_meta = [d_meta('a.sxm'),d_meta('b.dat')]
+    diff = directory_diff(db_meta,[dict(d) for d in db_meta])
+    assert diff_is_empty(diff)
+    assert diff['unchanged'] == 2
+
+
+def test_rename_needs_same_ending():
+    diff = directory_diff([d_meta('a.sxm',100,1.0)],[d_meta('a.dat',100,1.0)])
+    assert diff['renamed'] == []
+    assert names(diff['deleted']) == ['a.sxm']
+    assert names(diff['added']) == ['a.dat']
+
+
+def test_renames_with_the_same_signature_are_paired_once():
+    db_meta_old = [d_meta('a.sxm',100,1.0),d_meta('b.sxm',100,1.0)]
+    db_meta_new = [d_meta('x.sxm',100,1.0),d_meta('y.sxm',100,1.0),d_meta('z.sxm',100,1.0)]
+    diff = directory_diff(db_meta_old,db_meta_new)
+    renamed_new = [new['filename_full'] for _,new in diff['renamed']]
+    assert len(diff['renamed']) == 2
+    assert len(set(renamed_new)) == 2
+    assert names(diff['added']) == sorted(set(['x.sxm','y.sxm','z.sxm']) - set(renamed_new))
+    assert diff['deleted'] == []
+
+
+def test_content_hash_confirms_renames():
+    db_meta_old = [d_meta('a.sxm',100,1.0,file_hash='hash_a'),d_meta('b.sxm',200,2.0,file_hash='hash_b')]
+    db_meta_new = [d_meta('c.sxm',100,1.0,path='c.sxm'),d_meta('d.sxm',200,2.0,path='d.sxm')]
+    hashes = {'c.sxm':'hash_a','d.sxm':'other'}
+    diff = directory_diff(db_meta_old,db_meta_new,content_hash=lambda d: hashes[d['path']])
+    assert [(old['filename_full'],new['filename_full']) for old,new in diff['renamed']] == [('a.sxm','c.sxm')]
+    assert names(diff['deleted']) == ['b.sxm']
+    assert names(diff['added']) == ['d.sxm']
+
+
+class TestApplyDirectoryDiff:
+    """apply_directory_diff keeps the display properties of modified and renamed files"""
+
+    @pytest.fixture(autouse=True)
+    def import_db_manager(self):
+        # db_manager imports the clipboard of the viewers (Windows)
+        pytest.importorskip('win32clipboard')
+        import db_manager
+        self.db_manager = db_manager.db_manager
+
+    @pytest.fixture
+    def db(self,tmp_path):
+        db = self.db_manager()
+        db.directory = str(tmp_path)
+        db.create_super_properties()
+        for data_id,file_size,file_modified_date in [('a.sxm',100,1.0),('b.dat',200,2.0),('c.dat',300,3.0)]:
+            d = d_meta(data_id,file_size,file_modified_date)
+            write_data_id = True
+            for key in db.db_meta_keys:
+                db.db_write(data_id,key,d[key],write_data_id=write_data_id,write_display_property=True)
+                write_data_id = False
+        db.create_standard_display_properties()
+        db.db_write('a.sxm','liked',True)
+        db.db_write('a.sxm','tags',['keep'])
+        db.db_write('b.dat','tags',['modified'])
+        db.db_write('b.dat','prerender',{'a':'b.png'})
+        db.db_write('b.dat','sxm_ref','a.sxm')
+        return db
+
+    def test_modified_deleted_renamed(self,db):
+        db_meta_new = [d_meta('r.sxm',100,1.0),d_meta('b.dat',250,5.0),d_meta('n.dat',50,4.0)]
+        diff = db.directory_diff(db.db_meta_from_db_prop(db.db_prop),db_meta_new)
+        db.apply_directory_diff(db.directory,diff)
+
+        assert sorted(db.db_prop['data_prop'].keys()) == ['b.dat','n.dat','r.sxm']
+        # renamed: display properties and references move to the new data_id
+        assert db.db_get('r.sxm','liked') == True
+        assert db.db_get('r.sxm','tags') == ['keep']
+        assert db.db_get('r.sxm','filename_full') == 'r.sxm'
+        assert db.db_get('b.dat','sxm_ref') == 'r.sxm'
+        # modified: new file metadata, tags kept, prerendered images dropped
+        assert db.db_get('b.dat','file_size') == 250
+        assert db.db_get('b.dat','file_modified_date') == 5.0
+        assert db.db_get('b.dat','tags') == ['modified']
+        assert db.db_get('b.dat','prerender') == None
+        # indexes follow the diff
+        assert list(db.db_index.liked()) == ['r.sxm']
+        assert list(db.db_index.ids_with_tag('keep')) == ['r.sxm']
+        assert 'c.dat' not in db.db_time_index.sorted_ids()
+        assert db.db_get('super','data_id_time_sorted',super_prop=True) == ['b.dat','n.dat','r.sxm']
+
+    def test_empty_directory_keeps_files(self,db):
+        diff = db.directory_diff(db.db_meta_from_db_prop(db.db_prop),[])
+        assert diff_is_empty(diff)
+        diff = db.directory_diff(db.db_meta_from_db_prop(db.db_prop),[],partial=True)
+        assert names(diff['deleted']) == ['a.sxm','b.dat','c.dat']
@@ -0,0 +1,179 @@
+import os
+
+import pytest
+
+from db_journal import db_journal
+
+
+def journal_path(tmp_path):
+    return str(tmp_path/'_database.pickle.journal')
+
+
+def test_replay(tmp_path):
+    journal = db_journal(journal_path(tmp_path))
+    journal.reset('snapshot_1')
+    journal.append('data_prop','a.sxm','liked',True)
+    journal.append('data_prop','b.sxm','tags',['keep'])
+    journal.append('super',[],'db_save_time',2.0)
+    journal.append_delete('data_prop','c.dat')
+    journal.close()
+
+    db_prop = {'data_prop':{'a.sxm':{'liked':False},'c.dat':{}},'super':{'db_save_time':1.0}}
+    assert db_journal(journal_path(tmp_path)).replay(db_prop,'snapshot_1') == 4
+    assert db_prop == {'data_prop':{'a.sxm':{'liked':True},'b.sxm':{'tags':['keep']}},'super':{'db_save_time':2.0}}
+
+
+def test_other_snapshot_is_not_replayed(tmp_path):
+    journal = db_journal(journal_path(tmp_path))
+    journal.reset('snapshot_2')
+    journal.append('data_prop','a.sxm','liked',True)
+    journal.close()
+
+    db_prop = {'data_prop':{'a.sxm':{'liked':False}}}
+    assert db_journal(journal_path(tmp_path)).replay(db_prop,'snapshot_1') == 0
+    assert db_prop['data_prop']['a.sxm']['liked'] == False
+    assert db_journal(journal_path(tmp_path)).open_append('snapshot_1') == False
+
+
+def test_truncated_record_is_dropped(tmp_path):
+    journal = db_journal(journal_path(tmp_path))
+    journal.reset('snapshot_1')
+    journal.append('data_prop','a.sxm','liked',True)
+    journal.append('data_prop','a.sxm','tags',['lost'])
+    journal.close()
+    # crash while the last record was written
+    size = os.path.getsize(journal_path(tmp_path))
+    with open(journal_path(tmp_path),'r+b') as handle:
+        handle.truncate(size - 3)
+
+    db_prop = {'data_prop':{'a.sxm':{}}}
+    assert db_journal(journal_path(tmp_path)).replay(db_prop,'snapshot_1') == 1
+    assert db_prop['data_prop']['a.sxm'] == {'liked':True}
+
+    # the truncated record is removed when the journal is opened again, new records follow the last complete one
+    journal = db_journal(journal_path(tmp_path))
+    assert journal.open_append('snapshot_1')
+    journal.append('data_prop','a.sxm','tags',['new'])
+    journal.close()
+    db_prop = {'data_prop':{'a.sxm':{}}}
+    assert db_journal(journal_path(tmp_path)).replay(db_prop,'snapshot_1') == 2
+    assert db_prop['data_prop']['a.sxm'] == {'liked':True,'tags':['new']}
+
+
+def test_child_journal_is_replayed_on_its_parent(tmp_path):
+    # journal of snapshot_2 that was started before snapshot_2 reached the disk
+    journal = db_journal(str(tmp_path/'_database.pickle.journal.1'))
+    journal.reset('snapshot_2',parent_snapshot_id='snapshot_1')
+    journal.append('data_prop','a.sxm','liked',True)
+    journal.close()
+
+    header = db_journal(str(tmp_path/'_database.pickle.journal.1')).header()
+    assert header == {'snapshot':'snapshot_2','parent':'snapshot_1'}
+    db_prop = {'data_prop':{'a.sxm':{'liked':False}}}
+    assert db_journal(str(tmp_path/'_database.pickle.journal.1')).replay(db_prop,'snapshot_1') == 0
+    assert db_journal(str(tmp_path/'_database.pickle.journal.1')).replay(db_prop,'snapshot_1',child=True) == 1
+    assert db_prop['data_prop']['a.sxm']['liked'] == True
+
+
+class TestDatabase:
+    """Save and reload with the journal of db_manager (pickle backend)"""
+
+    @pytest.fixture(autouse=True)
+    def import_db_manager(self):
+        # db_manager imports the clipboard of the viewers (Windows)
+        pytest.importorskip('win32clipboard')
+        import db_manager
+        self.db_manager = db_manager.db_manager
+
+    def new_db(self,directory,data_ids):
+        db = self.db_manager()
+        db.directory = directory
+        db.create_super_properties()
+        for i,data_id in enumerate(data_ids):
+            db.db_write(data_id,'filename_full',data_id,write_data_id=True,write_display_property=True)
+            db.db_write(data_id,'file_modified_date',float(i),write_display_property=True)
+            db.db_write(data_id,'liked',False,write_display_property=True)
+        return db
+
+    def load(self,directory,database_file='_database.pickle'):
+        db = self.db_manager()
+        db.database_file = database_file
+        db_prop,_ = db.load_db(directory)
+        return db_prop
+
+    def test_write_save_reload(self,tmp_path):
+        directory = str(tmp_path)
+        db = self.new_db(directory,['a.sxm','b.dat'])
+        db.save_db(directory,overwrite=True,compact=True)
+        snapshot_size = os.path.getsize(directory+'\\'+db.database_file)
+
+        db.db_write('a.sxm','liked',True)
+        db.db_write('b.dat','tags',['keep'],write_display_property=True)
+        db.db_delete('b.dat')
+        db.db_write('a.sxm','tags',['new'],write_display_property=True)
+        db.save_db(directory)
+
+        # journal only save: the snapshot is not written again
+        assert os.path.getsize(directory+'\\'+db.database_file) == snapshot_size
+        db_prop = self.load(directory)
+        assert list(db_prop['data_prop'].keys()) == ['a.sxm']
+        assert db_prop['data_prop']['a.sxm']['liked'] == True
+        assert db_prop['data_prop']['a.sxm']['tags'] == ['new']
+        # derived super properties are not stored
+        assert 'data_id_time_sorted' not in db_prop['super']
+
+    def test_compaction(self,tmp_path):
+        directory = str(tmp_path)
+        db = self.new_db(directory,['a.sxm','b.dat'])
+        db.save_db(directory,overwrite=True,compact=True)
+        db.database_journal_max_size = 1
+        db.db_write('a.sxm','liked',True)
+        db.save_db(directory,overwrite=True)
+        # the journal exceeded database_journal_max_size, the changes are in the new snapshot
+        db.db_write('b.dat','liked',True)
+        db.save_db(directory,overwrite=True)
+
+        assert db.db_journal.size() < 1024
+        db_prop = self.load(directory)
+        assert db_prop['data_prop']['a.sxm']['liked'] == True
+        assert db_prop['data_prop']['b.dat']['liked'] == True
+
+    def test_crash_before_snapshot_is_written(self,tmp_path):
+        directory = str(tmp_path)
+        db = self.new_db(directory,['a.sxm'])
+        db.save_db(directory,overwrite=True,compact=True)
+        parent_file = db.database_file
+
+        def crash(database_path,db_export_group):
+            # db_write while the snapshot is written, then the snapshot never reaches the disk
+            db.db_write('a.sxm','liked',True)
+            raise OSError('disk full')
+        db.write_snapshot = crash
+        db.save_db(directory,overwrite=False,compact=True)
+
+        assert db.database_file == parent_file
+        # the journal of the new snapshot is replayed on top of its parent
+        assert self.load(directory,parent_file)['data_prop']['a.sxm']['liked'] == True
+
+    def test_crash_between_rename_and_journal_move(self,tmp_path,monkeypatch):
+        directory = str(tmp_path)
+        db = self.new_db(directory,['a.sxm'])
+        db.save_db(directory,overwrite=True,compact=True)
+        parent_file = db.database_file
+
+        # the snapshot is written under a new name, the process stops before its journal is moved
+        monkeypatch.setattr(db,'db_journal_move',lambda directory,parent_file,snapshot_id: None)
+        monkeypatch.setattr(db,'db_journal_attach',lambda directory: None)
+        write_snapshot = db.write_snapshot
+        def write_and_change(database_path,db_export_group):
+            db.db_write('a.sxm','liked',True)
+            return write_snapshot(database_path,db_export_group)
+        db.write_snapshot = write_and_change
+        db.save_db(directory,overwrite=False,compact=True)
+        db.db_write('a.sxm','tags',['late'],write_display_property=True)
+        db.db_journal.sync()
+
+        assert db.database_file != parent_file
+        db_prop = self.load(directory,db.database_file)
+        assert db_prop['data_prop']['a.sxm']['liked'] == True
+        assert db_prop['data_prop']['a.sxm']['tags'] == ['late']
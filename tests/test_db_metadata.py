@@ -0,0 +1,60 @@
+import pytest
+
+from db_metadata import db_metadata
+
+
+@pytest.fixture
+def metadata():
+    db_prop = {'data_prop':{
+        'a.sxm':{'filename_ending':'sxm','file_modified_date':3.0,'metadata':{'V':0.01,'temperature':5.0,'width':20.0}},
+        'b.sxm':{'filename_ending':'sxm','file_modified_date':1.0,'metadata':{'V':-0.5,'temperature':4.5,'width':50.0}},
+        'c.dat':{'filename_ending':'dat','file_modified_date':2.0,'metadata':{'V':0.03,'temperature':7.0}},
+        'd.dat':{'filename_ending':'dat','file_modified_date':4.0,'metadata':None},
+    }}
+    table = db_metadata()
+    table.rebuild(db_prop)
+    return table
+
+
+@pytest.mark.parametrize('expression,data_ids',[
+    ('abs(V) < 0.05',['a.sxm','c.dat']),
+    ('abs(V) < 0.05 and temperature < 6',['a.sxm']),
+    ("ending == 'sxm' and width >= 20",['a.sxm','b.sxm']),
+    ('not isnan(V) and -1 < V <= 0.01',['a.sxm','b.sxm']),
+    ('min(V,0) < 0 or temperature > 6',['b.sxm','c.dat']),
+])
+def test_filter(metadata,expression,data_ids):
+    assert metadata.query(expression) == data_ids
+
+
+@pytest.mark.parametrize('expression,data_ids',[
+    ('sort time',['b.sxm','c.dat','a.sxm','d.dat']),
+    ('sort time desc',['d.dat','a.sxm','c.dat','b.sxm']),
+    ('sort V desc',['c.dat','a.sxm','b.sxm','d.dat']),
+    ("ending == 'sxm' sort abs(V)",['a.sxm','b.sxm']),
+])
+def test_sort(metadata,expression,data_ids):
+    assert metadata.query(expression) == data_ids
+
+
+@pytest.mark.parametrize('expression',[
+    'ending < 5',
+    'abs(V,1) < 2',
+    'min(V) < 1',
+    "V + 'sxm' > 0",
+    '-ending == 1',
+    'unknown < 1',
+    'V <',
+    'V',
+    '__import__("os")',
+    'V < 1 sort',
+    'sort V sort time',
+])
+def test_invalid_expression(metadata,expression):
+    with pytest.raises(ValueError):
+        metadata.query(expression)
+
+
+def test_invalid_expression_names_node(metadata):
+    with pytest.raises(ValueError,match='ending < 5'):
+        metadata.query('V < 1 and ending < 5')
@@ -0,0 +1,155 @@
+import datetime
+
+import pytest
+
+from db_time_index import db_time_index
+
+
+def d_prop(filename_full,file_modified_date=None,acquisition_time=None):
+    d_prop = {'filename_full':filename_full,'filename_ending':filename_full.split('.')[-1],
+              'file_modified_date':file_modified_date}
+    if acquisition_time != None:
+        d_prop['metadata'] = {'acquisition_time':acquisition_time}
+    return d_prop
+
+
+def time_index(*d_props):
+    index = db_time_index()
+    index.rebuild({'data_prop':{d['filename_full']:d for d in d_props}})
+    return index
+
+
+def test_rebuild_orders_ties_by_data_id():
+    index = time_index(d_prop('c.sxm',2.0),d_prop('b.dat',1.0),d_prop('a.sxm',2.0),d_prop('d.dat',2.0))
+    assert index.sorted_ids() == ['b.dat','a.sxm','c.sxm','d.dat']
+    assert index.sorted_ids(descending=True) == ['d.dat','c.sxm','a.sxm','b.dat']
+    assert index.sorted_ids(filename_ending='sxm') == ['a.sxm','c.sxm']
+    assert index.sorted_ids(filename_ending='png') == []
+
+
+def test_acquisition_time_before_file_modified_date():
+    index = time_index(d_prop('a.sxm',1.0,acquisition_time=5.0),d_prop('b.sxm',3.0))
+    assert index.time('a.sxm') == 5.0
+    assert index.sorted_ids() == ['b.sxm','a.sxm']
+
+
+def test_files_without_time_are_not_indexed():
+    index = time_index(d_prop('a.sxm',1.0),d_prop('b.sxm'),d_prop('c.sxm',float('nan')),
+                       d_prop('d.sxm',float('inf')),d_prop('e.sxm','unknown'),d_prop('f.sxm',None,acquisition_time=float('nan')))
+    assert index.sorted_ids() == ['a.sxm']
+    for data_id in ['b.sxm','c.sxm','d.sxm','e.sxm','f.sxm']:
+        assert index.time(data_id) == None
+    # a valid time indexes the file again
+    index.update('c.sxm','file_modified_date',0.5)
+    assert index.sorted_ids() == ['c.sxm','a.sxm']
+
+
+def test_update_moves_data_ids():
+    index = time_index(d_prop('a.sxm',1.0),d_prop('b.dat',2.0),d_prop('c.sxm',3.0))
+    index.clear_changed()
+    index.update('a.sxm','metadata',{'acquisition_time':4.0})
+    assert index.sorted_ids() == ['b.dat','c.sxm','a.sxm']
+    # without acquisition time the file_modified_date is used again
+    index.update('a.sxm','metadata',None)
+    assert index.sorted_ids() == ['a.sxm','b.dat','c.sxm']
+    index.update('b.dat','filename_ending','sxm')
+    assert index.sorted_ids(filename_ending='sxm') == ['a.sxm','b.dat','c.sxm']
+    assert index.sorted_ids(filename_ending='dat') == []
+    # other display properties do not change the index
+    index.update('c.sxm','liked',True)
+    assert index.sorted_ids() == ['a.sxm','b.dat','c.sxm']
+    assert not index.changed_since_clear(['a.sxm','b.dat'])
+
+
+def test_changed_since_clear():
+    index = time_index(d_prop('a.sxm',1.0),d_prop('b.sxm',2.0))
+    assert index.changed_since_clear()
+    index.clear_changed()
+    assert not index.changed_since_clear()
+    index.update('a.sxm','liked',True)
+    index.update('b.sxm','file_modified_date',2.0)
+    assert not index.changed_since_clear()
+    index.update('a.sxm','file_modified_date',3.0)
+    assert index.changed_since_clear()
+    assert not index.changed_since_clear(['a.sxm'])
+    index.clear_changed()
+    index.remove('b.sxm')
+    assert index.changed_since_clear(['a.sxm'])
+
+
+def test_remove():
+    index = time_index(d_prop('a.sxm',1.0),d_prop('b.sxm',1.0),d_prop('c.dat',1.0))
+    index.remove('b.sxm')
+    index.remove('c.dat')
+    index.remove('missing.sxm')
+    assert index.sorted_ids() == ['a.sxm']
+    assert index.sorted_ids(filename_ending='sxm') == ['a.sxm']
+    assert index.sorted_ids(filename_ending='dat') == []
+    assert index.time('b.sxm') == None
+    # a removed data_id written again is indexed from its new properties only
+    index.update('b.sxm','filename_ending','sxm')
+    assert index.time('b.sxm') == None
+    index.update('b.sxm','file_modified_date',0.0)
+    assert index.sorted_ids() == ['b.sxm','a.sxm']
+
+
+def test_queries():
+    index = time_index(d_prop('a.sxm',10.0),d_prop('b.dat',15.0),d_prop('c.sxm',20.0),d_prop('d.sxm',20.0),d_prop('e.dat',30.0))
+    assert index.preceding(20.0) == 'd.sxm'
+    assert index.preceding(19.9,'sxm') == 'a.sxm'
+    assert index.preceding(9.9) == None
+    assert index.within(15.0,5.0) == ['a.sxm','b.dat','c.sxm','d.sxm']
+    assert index.within(15.0,5.0,'dat') == ['b.dat']
+    assert index.window(20.0,30.0) == ['c.sxm','d.sxm','e.dat']
+    assert index.window(21.0,29.0) == []
+    assert index.window(0.0,100.0,'png') == []
+
+
+class TestTimeQueries:
+    """preceding_scan, scans_within and files_in_window of db_manager"""
+
+    @pytest.fixture(autouse=True)
+    def import_db_manager(self):
+        # db_manager imports the clipboard of the viewers (Windows)
+        pytest.importorskip('win32clipboard')
+        import db_manager
+        self.db_manager = db_manager.db_manager
+
+    @pytest.fixture
+    def db(self,tmp_path):
+        db = self.db_manager()
+        db.directory = str(tmp_path)
+        db.create_super_properties()
+        for data_id,file_modified_date in [('a.sxm',10.0),('b.dat',15.0),('c.sxm',20.0),('d.sxm',20.0),
+                                           ('e.dat',20.0),('f.dat',None),('g.sxm',40.0)]:
+            db.db_write(data_id,'filename_full',data_id,write_data_id=True,write_display_property=True)
+            db.db_write(data_id,'filename_ending',data_id.split('.')[-1],write_display_property=True)
+            db.db_write(data_id,'file_modified_date',file_modified_date,write_display_property=True)
+        return db
+
+    def test_preceding_scan(self,db):
+        assert db.preceding_scan('b.dat') == 'a.sxm'
+        # scans with the same time are ordered by data_id, a spectrum takes the last of them
+        assert db.preceding_scan('c.sxm') == 'a.sxm'
+        assert db.preceding_scan('d.sxm') == 'c.sxm'
+        assert db.preceding_scan('e.dat') == 'd.sxm'
+        assert db.preceding_scan('a.sxm') == None
+        assert db.preceding_scan('f.dat') == None
+        db.db_delete('d.sxm')
+        assert db.preceding_scan('e.dat') == 'c.sxm'
+
+    def test_scans_within(self,db):
+        assert db.scans_within('b.dat',5.0) == ['a.sxm','c.sxm','d.sxm']
+        assert db.scans_within('c.sxm',0.0) == ['d.sxm']
+        assert db.scans_within('g.sxm',5.0) == []
+        assert db.scans_within('f.dat',100.0) == []
+
+    def test_files_in_window(self,db):
+        assert db.files_in_window(15.0,20.0) == ['b.dat','c.sxm','d.sxm','e.dat']
+        assert db.files_in_window(15.0,20.0,'dat') == ['b.dat','e.dat']
+        start = datetime.datetime.fromtimestamp(20.0)
+        end = datetime.datetime.fromtimestamp(40.0)
+        assert db.files_in_window(start,end,'sxm') == ['c.sxm','d.sxm','g.sxm']
+        db.db_write('g.sxm','file_modified_date',5.0)
+        assert db.files_in_window(start,end,'sxm') == ['c.sxm','d.sxm']
+        assert db.data_id_time_sorted() == ['e.dat','d.sxm','c.sxm','b.dat','a.sxm','g.sxm','f.dat']
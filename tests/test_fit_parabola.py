@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from spmpy_terry import fit_parabola
+
+
+@pytest.fixture
+def spectra():
+    rng = np.random.default_rng(0)
+    bias = np.tile(np.linspace(-1.5,0.5,60),(5,1)) + rng.uniform(-0.2,0.2,(5,1))
+    a = rng.uniform(-3,-1,(5,1))
+    vertex = rng.uniform(-0.5,0.2,(5,1))
+    df = a*(bias - vertex)**2 - 5 + rng.normal(0,0.05,bias.shape)
+    return bias,df
+
+
+def polyfit_reference(bias,df,points):
+    p_ref = []
+    err_ref = []
+    for i in range(len(bias)):
+        p,cov = np.polyfit(bias[i][points[i]],df[i][points[i]],2,cov=True)
+        p_ref.append(p)
+        err_ref.append(np.sqrt(np.abs(np.diag(cov))))
+    return np.array(p_ref),np.array(err_ref)
+
+
+def test_matches_polyfit(spectra):
+    bias,df = spectra
+    p_fit,err_p,df_fit,bias_max,_,df_max,_ = fit_parabola(bias,df)
+    p_ref,err_ref = polyfit_reference(bias,df,np.ones(bias.shape,dtype=bool))
+
+    np.testing.assert_allclose(p_fit,p_ref,rtol=1e-9,atol=1e-9)
+    np.testing.assert_allclose(err_p,err_ref,rtol=1e-7)
+    np.testing.assert_allclose(df_fit,[np.polyval(p,b) for p,b in zip(p_ref,bias)],rtol=1e-9,atol=1e-9)
+    np.testing.assert_allclose(bias_max,-p_ref[:,1]/(2*p_ref[:,0]),rtol=1e-9)
+    np.testing.assert_allclose(df_max,[np.polyval(p,v) for p,v in zip(p_ref,-p_ref[:,1]/(2*p_ref[:,0]))],rtol=1e-9)
+
+
+def test_mask_and_nan_match_polyfit_of_the_points(spectra):
+    bias,df = spectra
+    df = df.copy()
+    df[0,:5] = np.nan
+    df[3,40] = np.nan
+    mask = (bias >= -1.0) & (bias <= 0.3)
+    p_fit,err_p = fit_parabola(bias,df,mask=mask)[:2]
+    p_ref,err_ref = polyfit_reference(bias,df,mask & ~np.isnan(df))
+
+    np.testing.assert_allclose(p_fit,p_ref,rtol=1e-9,atol=1e-9)
+    np.testing.assert_allclose(err_p,err_ref,rtol=1e-7)
+
+
+def test_fit_min_and_single_spectrum(spectra):
+    bias,df = spectra
+    p_fit,err_p = fit_parabola(bias[2],df[2],single_spectrum=True,fitMin=[-1.2])[:2]
+    p_ref,err_ref = polyfit_reference(bias[2:3],df[2:3],bias[2:3] > -1.2)
+
+    np.testing.assert_allclose(p_fit,p_ref,rtol=1e-9,atol=1e-9)
+    np.testing.assert_allclose(err_p,err_ref,rtol=1e-7)